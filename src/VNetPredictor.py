@@ -1,17 +1,70 @@
 import json
+from contextlib import contextmanager
+from typing import List
 from overrides import overrides
 from collections import namedtuple
 
 from allennlp.common.util import JsonDict
-from allennlp.data import Instance
+from allennlp.data import DatasetReader, Instance
+from allennlp.models import Model
 from allennlp.predictors.predictor import Predictor
 from allennlp.data.tokenizers import Token
 
+from .quantization import quantize_vnet
 from .scripts.preprocess_duReader import process
 
 
+class _VNetInferencePredictor(Predictor):
+    """
+    Runs the model in inference mode: ``forward`` only returns ``best_span``, ``best_span_str``
+    and ``qids``, without loss, metrics, debug logging or logits.  The mode is only set during
+    the forward passes of the predictor, the model is left as it was for training or evaluation.
+
+    With ``top_k`` (an argument or the attribute) the outputs also have the ``top_k`` best spans
+    of the band search with their scores, and ``dump_line`` adds them as ``top_k_answers``.
+    With ``quantize`` the predictor runs a dynamic int8 copy of the model on the CPU, see
+    :func:`~src.quantization.quantize_vnet`.
+    """
+    def __init__(self,
+                 model: Model,
+                 dataset_reader: DatasetReader,
+                 top_k: int = None,
+                 quantize: bool = False) -> None:
+        if quantize:
+            model = quantize_vnet(model)
+        super().__init__(model, dataset_reader)
+        self.top_k = top_k
+
+    @contextmanager
+    def _inference_mode(self):
+        modes = self._model.inference, self._model.top_k
+        self._model.inference, self._model.top_k = True, self.top_k
+        try:
+            yield
+        finally:
+            self._model.inference, self._model.top_k = modes
+
+    @overrides
+    def predict_instance(self, instance: Instance) -> JsonDict:
+        with self._inference_mode():
+            return super().predict_instance(instance)
+
+    @overrides
+    def predict_batch_instance(self, instances: List[Instance]) -> List[JsonDict]:
+        with self._inference_mode():
+            return super().predict_batch_instance(instances)
+
+    @staticmethod
+    def _top_k_answers(outputs: JsonDict) -> List[JsonDict]:
+        return [{'answer': answer, 'score': score, 'passage_id': span[0], 'passage_score': passage_score}
+                for answer, score, span, passage_score in zip(outputs['top_k_span_str'],
+                                                              outputs['top_k_scores'],
+                                                              outputs['top_k_spans'],
+                                                              outputs['top_k_passage_scores'])]
+
+
 @Predictor.register('vnet_msmarco')
-class VNetPredictorMS(Predictor):
+class VNetPredictorMS(_VNetInferencePredictor):
     """
     Predictor for the :class:`~allennlp.models.bidaf.BidirectionalAttentionFlow` model.
     """
@@ -33,7 +86,7 @@ class VNetPredictorMS(Predictor):
                                                      passage_text,
                                                      qid)
 
-    def dump_line(self, outputs: JsonDict) -> str:  # pylint: disable=no-self-use
+    def dump_line(self, outputs: JsonDict) -> str:
         """
         If you don't want your outputs in JSON-lines format
         you can override this function to output them differently.
@@ -41,11 +94,13 @@ class VNetPredictorMS(Predictor):
         output = {}
         output['query_id'] = outputs['qids']
         output['answers'] = [outputs['best_span_str']]
+        if 'top_k_span_str' in outputs:
+            output['top_k_answers'] = self._top_k_answers(outputs)
         return json.dumps(output) + "\n"
 
 
 @Predictor.register('vnet_dureader')
-class VNetPredictorDu(Predictor):
+class VNetPredictorDu(_VNetInferencePredictor):
     """input:
     {
       "question_id": 186358,
@@ -128,4 +183,24 @@ class VNetPredictorDu(Predictor):
         output = {}
         output['question_id'] = outputs['qids']
         output['answers'] = [outputs['best_span_str']]
+        if 'top_k_span_str' in outputs:
+            output['top_k_answers'] = self._top_k_answers(outputs)
         return json.dumps(output, ensure_ascii=False) + "\n"
+
+
+@Predictor.register('vnet_msmarco_int8')
+class VNetPredictorMSInt8(VNetPredictorMS):
+    """
+    ``vnet_msmarco`` with the dynamic int8 model, for CPU inference.
+    """
+    def __init__(self, model: Model, dataset_reader: DatasetReader, top_k: int = None) -> None:
+        super().__init__(model, dataset_reader, top_k, quantize=True)
+
+
+@Predictor.register('vnet_dureader_int8')
+class VNetPredictorDuInt8(VNetPredictorDu):
+    """
+    ``vnet_dureader`` with the dynamic int8 model, for CPU inference.
+    """
+    def __init__(self, model: Model, dataset_reader: DatasetReader, top_k: int = None) -> None:
+        super().__init__(model, dataset_reader, top_k, quantize=True)
@@ -0,0 +1,182 @@
+# encoding: utf-8
+"""
+@file: column_json.py
+
+Incremental access to column-oriented JSON files such as the raw MS MARCO ``train_v2.1.json``::
+
+    {"query_id": {"0": 1185869, "1": 1185868, ...},
+     "query": {"0": "...", ...},
+     "passages": {"0": [...], ...},
+     "answers": {"0": [...], ...}}
+
+Instead of ``json.load``-ing the whole file, one pass over the bytes records where the value of
+every ``column[row]`` starts and ends. Rows are then read one at a time by seeking to their values,
+so memory stays bounded by the offsets index, not by the size of the file.  The index is cached
+next to the file and reused as long as the file does not change.
+"""
+import array
+import json
+import logging
+import os
+import pickle
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.column_index'
+
+# a complete string, a structural character, or the opening quote of a string cut by the chunk end
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]:,]|"', re.S)
+
+
+def scan_columns(file_path: str, chunk_size: int = 1 << 24) -> Dict[str, Tuple[List[str], array.array]]:
+    """
+    Finds the byte range of every value of every top-level object of the JSON object in
+    ``file_path``.
+
+    Returns
+    -------
+    ``{column: (keys, offsets)}``, where the value of ``column[keys[i]]`` is the bytes
+    ``offsets[2 * i]:offsets[2 * i + 1]`` of the file.
+    """
+    columns: Dict[str, Tuple[List[str], array.array]] = {}
+    depth = 0
+    column = None
+    keys: List[str] = []
+    offsets = array.array('q')
+    expect_key = True
+    in_column = False
+    value_start = None
+    base = 0
+    carry = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buffer = carry + chunk
+            carry = b''
+            for match in _TOKEN.finditer(buffer):
+                token = match.group()
+                if token == b'"':
+                    # an unterminated string, continue from it with the next chunk
+                    carry = buffer[match.start():]
+                    break
+                first = token[:1]
+                if first == b'"':
+                    if depth == 1 and expect_key:
+                        column = json.loads(token.decode('utf-8'))
+                        expect_key = False
+                    elif depth == 2 and in_column and expect_key:
+                        keys.append(json.loads(token.decode('utf-8')))
+                        expect_key = False
+                elif first in b'{[':
+                    depth += 1
+                    if depth == 2:
+                        # only objects are columns
+                        in_column = first == b'{'
+                        keys = []
+                        offsets = array.array('q')
+                        expect_key = True
+                elif first in b'}]':
+                    if depth == 2 and in_column:
+                        if value_start is not None:
+                            offsets.extend((value_start, base + match.start()))
+                            value_start = None
+                        columns[column] = (keys, offsets)
+                        in_column = False
+                    depth -= 1
+                elif first == b':':
+                    if depth == 2 and in_column:
+                        value_start = base + match.end()
+                elif first == b',':
+                    if depth == 2 and in_column:
+                        offsets.extend((value_start, base + match.start()))
+                        value_start = None
+                        expect_key = True
+                    elif depth == 1:
+                        expect_key = True
+            if not chunk:
+                break
+            consumed = len(buffer) - len(carry)
+            base += consumed
+    return columns
+
+
+class ColumnJsonIndex:
+    """
+    Row-wise reader of a column-oriented JSON file.
+
+    Parameters
+    ----------
+    file_path : ``str``
+        The JSON file.
+    key_column : ``str``
+        The column whose keys define the rows and their order, like iterating ``source[key_column]``
+        after ``json.load``.
+    cache : ``bool``, optional (default=True)
+        Whether to save the offsets index to ``file_path + '.column_index'`` and reuse it.
+    """
+
+    def __init__(self, file_path: str, key_column: str, cache: bool = True) -> None:
+        self.file_path = file_path
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime)
+        index_path = file_path + INDEX_SUFFIX
+        index = None
+        if cache and os.path.isfile(index_path):
+            with open(index_path, 'rb') as f:
+                index = pickle.load(f)
+            if index['signature'] != signature or index['key_column'] != key_column:
+                index = None
+        if index is None:
+            logger.info("Indexing columns of %s", file_path)
+            index = self._build_index(scan_columns(file_path), key_column)
+            index['signature'] = signature
+            if cache:
+                with open(index_path, 'wb') as f:
+                    pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.keys: List[str] = index['keys']
+        self.key_column = key_column
+        self._offsets: Dict[str, array.array] = index['offsets']
+        # only set for columns whose keys are not in the order of ``keys``
+        self._rows: Dict[str, Dict[str, int]] = index['rows']
+        self._file = open(file_path, 'rb')
+
+    @staticmethod
+    def _build_index(columns, key_column):
+        keys = columns[key_column][0]
+        offsets = {}
+        rows = {}
+        for column, (column_keys, column_offsets) in columns.items():
+            offsets[column] = column_offsets
+            if column_keys != keys:
+                rows[column] = {key: row for row, key in enumerate(column_keys)}
+        return {'key_column': key_column, 'keys': keys, 'offsets': offsets, 'rows': rows}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._offsets
+
+    def get(self, column: str, row: int) -> Any:
+        """
+        The value of ``column[keys[row]]``; raises ``KeyError`` if the column has no such key.
+        """
+        if column in self._rows:
+            row = self._rows[column][self.keys[row]]
+        offsets = self._offsets[column]
+        start, end = offsets[2 * row], offsets[2 * row + 1]
+        self._file.seek(start)
+        return json.loads(self._file.read(end - start).decode('utf-8'))
+
+    def rows(self, columns: Iterable[str]) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Yields ``(key, [column[key] for column in columns])`` in the order of the key column.
+        """
+        columns = list(columns)
+        for row, key in enumerate(self.keys):
+            yield key, [self.get(column, row) for column in columns]
+
+    def close(self) -> None:
+        self._file.close()
@@ -1,18 +1,24 @@
 import json
 import logging
 import pickle
-from collections import Counter
 from typing import Dict, List, Tuple, Optional, Iterable, Any
 from overrides import overrides
 from tqdm import tqdm as tqdm
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.instance import Instance
 from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenIndexer
+from allennlp.data.vocabulary import Vocabulary
 from allennlp.data.tokenizers import Token, Tokenizer, WordTokenizer
 from allennlp.data.fields import Field, TextField, IndexField, \
     MetadataField, ListField
 
+from .indexed_fields import TokenIdMapper, json_obj_to_indexed_instance
+from .paragraph_selection import ParagraphSelector
+from .token_id_cache import TokenIdCache, TokenIdCacheWriter, cache_path
+from .scripts.sharding import shard_lines
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,6 +42,16 @@ class DuReaderMultiPassageReader(DatasetReader):
         if specified, we will cut the passage if the length of passage exceeds this limit.
     max_q_len : ``int``, optional (default=50)
         if specified, we will cut the question if the length of passage exceeds this limit.
+    vocabulary_directory : ``str``, optional (default=None)
+        if specified, the instances are built from token ids mapped once per distinct token with
+        the vocabulary saved in this directory, which must be the vocabulary of the model (the
+        ``directory_path`` of the ``vocabulary`` section of the config).  Their fields give the
+        same tensors as the ``TextField`` and ``ListField`` ones, see :mod:`indexed_fields`.
+    cache_token_ids : ``bool``, optional (default=False)
+        if true (requires ``vocabulary_directory``), the token ids of the instances of a complete
+        pass over a file are saved in ``<file>.ids`` and the next passes read them from there
+        instead of the file.  The cache is rebuilt when the vocabulary, the token indexers, the
+        limits or the file change, see :mod:`token_id_cache`.
     """
 
     def __init__(self,
@@ -46,7 +62,9 @@ class DuReaderMultiPassageReader(DatasetReader):
                  tokenizer: Tokenizer = None,
                  token_indexers: Dict[str, TokenIndexer] = None,
                  lazy: bool = False,
-                 max_samples: int = -1) -> None:
+                 max_samples: int = -1,
+                 vocabulary_directory: str = None,
+                 cache_token_ids: bool = False) -> None:
         super().__init__(lazy)
         self.max_p_num = max_p_num
         self.max_p_len = max_p_len
@@ -54,16 +72,42 @@ class DuReaderMultiPassageReader(DatasetReader):
         self._tokenizer = tokenizer or WordTokenizer()
         self._token_indexers = token_indexers or {'tokens': SingleIdTokenIndexer()}
         self.max_samples = max_samples
+        self._token_mapper = None
+        if vocabulary_directory is not None:
+            self._token_mapper = TokenIdMapper(Vocabulary.from_files(vocabulary_directory), self._token_indexers)
+        if cache_token_ids and self._token_mapper is None:
+            raise ConfigurationError("cache_token_ids requires a vocabulary_directory")
+        self.cache_token_ids = cache_token_ids
+        self._paragraph_selector = ParagraphSelector()
 
     @overrides
     def _read(self, file_path: str) -> Iterable[Instance]:
+        writer = None
+        if self.cache_token_ids:
+            limits = {'max_p_num': self.max_p_num, 'max_p_len': self.max_p_len,
+                      'max_q_len': self.max_q_len, 'max_samples': self.max_samples}
+            path = cache_path(file_path, self._token_mapper, **limits)
+            if TokenIdCache.exists(path):
+                logger.info("load token ids from %s", path)
+                yield from TokenIdCache(path, self._token_mapper)
+                return
+            writer = TokenIdCacheWriter(path, self._token_mapper, **limits)
         if 'train' in file_path:
             dataset = self._load_dataset(file_path, True)
         else:
             dataset = self._load_dataset(file_path)
-        for sample in dataset:
-            json_obj = self._dureader_sample_to_json_obj(sample)
-            yield self._json_blob_to_instance(json_obj)
+        try:
+            for sample in dataset:
+                json_obj = self._dureader_sample_to_json_obj(sample)
+                if writer is not None:
+                    yield writer.add(json_obj)
+                else:
+                    yield self._json_blob_to_instance(json_obj)
+            if writer is not None:
+                writer.save()
+        finally:
+            if writer is not None:
+                writer.close()
 
     @staticmethod
     def segmented_text_to_tuples(tokens):
@@ -105,6 +149,9 @@ class DuReaderMultiPassageReader(DatasetReader):
         return json_obj
 
     def _json_blob_to_instance(self, json_obj) -> Instance:
+        if self._token_mapper is not None:
+            return json_obj_to_indexed_instance(self._token_mapper, json_obj,
+                                                self.max_q_len, self.max_p_len, self.max_p_num)
         question_tokens = [Token(text=text, idx=idx) for text, idx
                            in json_obj['question_tokens']][:self.max_q_len]
         passages_tokens = [[Token(text=text, idx=idx) for text, idx in passage_tokens][:self.max_p_len]
@@ -127,8 +174,7 @@ class DuReaderMultiPassageReader(DatasetReader):
         Args:
             data_path: the data file to load
         """
-        fin = open(data_path)
-        for lidx, line in tqdm(enumerate(fin)):
+        for lidx, line in tqdm(enumerate(shard_lines(data_path))):
             if self.max_samples >= 0 and lidx > self.max_samples:
                 break
             sample = json.loads(line.strip())
@@ -144,6 +190,12 @@ class DuReaderMultiPassageReader(DatasetReader):
             sample['question_tokens'] = sample['segmented_question']
 
             sample['passages'] = []
+            if not train:
+                # the paragraph with the best recall of the question, computed once per question
+                key = None if 'question_id' not in sample else (data_path, sample['question_id'])
+                selection = self._paragraph_selector.select(key, sample['segmented_question'],
+                                                            [doc['segmented_paragraphs']
+                                                             for doc in sample['documents']])
             for d_idx, doc in enumerate(sample['documents']):
                 if train:
                     most_related_para = doc['most_related_para']
@@ -152,23 +204,11 @@ class DuReaderMultiPassageReader(DatasetReader):
                          'is_selected': doc['is_selected']}
                     )
                 else:
-                    para_infos = []
-                    for para_tokens in doc['segmented_paragraphs']:
-                        question_tokens = sample['segmented_question']
-                        common_with_question = Counter(para_tokens) & Counter(question_tokens)
-                        correct_preds = sum(common_with_question.values())
-                        if correct_preds == 0:
-                            recall_wrt_question = 0
-                        else:
-                            recall_wrt_question = float(correct_preds) / len(question_tokens)
-                        para_infos.append((para_tokens, recall_wrt_question, len(para_tokens)))
-                    para_infos.sort(key=lambda x: (-x[1], x[2]))
                     fake_passage_tokens = []
-                    for para_info in para_infos[:1]:
-                        fake_passage_tokens += para_info[0]
+                    if selection[d_idx] >= 0:
+                        fake_passage_tokens += doc['segmented_paragraphs'][selection[d_idx]]
                     sample['passages'].append({'passage_tokens': fake_passage_tokens})
             yield sample
-        fin.close()
 
     def make_MSMARCO_MultiPassage_instance(self,
                                            question_tokens: List[Token],
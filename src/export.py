@@ -0,0 +1,200 @@
+# encoding: utf-8
+"""
+@file: export.py
+
+Exports the numeric core of a trained VNet (embedding, highway, phrase layer, attention,
+modeling layer, pointer net, content, verification and span decoding) as a TorchScript module,
+which :mod:`src.exported_predictor` runs without AllenNLP::
+
+    python -m src.export model.tar.gz vnet.pt --top_k 5
+
+The core is traced through ``VNet.forward`` in inference mode, so the Python of the model (the
+glyph checks, the decoding switch, the metadata) runs once at export time and is not in the
+graph.  The masked ``PytorchSeq2SeqWrapper`` encoders sort the batch with the number of valid
+sequences as a Python int, which a trace would fix; :class:`_PackedSeq2Seq` runs the same LSTMs
+with the lengths as a tensor.  The passages are padded to ``max_passage_len`` tokens and
+``max_num_passages`` passages and the passage characters to ``max_num_character``, as in
+``forward`` without ``dynamic_padding``; the batch size, the question length and the number of
+characters of the question tokens can change.
+
+The module takes ``(question_tokens, question_characters, passages_tokens, passages_characters)``
+(``(batch_size, question_length)``, ``(batch_size, question_length, num_question_characters)``,
+``(batch_size, max_num_passages, max_passage_len)`` and
+``(batch_size, max_num_passages, max_passage_len, max_num_character)`` vocabulary ids, 0 for
+padding) and returns the ``top_k_spans``, ``top_k_scores`` and ``top_k_passage_scores`` of
+``VNet.forward``.  The vocabulary and the settings of the token indexers go with it in
+``vnet.json`` (``torch.jit.load(path, _extra_files=...)``); the answer strings are built in Python.
+"""
+import argparse
+import copy
+import json
+import logging
+import warnings
+from typing import Any, Dict, Tuple
+
+import torch
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.util import import_submodules
+from allennlp.data import DatasetReader
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.modules.seq2seq_encoders import PytorchSeq2SeqWrapper
+
+from .vnet import VNet
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = 'vnet.json'
+
+
+class _PackedSeq2Seq(torch.nn.Module):
+    """
+    The outputs of ``PytorchSeq2SeqWrapper(module)`` (zeros for the padding and for the sequences
+    without tokens), computed with ``enforce_sorted=False`` packing so that the batch can be traced.
+    """
+    def __init__(self, module: torch.nn.Module) -> None:
+        super().__init__()
+        self._module = module
+
+    def forward(self, inputs: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        if mask is None:
+            return self._module(inputs)[0]
+        lengths = mask.long().sum(-1).clamp(min=1)
+        packed_inputs = pack_padded_sequence(inputs, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        outputs, _ = pad_packed_sequence(self._module(packed_inputs)[0],
+                                         batch_first=True,
+                                         total_length=inputs.size(1))
+        return outputs * mask.unsqueeze(-1).to(outputs.dtype)
+
+
+class VNetCore(torch.nn.Module):
+    """
+    A copy of ``model`` in inference mode with ``top_k`` spans, called with the tensors of the
+    text fields instead of the field dictionaries.  This is the module :func:`export_vnet` traces.
+    """
+    def __init__(self, model: VNet, top_k: int = 1) -> None:
+        super().__init__()
+        model = copy.deepcopy(model).eval()
+        for name in ('_phrase_layer', '_modeling_layer'):
+            layer = getattr(model, name)
+            if isinstance(layer, PytorchSeq2SeqWrapper) and not layer.stateful:
+                setattr(model, name, _PackedSeq2Seq(layer._module))  # pylint: disable=protected-access
+        model.inference = True
+        model.top_k = top_k
+        self.model = model
+        token_embedders = getattr(model._text_field_embedder, '_token_embedders', {})  # pylint: disable=protected-access
+        if set(token_embedders) - {'tokens', 'token_characters'}:
+            raise ConfigurationError("only 'tokens' and 'token_characters' embedders can be exported, "
+                                     "not %s" % sorted(token_embedders))
+        self.use_characters = 'token_characters' in token_embedders
+
+    def _text_field(self, tokens: torch.Tensor, characters: torch.Tensor) -> Dict[str, torch.Tensor]:
+        if self.use_characters:
+            return {'tokens': tokens, 'token_characters': characters}
+        return {'tokens': tokens}
+
+    def forward(self,  # pylint: disable=arguments-differ
+                question_tokens: torch.Tensor,
+                question_characters: torch.Tensor,
+                passages_tokens: torch.Tensor,
+                passages_characters: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        output_dict = self.model(self._text_field(question_tokens, question_characters),
+                                 self._text_field(passages_tokens, passages_characters))
+        return output_dict['top_k_spans'], output_dict['top_k_scores'], output_dict['top_k_passage_scores']
+
+
+def example_inputs(model: VNet,
+                   batch_size: int,
+                   question_length: int,
+                   num_question_characters: int,
+                   device: torch.device = torch.device('cpu')) -> Tuple[torch.Tensor, ...]:
+    """
+    Inputs of :class:`VNetCore` of the exported shapes.  The first sample has one passage shorter
+    than the others and, with more than one passage, an empty one, so that the trace sees masked
+    tokens and passages.
+    """
+    num_passages, passage_length = model.max_num_passages, model.max_passage_len
+    question_tokens = torch.ones(batch_size, question_length, dtype=torch.long, device=device)
+    question_tokens[0, question_length // 2 + 1:] = 0
+    passages_tokens = torch.ones(batch_size, num_passages, passage_length, dtype=torch.long, device=device)
+    passages_tokens[0, 0, passage_length // 2 + 1:] = 0
+    if num_passages > 1:
+        passages_tokens[0, -1] = 0
+    question_characters = torch.ones(num_question_characters, dtype=torch.long, device=device)
+    passage_characters = torch.ones(model.max_num_character, dtype=torch.long, device=device)
+    return (question_tokens,
+            question_tokens.unsqueeze(-1) * question_characters,
+            passages_tokens,
+            passages_tokens.unsqueeze(-1) * passage_characters)
+
+
+def export_config(model: VNet, dataset_reader: DatasetReader, top_k: int = 1) -> Dict[str, Any]:
+    """
+    The settings ``src.exported_predictor`` needs to index the tokens and pad the inputs like the
+    ``dataset_reader`` and the model, and the vocabulary of the token indexers.
+    """
+    config: Dict[str, Any] = {'num_passages': model.max_num_passages,
+                              'passage_length': model.max_passage_len,
+                              'num_characters': model.max_num_character,
+                              'top_k': top_k}
+    for name, indexer in dataset_reader._token_indexers.items():  # pylint: disable=protected-access
+        if isinstance(indexer, SingleIdTokenIndexer) and name == 'tokens':
+            config['lowercase_tokens'] = indexer.lowercase_tokens
+            namespace = indexer.namespace
+        elif isinstance(indexer, TokenCharactersIndexer) and name == 'token_characters':
+            tokenizer = indexer._character_tokenizer  # pylint: disable=protected-access
+            if tokenizer._byte_encoding is not None:  # pylint: disable=protected-access
+                raise ConfigurationError('byte encoded characters can not be exported')
+            config['lowercase_characters'] = tokenizer._lowercase_characters  # pylint: disable=protected-access
+            config['min_padding_length'] = indexer._min_padding_length  # pylint: disable=protected-access
+            namespace = indexer._namespace  # pylint: disable=protected-access
+        else:
+            raise ConfigurationError("can not export the token indexer %s of type %s"
+                                     % (name, type(indexer).__name__))
+        vocabulary = model.vocab.get_index_to_token_vocabulary(namespace)
+        config[name] = [vocabulary[index] for index in range(len(vocabulary))]
+    return config
+
+
+def export_vnet(model: VNet,
+                dataset_reader: DatasetReader,
+                path: str,
+                top_k: int = 1,
+                device: torch.device = torch.device('cpu')) -> torch.jit.ScriptModule:
+    """
+    Traces :class:`VNetCore` and saves it with its ``vnet.json`` in ``path``.  The trace is checked
+    against the model with another batch size, question length and number of question characters.
+    """
+    core = VNetCore(model, top_k).to(device)
+    check_inputs = [example_inputs(model, 3, 7, model.max_num_character + 4, device)]
+    with torch.no_grad(), warnings.catch_warnings():
+        # the Python values the trace fixes are the padded sizes; ``check_inputs`` compares the rest
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        traced = torch.jit.trace(core, example_inputs(model, 2, 12, model.max_num_character, device),
+                                check_inputs=check_inputs)
+    config = export_config(model, dataset_reader, top_k)
+    torch.jit.save(traced, path, _extra_files={CONFIG_FILE: json.dumps(config, ensure_ascii=False)})
+    logger.info('exported the VNet core to %s', path)
+    return traced
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the numeric core of a VNet archive with TorchScript.')
+    parser.add_argument('archive_file', help='the model.tar.gz of a trained model')
+    parser.add_argument('output_file', help='where to save the TorchScript module')
+    parser.add_argument('--top_k', type=int, default=1, help='the number of spans of every sample')
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+
+    from allennlp.models.archival import load_archive
+    import_submodules('src')
+    archive = load_archive(args.archive_file, cuda_device=args.cuda_device)
+    dataset_reader = DatasetReader.from_params(archive.config['dataset_reader'].duplicate())
+    device = torch.device('cuda', args.cuda_device) if args.cuda_device >= 0 else torch.device('cpu')
+    export_vnet(archive.model, dataset_reader, args.output_file, args.top_k, device)
+
+
+if __name__ == '__main__':
+    main()
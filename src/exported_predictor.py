@@ -0,0 +1,184 @@
+# encoding: utf-8
+"""
+@file: exported_predictor.py
+
+Predicts the answers of preprocessed samples with a VNet exported by :mod:`src.export`, using
+only PyTorch: the tokens are indexed with the vocabulary saved in the module, the TorchScript
+module runs the network and the answer strings are cut from the passages here.  Run as a
+script, it imports neither AllenNLP nor the ``src`` package, so it starts in about the time it
+takes to load the module::
+
+    python src/exported_predictor.py vnet.pt dev.json.instances > predictions.json
+
+The input lines are the samples of the ``.instances`` files (``qid``, ``question_tokens``,
+``passages_tokens`` and ``passages_texts``), as for the ``vnet_dureader`` predictor, and the
+output lines are those of ``vnet_dureader``.  Passages longer than the ``max_passage_len`` of the
+model are cut; the readers already cut them to ``max_p_len``.  As in the model, the characters of
+the passage tokens are cut and padded to ``max_num_character`` and those of the question tokens
+are padded to the longest question token of the batch, at least the ``min_padding_length`` of the
+character indexer.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterable, Iterator, List
+
+import torch
+
+CONFIG_FILE = 'vnet.json'
+# the padding and OOV tokens of AllenNLP vocabularies
+PADDING_INDEX = 0
+OOV_TOKEN = '@@UNKNOWN@@'
+# the passage ``vnet_dureader`` uses for samples without passages
+EMPTY_PASSAGE = '竟然没有文章'
+
+
+def span_string(metadata: Dict[str, Any], passage_id: int, start_idx: int, end_idx: int) -> str:
+    """ ``VNet.span_string``: the text of the token span ``[start_idx, end_idx]`` of a passage. """
+    if passage_id >= len(metadata['passages_offsets']):
+        # a padding passage of a sample with fewer than ``max_num_passages`` passages
+        return ''
+    offsets = metadata['passages_offsets'][passage_id]
+    start_idx = max(0, min(start_idx, len(offsets) - 1))
+    end_idx = max(0, min(end_idx, len(offsets) - 1))
+    return metadata['original_passages'][passage_id][offsets[start_idx][0]:offsets[end_idx][1]]
+
+
+class ExportedVNetPredictor:
+    """
+    Parameters
+    ----------
+    path : ``str``
+        The file written by ``src.export``.
+    device : ``str``, optional (default = 'cpu')
+    """
+
+    def __init__(self, path: str, device: str = 'cpu') -> None:
+        extra_files = {CONFIG_FILE: ''}
+        self.device = torch.device(device)
+        self.module = torch.jit.load(path, map_location=self.device, _extra_files=extra_files)
+        self.config = json.loads(extra_files[CONFIG_FILE])
+        self.top_k = self.config['top_k']
+        self._token_ids = {token: index for index, token in enumerate(self.config['tokens'])}
+        self._character_ids = {character: index
+                               for index, character in enumerate(self.config.get('token_characters', ()))}
+        self._characters: Dict[str, List[int]] = {}
+
+    def _token_id(self, text: str) -> int:
+        if self.config['lowercase_tokens']:
+            text = text.lower()
+        token_id = self._token_ids.get(text)
+        return self._token_ids.get(OOV_TOKEN, 1) if token_id is None else token_id
+
+    def _token_characters(self, text: str) -> List[int]:
+        characters = self._characters.get(text)
+        if characters is None:
+            oov = self._character_ids.get(OOV_TOKEN, 1)
+            lowered = text.lower() if self.config.get('lowercase_characters') else text
+            characters = [self._character_ids.get(character, oov) for character in lowered]
+            self._characters[text] = characters
+        return characters
+
+    def _metadata(self, json_dict: Dict[str, Any]) -> Dict[str, Any]:
+        passages_texts = json_dict['passages_texts']
+        passages_tokens = json_dict['passages_tokens']
+        if not passages_texts:
+            passages_texts, passages_tokens = [EMPTY_PASSAGE], [[[EMPTY_PASSAGE, 0]]]
+        passages_tokens = [passage_tokens[:self.config['passage_length']]
+                           for passage_tokens in passages_tokens[:self.config['num_passages']]]
+        return {'qid': json_dict['qid'],
+                'original_passages': passages_texts,
+                'passages_offsets': [[(idx, idx + len(text)) for text, idx in passage_tokens]
+                                     for passage_tokens in passages_tokens],
+                'question_tokens': [text for text, _ in json_dict['question_tokens']],
+                'passage_tokens': [[text for text, _ in passage_tokens] for passage_tokens in passages_tokens]}
+
+    def _tensors(self, batch: List[Dict[str, Any]]) -> List[torch.Tensor]:
+        num_passages, passage_length = self.config['num_passages'], self.config['passage_length']
+        num_characters = self.config['num_characters']
+        question_length = max(len(metadata['question_tokens']) for metadata in batch)
+        # the question characters are not cut by the model, only padded by the indexer
+        question_characters_length = max([self.config.get('min_padding_length', 0)] +
+                                         [len(text) for metadata in batch for text in metadata['question_tokens']])
+        question_tokens = torch.full((len(batch), question_length), PADDING_INDEX, dtype=torch.long)
+        question_characters = torch.full((len(batch), question_length, question_characters_length), PADDING_INDEX,
+                                         dtype=torch.long)
+        passages_tokens = torch.full((len(batch), num_passages, passage_length), PADDING_INDEX, dtype=torch.long)
+        passages_characters = torch.full((len(batch), num_passages, passage_length, num_characters),
+                                         PADDING_INDEX, dtype=torch.long)
+        for i, metadata in enumerate(batch):
+            sequences = [(question_tokens[i], question_characters[i], metadata['question_tokens'])]
+            sequences.extend((passages_tokens[i, p], passages_characters[i, p], texts)
+                             for p, texts in enumerate(metadata['passage_tokens']))
+            for tokens, characters, texts in sequences:
+                tokens[:len(texts)] = torch.tensor([self._token_id(text) for text in texts], dtype=torch.long)
+                for position, text in enumerate(texts):
+                    token_characters = self._token_characters(text)[:characters.size(-1)]
+                    characters[position, :len(token_characters)] = torch.tensor(token_characters, dtype=torch.long)
+        return [tensor.to(self.device) for tensor in (question_tokens, question_characters,
+                                                      passages_tokens, passages_characters)]
+
+    def predict_batch_json(self, inputs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        batch = [self._metadata(json_dict) for json_dict in inputs]
+        with torch.no_grad():
+            spans, scores, passage_scores = self.module(*self._tensors(batch))
+        outputs = []
+        for metadata, sample_spans, sample_scores, sample_passage_scores in zip(batch, spans.tolist(),
+                                                                                 scores.tolist(),
+                                                                                 passage_scores.tolist()):
+            output = {'qids': metadata['qid'],
+                      'best_span': sample_spans[0],
+                      'best_span_str': span_string(metadata, *sample_spans[0])}
+            if self.top_k > 1:
+                output['top_k_spans'] = sample_spans
+                output['top_k_scores'] = sample_scores
+                output['top_k_passage_scores'] = sample_passage_scores
+                output['top_k_span_str'] = [span_string(metadata, *span) for span in sample_spans]
+            outputs.append(output)
+        return outputs
+
+    def predict_json(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return self.predict_batch_json([inputs])[0]
+
+    def predict_lines(self, lines: Iterable[str], batch_size: int = 32) -> Iterator[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        for line in lines:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield from self.predict_batch_json(batch)
+                batch = []
+        if batch:
+            yield from self.predict_batch_json(batch)
+
+    @staticmethod
+    def dump_line(outputs: Dict[str, Any]) -> str:
+        """ The output line of ``vnet_dureader``. """
+        output = {'question_id': outputs['qids'], 'answers': [outputs['best_span_str']]}
+        if 'top_k_span_str' in outputs:
+            output['top_k_answers'] = [{'answer': answer, 'score': score, 'passage_id': span[0],
+                                        'passage_score': passage_score}
+                                       for answer, score, span, passage_score in zip(outputs['top_k_span_str'],
+                                                                                     outputs['top_k_scores'],
+                                                                                     outputs['top_k_spans'],
+                                                                                     outputs['top_k_passage_scores'])]
+        return json.dumps(output, ensure_ascii=False) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict with a VNet exported by src.export.')
+    parser.add_argument('model_file', help='the TorchScript module written by src.export')
+    parser.add_argument('input_file', nargs='?', default=None, help='JSON lines, default: stdin')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    args = parser.parse_args()
+
+    predictor = ExportedVNetPredictor(args.model_file,
+                                      'cuda:%d' % args.cuda_device if args.cuda_device >= 0 else 'cpu')
+    lines = open(args.input_file) if args.input_file else sys.stdin
+    for outputs in predictor.predict_lines(lines, args.batch_size):
+        sys.stdout.write(predictor.dump_line(outputs))
+
+
+if __name__ == '__main__':
+    main()
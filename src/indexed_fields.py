@@ -0,0 +1,387 @@
+# encoding: utf-8
+"""
+@file: indexed_fields.py
+
+Instances of the multi-passage readers built from token ids instead of ``Token`` objects.
+
+``make_MSMARCO_MultiPassage_instance`` creates, per instance, a ``TextField`` for the question, a
+``ListField`` of ``TextField`` for the passages, two ``ListField`` of ``ListField`` of
+``IndexField`` for the spans and a metadata dict with the passage tokens a second time.  Every
+field is then indexed and padded one by one when a batch is made.  With a fixed vocabulary,
+:class:`TokenIdMapper` converts every distinct token string once and the fields below only hold
+numpy arrays of ids: padding a batch is a copy into a zero tensor and batching is a ``torch.stack``.
+The tensors are the same as the ones of the ``TextField``/``ListField`` version, so the model does
+not change.  The metadata is only decoded from the sample when the model reads it.
+"""
+import functools
+import hashlib
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy
+import torch
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.data.fields import Field, SequenceField, MetadataField
+from allennlp.data.instance import Instance
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer, TokenIndexer
+from allennlp.data.tokenizers import Token
+from allennlp.data.vocabulary import Vocabulary
+
+
+def _pad(array: numpy.ndarray, shape: Tuple[int, ...], padding_value: int = 0) -> torch.LongTensor:
+    tensor = torch.full(shape, padding_value, dtype=torch.long)
+    if array.size:
+        tensor[tuple(slice(0, size) for size in array.shape)] = torch.from_numpy(array)
+    return tensor
+
+
+class TokenIdMapper:
+    """
+    Converts token strings to the ids the ``token_indexers`` would give them with ``vocab``.
+
+    Every distinct token gets a local id (0 is the padding) the first time it is seen; the ids of
+    each indexer are then looked up in arrays indexed by local id.  Only ``SingleIdTokenIndexer``
+    and ``TokenCharactersIndexer`` without start or end tokens are supported.
+    """
+
+    def __init__(self, vocab: Vocabulary, token_indexers: Dict[str, TokenIndexer]) -> None:
+        self.vocab = vocab
+        self.token_indexers = token_indexers
+        self._single_id: Dict[str, Tuple[str, bool]] = {}
+        self._characters: Dict[str, TokenCharactersIndexer] = {}
+        for name, indexer in token_indexers.items():
+            if getattr(indexer, '_start_tokens', None) or getattr(indexer, '_end_tokens', None):
+                raise ConfigurationError("token indexer %s: start and end tokens are not supported "
+                                         "with pre-indexed instances" % name)
+            if isinstance(indexer, SingleIdTokenIndexer):
+                self._single_id[name] = (indexer.namespace, indexer.lowercase_tokens)
+            elif isinstance(indexer, TokenCharactersIndexer):
+                self._characters[name] = indexer
+            else:
+                raise ConfigurationError("token indexer %s: %s is not supported with pre-indexed instances"
+                                         % (name, type(indexer).__name__))
+        self._local_ids: Dict[str, int] = {}
+        self._size = 1
+        self._capacity = 1024
+        self._ids = {name: numpy.zeros(self._capacity, dtype=numpy.int64) for name in self._single_id}
+        self._chars = {name: numpy.zeros((self._capacity, max(indexer._min_padding_length, 1)), dtype=numpy.int64)
+                       for name, indexer in self._characters.items()}
+        self._num_chars = {name: numpy.zeros(self._capacity, dtype=numpy.int64) for name in self._characters}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, texts: List[str]) -> None:
+        start = self._size
+        self._size += len(texts)
+        if self._size > self._capacity:
+            self._grow(2 * self._size)
+        for name, (namespace, lowercase) in self._single_id.items():
+            self._ids[name][start:self._size] = [self.vocab.get_token_index(text.lower() if lowercase else text,
+                                                                            namespace)
+                                                 for text in texts]
+        for name, indexer in self._characters.items():
+            for local_id, text in enumerate(texts, start):
+                char_ids = [character.text_id if getattr(character, 'text_id', None) is not None
+                            else self.vocab.get_token_index(character.text, indexer._namespace)
+                            for character in indexer._character_tokenizer.tokenize(text)]
+                if len(char_ids) > self._chars[name].shape[1]:
+                    self._chars[name] = numpy.pad(self._chars[name],
+                                                  ((0, 0), (0, len(char_ids) - self._chars[name].shape[1])),
+                                                  'constant')
+                self._chars[name][local_id, :len(char_ids)] = char_ids
+                self._num_chars[name][local_id] = len(char_ids)
+        for local_id, text in enumerate(texts, start):
+            self._local_ids[text] = local_id
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - self._capacity
+        self._capacity = capacity
+        for name, ids in self._ids.items():
+            self._ids[name] = numpy.pad(ids, (0, extra), 'constant')
+        for name, chars in self._chars.items():
+            self._chars[name] = numpy.pad(chars, ((0, extra), (0, 0)), 'constant')
+            self._num_chars[name] = numpy.pad(self._num_chars[name], (0, extra), 'constant')
+
+    def intern(self, texts: Sequence[str]) -> numpy.ndarray:
+        """ The local ids of ``texts``, adding the tokens not seen yet. """
+        local_ids = self._local_ids
+        new_texts = [text for text in dict.fromkeys(texts) if text not in local_ids]
+        if new_texts:
+            self._add(new_texts)
+        return numpy.fromiter((local_ids[text] for text in texts), dtype=numpy.int64, count=len(texts))
+
+    def pad_sequences(self, sequences: List[numpy.ndarray]) -> numpy.ndarray:
+        """ Stacks the local ids of several sequences in a ``(num_sequences, max_length)`` array. """
+        padded = numpy.zeros((len(sequences), max((len(ids) for ids in sequences), default=0)),
+                             dtype=numpy.int64)
+        for row, ids in enumerate(sequences):
+            padded[row, :len(ids)] = ids
+        return padded
+
+    def arrays(self, local_ids: numpy.ndarray) -> Dict[str, numpy.ndarray]:
+        """
+        The ids of every indexer for an array of local ids of any shape, with a last dimension of
+        characters (as long as the longest token, at least ``min_padding_length``) for the
+        character indexers.
+        """
+        arrays = {name: ids[local_ids] for name, ids in self._ids.items()}
+        for name, indexer in self._characters.items():
+            num_chars = int(self._num_chars[name][local_ids].max()) if local_ids.size else 0
+            arrays[name] = self._chars[name][local_ids, :max(num_chars, indexer._min_padding_length)]
+        return arrays
+
+    def fingerprint(self) -> str:
+        """
+        A hash of the settings of the indexers and of the vocabulary namespaces they use: the ids
+        of a token are the same for two mappers with the same fingerprint.
+        """
+        digest = hashlib.sha1()
+        namespaces = []
+        for name, (namespace, lowercase) in sorted(self._single_id.items()):
+            digest.update(('single_id %s %s %s\n' % (name, namespace, lowercase)).encode('utf-8'))
+            namespaces.append(namespace)
+        for name, indexer in sorted(self._characters.items()):
+            digest.update(('characters %s %s %d %r\n' % (name, indexer._namespace, indexer._min_padding_length,
+                                                         vars(indexer._character_tokenizer))).encode('utf-8'))
+            namespaces.append(indexer._namespace)
+        for namespace in sorted(set(namespaces)):
+            digest.update(('namespace %s\n' % namespace).encode('utf-8'))
+            for token in self.vocab.get_index_to_token_vocabulary(namespace).values():
+                digest.update(token.encode('utf-8'))
+                digest.update(b'\n')
+        return digest.hexdigest()
+
+    def tables(self) -> Dict[str, numpy.ndarray]:
+        """
+        The ids of every local id, by indexer: ``ids.<name>`` for the single id indexers,
+        ``chars.<name>`` and ``num_chars.<name>`` for the character indexers.
+        """
+        tables = {'ids.' + name: ids[:self._size] for name, ids in self._ids.items()}
+        for name, chars in self._chars.items():
+            tables['chars.' + name] = chars[:self._size]
+            tables['num_chars.' + name] = self._num_chars[name][:self._size]
+        return tables
+
+    @classmethod
+    def from_tables(cls,
+                    vocab: Vocabulary,
+                    token_indexers: Dict[str, TokenIndexer],
+                    tables: Dict[str, numpy.ndarray]) -> 'TokenIdMapper':
+        """
+        A mapper for the local ids of the ``tables`` of another one, which does not know the token
+        strings: :func:`intern` must not be used.
+        """
+        mapper = cls(vocab, token_indexers)
+        for name in mapper._ids:
+            mapper._ids[name] = tables['ids.' + name]
+        for name in mapper._chars:
+            mapper._chars[name] = tables['chars.' + name]
+            mapper._num_chars[name] = tables['num_chars.' + name]
+        mapper._size = mapper._capacity = len(next(iter(tables.values()), ()))
+        return mapper
+
+
+class IndexedTextField(SequenceField[Dict[str, torch.Tensor]]):
+    """
+    A ``TextField`` already converted to ids, ``arrays`` maps the name of every token indexer to an
+    array of shape ``(num_tokens,)`` or ``(num_tokens, num_characters)``.
+    """
+
+    def __init__(self, arrays: Dict[str, numpy.ndarray]) -> None:
+        self.arrays = arrays
+
+    def sequence_length(self) -> int:
+        return len(next(iter(self.arrays.values())))
+
+    def get_padding_lengths(self) -> Dict[str, int]:
+        padding_lengths = {'num_tokens': self.sequence_length()}
+        for array in self.arrays.values():
+            if array.ndim == 2:
+                padding_lengths['num_token_characters'] = max(padding_lengths.get('num_token_characters', 0),
+                                                              array.shape[1])
+        return padding_lengths
+
+    def as_tensor(self, padding_lengths: Dict[str, int]) -> Dict[str, torch.Tensor]:
+        shape = (padding_lengths['num_tokens'],)
+        return {name: _pad(array, shape + (padding_lengths['num_token_characters'],) * (array.ndim - 1))
+                for name, array in self.arrays.items()}
+
+    def empty_field(self) -> 'IndexedTextField':
+        return IndexedTextField({name: numpy.zeros((0,) * array.ndim, dtype=numpy.int64)
+                                 for name, array in self.arrays.items()})
+
+    def batch_tensors(self, tensor_list: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        return {name: torch.stack([tensors[name] for tensors in tensor_list]) for name in tensor_list[0]}
+
+
+class IndexedTextListField(Field[Dict[str, torch.Tensor]]):
+    """
+    A ``ListField`` of ``TextField`` already converted to ids, ``arrays`` maps the name of every
+    token indexer to an array of shape ``(num_fields, num_tokens)`` or
+    ``(num_fields, num_tokens, num_characters)``.  The padding lengths have the names of the
+    ``ListField`` ones, so ``sorting_keys`` such as ``["passages", "list_num_tokens"]`` still work.
+    """
+
+    def __init__(self, arrays: Dict[str, numpy.ndarray]) -> None:
+        self.arrays = arrays
+
+    def __len__(self) -> int:
+        return len(next(iter(self.arrays.values())))
+
+    def get_padding_lengths(self) -> Dict[str, int]:
+        tokens = next(iter(self.arrays.values()))
+        padding_lengths = {'num_fields': tokens.shape[0], 'list_num_tokens': tokens.shape[1]}
+        for array in self.arrays.values():
+            if array.ndim == 3:
+                padding_lengths['list_num_token_characters'] = \
+                    max(padding_lengths.get('list_num_token_characters', 0), array.shape[2])
+        return padding_lengths
+
+    def as_tensor(self, padding_lengths: Dict[str, int]) -> Dict[str, torch.Tensor]:
+        shape = (padding_lengths['num_fields'], padding_lengths['list_num_tokens'])
+        return {name: _pad(array, shape + (padding_lengths['list_num_token_characters'],) * (array.ndim - 2))
+                for name, array in self.arrays.items()}
+
+    def empty_field(self) -> 'IndexedTextListField':
+        return IndexedTextListField({name: numpy.zeros((0,) * array.ndim, dtype=numpy.int64)
+                                     for name, array in self.arrays.items()})
+
+    def batch_tensors(self, tensor_list: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        return {name: torch.stack([tensors[name] for tensors in tensor_list]) for name in tensor_list[0]}
+
+
+class IndexArrayField(Field[torch.Tensor]):
+    """
+    The ``ListField`` of ``ListField`` of ``IndexField`` of the span starts (or ends) of every
+    passage as a ``(num_passages, num_spans)`` array, padded with -1 like the ``IndexField``.
+    The tensor has a last dimension of 1, as the ``IndexField`` tensors.
+    """
+
+    def __init__(self, array: numpy.ndarray, padding_value: int = -1) -> None:
+        self.array = array
+        self.padding_value = padding_value
+
+    def get_padding_lengths(self) -> Dict[str, int]:
+        return {'dimension_%d' % dimension: size for dimension, size in enumerate(self.array.shape)}
+
+    def as_tensor(self, padding_lengths: Dict[str, int]) -> torch.Tensor:
+        shape = tuple(padding_lengths['dimension_%d' % dimension] for dimension in range(self.array.ndim))
+        return _pad(self.array, shape, self.padding_value).unsqueeze(-1)
+
+    def empty_field(self) -> 'IndexArrayField':
+        return IndexArrayField(numpy.zeros((0,) * self.array.ndim, dtype=numpy.int64), self.padding_value)
+
+
+class LazyMetadata(Mapping):
+    """
+    The metadata dict of an instance, computed by ``decode`` the first time a key other than
+    ``qid`` is read.  ``decode`` should be picklable (e.g. a ``functools.partial`` of a module
+    function) so that the instances can be sent to other processes.
+    """
+
+    def __init__(self, decode: Callable[[], Dict[str, Any]], qid: Any) -> None:
+        self._decode = decode
+        self._qid = qid
+        self._metadata = None
+
+    def _decoded(self) -> Dict[str, Any]:
+        if self._metadata is None:
+            self._metadata = self._decode()
+        return self._metadata
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'qid':
+            return self._qid
+        return self._decoded()[key]
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self) -> int:
+        return len(self._decoded())
+
+
+def instance_metadata(json_obj: Dict[str, Any],
+                      max_q_len: int = None,
+                      max_p_len: int = None,
+                      max_p_num: int = None) -> Dict[str, Any]:
+    """
+    The metadata ``make_MSMARCO_MultiPassage_instance`` stores for a sample in the format of a
+    line of an ``.instances`` file, with the question and passages cut like the readers do.
+    """
+    question_tokens = [Token(text=text, idx=idx) for text, idx in json_obj['question_tokens'][:max_q_len]]
+    passages_tokens = [[Token(text=text, idx=idx) for text, idx in passage_tokens[:max_p_len]]
+                       for passage_tokens in json_obj['passages_tokens'][:max_p_num]]
+    metadata = {'original_passages': json_obj['passages_texts'],
+                'passages_offsets': [[(token.idx, token.idx + len(token.text)) for token in passage_tokens]
+                                     for passage_tokens in passages_tokens],
+                'qid': json_obj['qid'],
+                'question_tokens': [token.text for token in question_tokens],
+                'passage_tokens': [[token.text for token in passage_tokens] for passage_tokens in passages_tokens]}
+    if json_obj['answer_texts']:
+        metadata['answer_texts'] = json_obj['answer_texts']
+    return metadata
+
+
+def _store_metadata(store, index: int) -> Dict[str, Any]:
+    return instance_metadata(store[index])
+
+
+def make_indexed_instance(mapper: TokenIdMapper,
+                          question_ids: numpy.ndarray,
+                          passages_ids: List[numpy.ndarray],
+                          num_passages_texts: int,
+                          token_spans: Iterable[Sequence[Sequence[int]]],
+                          metadata: LazyMetadata) -> Instance:
+    """
+    The pre-indexed counterpart of ``make_MSMARCO_MultiPassage_instance`` for the local ids of the
+    question and passages.
+    """
+    token_spans = list(token_spans or [[(-1, -1)]] * num_passages_texts)[:len(passages_ids)]
+    num_spans = max((len(spans_in_passage) for spans_in_passage in token_spans), default=0)
+    spans = numpy.full((len(token_spans), num_spans, 2), -1, dtype=numpy.int64)
+    for passage_id, spans_in_passage in enumerate(token_spans):
+        if len(spans_in_passage):
+            spans[passage_id, :len(spans_in_passage)] = spans_in_passage
+    fields: Dict[str, Field] = {}
+    fields['question'] = IndexedTextField(mapper.arrays(question_ids))
+    fields['passages'] = IndexedTextListField(mapper.arrays(mapper.pad_sequences(passages_ids)))
+    fields['spans_start'] = IndexArrayField(spans[:, :, 0])
+    fields['spans_end'] = IndexArrayField(spans[:, :, 1])
+    fields['metadata'] = MetadataField(metadata)
+    return Instance(fields)
+
+
+def json_obj_to_indexed_instance(mapper: TokenIdMapper,
+                                 json_obj: Dict[str, Any],
+                                 max_q_len: int = None,
+                                 max_p_len: int = None,
+                                 max_p_num: int = None) -> Instance:
+    """ A pre-indexed instance of a sample in the format of a line of an ``.instances`` file. """
+    question_ids = mapper.intern([text for text, _ in json_obj['question_tokens'][:max_q_len]])
+    passages_ids = [mapper.intern([text for text, _ in passage_tokens[:max_p_len]])
+                    for passage_tokens in json_obj['passages_tokens'][:max_p_num]]
+    metadata = LazyMetadata(functools.partial(instance_metadata, json_obj, max_q_len, max_p_len, max_p_num),
+                            json_obj['qid'])
+    return make_indexed_instance(mapper, question_ids, passages_ids, len(json_obj['passages_texts']),
+                                 json_obj.get('token_spans'), metadata)
+
+
+def store_to_indexed_instance(mapper: TokenIdMapper, store, index: int, store_ids: numpy.ndarray) -> Instance:
+    """
+    A pre-indexed instance of the sample ``index`` of an ``InstanceStore``, where ``store_ids`` is
+    ``mapper.intern(store.tokens)``: the local id of every store token.
+    """
+    question, *passages = store.sample_sequences(index)
+    qid, answer_texts, num_token_spans = store.meta[index]
+    token_spans = None
+    if num_token_spans is not None:
+        token_spans = [store.sequence_spans(seq) for seq in passages[:num_token_spans]]
+    return make_indexed_instance(mapper,
+                                 store_ids[store.sequence_ids(question)],
+                                 [store_ids[store.sequence_ids(seq)] for seq in passages],
+                                 len(passages),
+                                 token_spans,
+                                 LazyMetadata(functools.partial(_store_metadata, store, index), qid))
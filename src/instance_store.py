@@ -0,0 +1,252 @@
+# encoding: utf-8
+"""
+@file: instance_store.py
+
+A binary, memory-mapped version of the ``.instances`` files written by the preprocessing scripts.
+
+An ``.instances`` file has one JSON object per line with ``question_tokens``, ``passages_tokens``,
+``passages_texts``, ``answer_texts``, ``qid`` and optionally ``token_spans``.  The store keeps the
+same content in flat arrays inside the directory ``<instances file>.store``:
+
+==================== ======= ==================================================================
+file                 dtype   content
+==================== ======= ==================================================================
+tokens.json                  the distinct token strings, position = store token id
+chars.json                   the distinct characters, position = store char id
+token_chars          int32   char ids of every store token, concatenated
+token_char_offsets   int64   ``token_chars[token_char_offsets[t]:token_char_offsets[t + 1]]``
+token_ids            int32   store token id of every token of every sequence
+token_starts         int32   character offset (``Token.idx``) of every token
+seq_offsets          int64   tokens of sequence ``s`` are ``token_ids[seq_offsets[s]:seq_offsets[s + 1]]``
+sample_offsets       int64   sequences of sample ``i``; the first one is the question
+texts                uint8   utf-8 passage texts, concatenated
+text_offsets         int64   bytes of the text of sequence ``s`` (empty for questions)
+spans                int32   ``(start, end)`` token spans, shape ``(num_spans, 2)``
+span_offsets         int64   spans of sequence ``s`` (empty for questions)
+meta.json                    ``samples``: ``[qid, answer_texts, num_token_spans]`` for every
+                             sample, where ``num_token_spans`` is ``None`` if the sample has no
+                             ``token_spans``; ``source``: ``[size, mtime_ns]`` of the
+                             ``.instances`` file the store was built from
+==================== ======= ==================================================================
+
+Opening a store only maps the arrays; samples are read at random without any parsing and the pages
+are shared between every process that opens the same store.  A store whose ``.instances`` file
+changed since it was built is stale, see :func:`InstanceStore.is_built_from`.
+"""
+import array
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+STORE_SUFFIX = '.store'
+
+_ARRAYS = {'token_chars': 'int32',
+           'token_char_offsets': 'int64',
+           'token_ids': 'int32',
+           'token_starts': 'int32',
+           'seq_offsets': 'int64',
+           'sample_offsets': 'int64',
+           'texts': 'uint8',
+           'text_offsets': 'int64',
+           'spans': 'int32',
+           'span_offsets': 'int64'}
+
+
+def _open_array(path: str, dtype: str) -> numpy.ndarray:
+    # numpy.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode='r')
+
+
+def _file_stamp(file_path: str) -> List[int]:
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# the stores unpickled in this process, by path and build (the modification time of meta.json)
+_SHARED_STORES: Dict[Tuple[str, int], 'InstanceStore'] = {}
+
+
+def _shared_store(path: str) -> 'InstanceStore':
+    key = (path, os.stat(os.path.join(path, 'meta.json')).st_mtime_ns)
+    store = _SHARED_STORES.get(key)
+    if store is None:
+        store = _SHARED_STORES[key] = InstanceStore(path)
+    return store
+
+
+class InstanceStore:
+    """
+    Read-only access to an instance store built by :func:`InstanceStore.build`.
+
+    Parameters
+    ----------
+    path : ``str``
+        The store directory, usually ``<instances file>.store``.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        for name, dtype in _ARRAYS.items():
+            setattr(self, name, _open_array(os.path.join(path, name), dtype))
+        self.spans = self.spans.reshape(-1, 2)
+        with open(os.path.join(path, 'tokens.json')) as f:
+            self.tokens: List[str] = json.load(f)
+        with open(os.path.join(path, 'chars.json')) as f:
+            self.chars: List[str] = json.load(f)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.meta: List[List[Any]] = meta['samples']
+        self.source: Optional[List[int]] = meta['source']
+
+    def __len__(self) -> int:
+        return len(self.sample_offsets) - 1
+
+    def __reduce__(self):
+        # the arrays are mapped again from the files instead of being pickled, once per process:
+        # the metadata of every batch of the ``prefetch`` workers refers to the store
+        return _shared_store, (self.path,)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def is_built_from(self, file_path: str) -> bool:
+        """
+        Whether the store has the content of the ``.instances`` file ``file_path``: the file did not
+        change (size and modification time) since :func:`from_instances_file`, or it does not exist.
+        """
+        if not os.path.isfile(file_path):
+            return True
+        return self.source == _file_stamp(file_path)
+
+    def sequence_ids(self, seq: int) -> numpy.ndarray:
+        return self.token_ids[self.seq_offsets[seq]:self.seq_offsets[seq + 1]]
+
+    def sequence_starts(self, seq: int) -> numpy.ndarray:
+        return self.token_starts[self.seq_offsets[seq]:self.seq_offsets[seq + 1]]
+
+    def sequence_text(self, seq: int) -> str:
+        return self.texts[self.text_offsets[seq]:self.text_offsets[seq + 1]].tobytes().decode('utf-8')
+
+    def sequence_spans(self, seq: int) -> numpy.ndarray:
+        return self.spans[self.span_offsets[seq]:self.span_offsets[seq + 1]]
+
+    def sequence_tuples(self, seq: int) -> List[List[Any]]:
+        tokens = self.tokens
+        return [[tokens[token_id], int(start)]
+                for token_id, start in zip(self.sequence_ids(seq).tolist(), self.sequence_starts(seq).tolist())]
+
+    def sample_sequences(self, index: int) -> range:
+        return range(int(self.sample_offsets[index]), int(self.sample_offsets[index + 1]))
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        """
+        The sample ``index`` in the format of a line of the ``.instances`` file.
+        """
+        question, *passages = self.sample_sequences(index)
+        qid, answer_texts, num_token_spans = self.meta[index]
+        json_obj = {'question_tokens': self.sequence_tuples(question),
+                    'passages_tokens': [self.sequence_tuples(seq) for seq in passages],
+                    'passages_texts': [self.sequence_text(seq) for seq in passages],
+                    'answer_texts': answer_texts,
+                    'qid': qid}
+        if num_token_spans is not None:
+            json_obj['token_spans'] = [self.sequence_spans(seq).tolist()
+                                       for seq in passages[:num_token_spans]]
+        return json_obj
+
+    def filter_fields(self, index: int) -> Dict[str, Any]:
+        """
+        Only the ``answer_texts`` and ``token_spans`` of the sample ``index``, which the readers
+        filter the samples on, without decoding the tokens.
+        """
+        question, *passages = self.sample_sequences(index)
+        _, answer_texts, num_token_spans = self.meta[index]
+        json_obj = {'answer_texts': answer_texts}
+        if num_token_spans is not None:
+            json_obj['token_spans'] = [self.sequence_spans(seq).tolist() for seq in passages[:num_token_spans]]
+        return json_obj
+
+    @classmethod
+    def build(cls, json_objs: Iterable[Dict[str, Any]], path: str, source: List[int] = None) -> 'InstanceStore':
+        """
+        Writes the samples ``json_objs`` (parsed lines of an ``.instances`` file) to the store
+        directory ``path``.  ``source`` is the ``[size, mtime_ns]`` of that file.
+        """
+        os.makedirs(path, exist_ok=True)
+        token_vocab: Dict[str, int] = {}
+        char_vocab: Dict[str, int] = {}
+        arrays = {name: array.array('q' if dtype == 'int64' else 'i')
+                  for name, dtype in _ARRAYS.items() if dtype != 'uint8'}
+        for name in ('token_char_offsets', 'seq_offsets', 'sample_offsets', 'text_offsets', 'span_offsets'):
+            arrays[name].append(0)
+        texts = open(os.path.join(path, 'texts'), 'wb')
+        text_size = 0
+        meta = []
+
+        def add_sequence(token_tuples, text=None, spans=()):
+            nonlocal text_size
+            for text_, start in token_tuples:
+                token_id = token_vocab.get(text_)
+                if token_id is None:
+                    token_id = token_vocab[text_] = len(token_vocab)
+                    arrays['token_chars'].extend(char_vocab.setdefault(char, len(char_vocab))
+                                                 for char in text_)
+                    arrays['token_char_offsets'].append(len(arrays['token_chars']))
+                arrays['token_ids'].append(token_id)
+                arrays['token_starts'].append(start)
+            arrays['seq_offsets'].append(len(arrays['token_ids']))
+            if text is not None:
+                encoded = text.encode('utf-8')
+                texts.write(encoded)
+                text_size += len(encoded)
+            arrays['text_offsets'].append(text_size)
+            for start, end in spans:
+                arrays['spans'].extend((start, end))
+            arrays['span_offsets'].append(len(arrays['spans']) // 2)
+
+        for json_obj in json_objs:
+            token_spans = json_obj.get('token_spans')
+            add_sequence(json_obj['question_tokens'])
+            for passage_id, (passage_tokens, passage_text) in enumerate(zip(json_obj['passages_tokens'],
+                                                                            json_obj['passages_texts'])):
+                spans = token_spans[passage_id] if token_spans and passage_id < len(token_spans) else ()
+                add_sequence(passage_tokens, passage_text, spans)
+            arrays['sample_offsets'].append(len(arrays['seq_offsets']) - 1)
+            meta.append([json_obj['qid'], json_obj['answer_texts'],
+                         None if token_spans is None else len(token_spans)])
+        texts.close()
+
+        for name, values in arrays.items():
+            numpy.asarray(values, dtype=_ARRAYS[name]).tofile(os.path.join(path, name))
+        with open(os.path.join(path, 'tokens.json'), 'w') as f:
+            json.dump(sorted(token_vocab, key=token_vocab.get), f, ensure_ascii=False)
+        with open(os.path.join(path, 'chars.json'), 'w') as f:
+            json.dump(sorted(char_vocab, key=char_vocab.get), f, ensure_ascii=False)
+        # meta.json is written last, it marks the store as complete
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'source': source, 'samples': meta}, f, ensure_ascii=False)
+        logger.info('wrote %d samples, %d tokens, %d distinct tokens to %s',
+                    len(meta), len(arrays['token_ids']), len(token_vocab), path)
+        return cls(path)
+
+    @classmethod
+    def from_instances_file(cls, file_path: str, path: str = None) -> 'InstanceStore':
+        """
+        Converts an ``.instances`` file to ``<file_path>.store`` (or ``path``).
+        """
+        def json_objs():
+            with open(file_path) as f:
+                for line in f:
+                    if not line.isspace():
+                        yield json.loads(line)
+        # taken before reading, a file changed while it is converted makes a stale store
+        source = _file_stamp(file_path)
+        return cls.build(json_objs(), path or file_path + STORE_SUFFIX, source)
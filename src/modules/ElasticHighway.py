@@ -29,3 +29,45 @@ class ElasticHighway(nn.Module):
             linear = self.linear[layer](x)
             x = gate * nonlinear + (1 - gate) * linear
         return x
+
+
+class FusedElasticHighway(nn.Module):
+    """
+    ``ElasticHighway`` with the gate, nonlinear and linear transformations of each layer stacked
+    into one ``nn.Linear``, so every layer reads its input once and runs a single matmul. It accepts
+    inputs of any shape ``[..., size]`` and does not need ``TimeDistributed``.
+
+    State dicts of ``ElasticHighway`` (also when it was wrapped in ``TimeDistributed``) are
+    converted when loaded.
+    """
+    def __init__(self, input_size, output_size, num_layers):
+        super(FusedElasticHighway, self).__init__()
+
+        self.num_layers = num_layers
+        self.output_size = output_size
+        # rows: [gate; nonlinear; linear]
+        self.layers = nn.ModuleList([nn.Linear(output_size if i else input_size, output_size * 3)
+                                     for i in range(num_layers)])
+        self.f = nn.ReLU()
+        self._register_load_state_dict_pre_hook(self._fuse_state_dict)
+
+    def forward(self, x):
+        """
+            :param x: tensor with shape of [..., size]
+            :return: tensor with shape of [..., size]
+            """
+        for layer in self.layers:
+            gate, nonlinear, linear = layer(x).chunk(3, dim=-1)
+            gate = torch.sigmoid(gate)
+            x = gate * self.f(nonlinear) + (1 - gate) * linear
+        return x
+
+    def _fuse_state_dict(self, state_dict, prefix, *args):
+        for old_prefix in (prefix, prefix + '_module.'):
+            for layer in range(self.num_layers):
+                for param in ('weight', 'bias'):
+                    keys = [old_prefix + '%s.%d.%s' % (name, layer, param)
+                            for name in ('gate', 'nonlinear', 'linear')]
+                    if all(key in state_dict for key in keys):
+                        state_dict[prefix + 'layers.%d.%s' % (layer, param)] = \
+                            torch.cat([state_dict.pop(key) for key in keys], dim=0)
@@ -16,6 +16,7 @@ import torch
 import torch.nn as nn
 import logging
 from torch.nn import Parameter
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from allennlp.nn import util
 from allennlp.modules.seq2seq_encoders.seq2seq_encoder import Seq2SeqEncoder
 from allennlp.modules import TimeDistributed
@@ -60,22 +61,40 @@ class PointerNetEncoder(nn.Module):
         self.c0 = Parameter(torch.zeros(1), requires_grad=False)
 
     def forward(self, embedded_inputs,
-                hidden):
+                hidden,
+                mask=None):
         """
         PointerNetEncoder - Forward-pass
 
         :param Tensor embedded_inputs: Embedded inputs of Pointer-Net
         :param Tensor hidden: Initiated hidden units for the LSTMs (h, c)
+        :param Tensor mask: Optional (batch, seq_len) mask of the inputs. If given, the LSTMs only
+            run over the real tokens and the final hidden units come from each last real token
         :return: LSTMs outputs and hidden units (h, c)
         """
-
-        embedded_inputs = embedded_inputs.permute(1, 0, 2)
-
-        self.lstm.flatten_parameters()
-        outputs, hidden = self.lstm(embedded_inputs, hidden)
-        self.lstm.flatten_parameters()
-
-        return outputs.permute(1, 0, 2).contiguous(), hidden
+        if isinstance(self.lstm, nn.LSTM):
+            # quantized LSTMs (``src/quantization.py``) keep their own packed weights
+            self.lstm.flatten_parameters()
+        if mask is None:
+            embedded_inputs = embedded_inputs.permute(1, 0, 2)
+            outputs, hidden = self.lstm(embedded_inputs, hidden)
+            return outputs.permute(1, 0, 2).contiguous(), hidden
+
+        # Sequences without any token (padding passages) still run one step so that every
+        # sequence has a final hidden state.
+        sequence_lengths = util.get_lengths_from_binary_sequence_mask(mask).clamp(min=1)
+        # The lengths stay a tensor and the LSTM sorts the batch (and the hidden units) itself,
+        # so that the encoder can be traced (see ``src/export.py``).
+        packed_inputs = pack_padded_sequence(embedded_inputs,
+                                             sequence_lengths.cpu(),
+                                             batch_first=True,
+                                             enforce_sorted=False)
+        packed_outputs, hidden = self.lstm(packed_inputs, hidden)
+        outputs, _ = pad_packed_sequence(packed_outputs,
+                                         batch_first=True,
+                                         total_length=embedded_inputs.size(1))
+
+        return outputs, hidden
 
     def init_hidden(self, batch_size):
         """
@@ -245,13 +264,10 @@ class PointerNetDecoder(nn.Module):
         logger.debug("embedded_inputs.size %s" % str(embedded_inputs.size()))
         logger.debug("start_hidden[0].size %s" % str(hidden[0].size()))
         logger.debug("start_hidden[1].size %s" % str(hidden[1].size()))
-        F = torch.tanh(self._ptr_layer_1(torch.cat([embedded_inputs,
-                                                    embedded_inputs.new_zeros(
-                                                        embedded_inputs.size())], dim=-1)) +
-                       self._ptr_layer_2(hidden[0].unsqueeze(1)).repeat(1, passage_length, 1))
-        logger.debug("F.size %s" % str(F.size()))
-        # linear with bias
-        span_start_logits = self._ptr_layer_3(F).squeeze()
+        # The passage projection does not depend on the pointer, so it is shared by both.
+        # (batch_size, passage_length, embedding_dim)
+        passage_projection = self._project_passage(embedded_inputs)
+        span_start_logits = self._pointer_logits(passage_projection, hidden[0])
         logger.debug("span_start_logits.size %s" % str(span_start_logits.size()))
         # passages_mask = passages_mask.view(span_start_logits.size(0), -1)
         span_start_probs = util.masked_softmax(span_start_logits, passages_mask)
@@ -262,14 +278,49 @@ class PointerNetDecoder(nn.Module):
         logger.debug("end_hidden[0].size %s" % str(hidden[0].size()))
         logger.debug("end_hidden[1].size %s" % str(hidden[1].size()))
         # end
-        F = torch.tanh(self._ptr_layer_1(torch.cat([embedded_inputs,
-                                                    embedded_inputs.new_zeros(
-                                                        embedded_inputs.size())], dim=-1)) +
-                       self._ptr_layer_2(hidden[0].unsqueeze(1)).repeat(1, passage_length, 1))
-        span_end_logits = self._ptr_layer_3(F).squeeze()
+        span_end_logits = self._pointer_logits(passage_projection, hidden[0])
         # span_end_probs = util.masked_softmax(span_end_logits, passages_mask)
         return span_start_logits, span_end_logits
 
+    def _project_passage(self, embedded_inputs):
+        """
+        ``_ptr_layer_1`` applied to ``[embedded_inputs; 0]``. The zero half of the input only
+        meets the second half of the weight, so only the first half is used.
+
+        :param Tensor embedded_inputs: (batch, seq_len, embedding_dim)
+        :return: (batch, seq_len, embedding_dim)
+        """
+        layer = self._ptr_layer_1._module
+        if layer.in_features == self.embedding_dim:
+            # the first half only, see ``drop_zero_half``
+            return layer(embedded_inputs)
+        return nn.functional.linear(embedded_inputs, layer.weight[:, :self.embedding_dim])
+
+    def drop_zero_half(self):
+        """
+        Replaces ``_ptr_layer_1`` by a layer with the first half of its weight, the part
+        ``_project_passage`` uses, so that the layer can be called (e.g. once it is quantized)
+        instead of slicing its weight.  The state dict changes, use it for inference only.
+        """
+        layer = self._ptr_layer_1._module
+        if layer.in_features == self.embedding_dim:
+            return
+        half = nn.Linear(self.embedding_dim, layer.out_features, bias=False).to(layer.weight.device)
+        half.weight.data.copy_(layer.weight.data[:, :self.embedding_dim])
+        self._ptr_layer_1._module = half
+
+    def _pointer_logits(self, passage_projection, h):
+        """
+        Pointer logits over the passage for the decoder hidden state ``h``.
+
+        :param Tensor passage_projection: Output of ``_project_passage``, (batch, seq_len, embedding_dim)
+        :param Tensor h: Decoder hidden state, (batch, hidden_dim)
+        :return: (batch, seq_len)
+        """
+        # (batch, 1, embedding_dim), broadcast over seq_len
+        hidden_projection = self._ptr_layer_2._module(h).unsqueeze(1)
+        return self._ptr_layer_3(torch.tanh(passage_projection + hidden_projection)).squeeze(-1)
+
 
 @Seq2SeqEncoder.register("PointerNet")
 class PointerNet(Seq2SeqEncoder):
@@ -312,6 +363,8 @@ class PointerNet(Seq2SeqEncoder):
         ----------
         embedded_inputs
             Shape(batch_size * num_passages, passage_length, embedding_size)
+        passages_mask
+            Shape(batch_size * num_passages, passage_length)
         Return
         ------
         span_start_logits, span_end_logits
@@ -324,7 +377,8 @@ class PointerNet(Seq2SeqEncoder):
         encoder_hidden0 = self._encoder.init_hidden(batch_size)
         # use lstm to encode
         encoder_outputs, encoder_hidden = self._encoder(embedded_inputs,
-                                                        encoder_hidden0)
+                                                        encoder_hidden0,
+                                                        passages_mask)
         # pdb.set_trace()
         if self.bidir:
             hidden0 = (torch.cat(tuple(encoder_hidden[0][-2:]), dim=-1),
@@ -7,11 +7,13 @@ import time
 from typing import Dict, List, Tuple, Optional, Iterable, Any
 from overrides import overrides
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.common.file_utils import cached_path
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.instance import Instance
 from allennlp.data.dataset_readers.reading_comprehension import util
 from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenIndexer
+from allennlp.data.vocabulary import Vocabulary
 from allennlp.data.tokenizers import Token, Tokenizer, WordTokenizer
 from allennlp.data.fields import Field, TextField, IndexField, \
     MetadataField, LabelField, ListField, SequenceLabelField
@@ -19,7 +21,13 @@ from allennlp.data.fields import Field, TextField, IndexField, \
 from .scripts.dataset import load_data
 from .scripts.rouge import Rouge
 from .utils import get_answers_with_RougeL
+from .instance_store import InstanceStore, STORE_SUFFIX
+from .indexed_fields import TokenIdMapper, json_obj_to_indexed_instance, store_to_indexed_instance
+from .token_id_cache import TokenIdCache, TokenIdCacheWriter, cache_path
+from .column_json import ColumnJsonIndex
 from .scripts.addRouge_L import add_rouge_read
+from .scripts.span_utils import TokenOffsetIndex
+from .scripts.sharding import shard_lines, shard_range
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +52,23 @@ class MsmarcoMultiPassageReader(DatasetReader):
         if specified, we will cut the passage if the length of passage exceeds this limit.
     question_length_limit : ``int``, optional (default=None)
         if specified, we will cut the question if the length of passage exceeds this limit.
+    stream : ``bool``, optional (default=False)
+        if true, raw MS MARCO json files are not ``json.load``-ed at once. We index the byte
+        offsets of every ``query_id``, ``query``, ``passages`` and ``answers`` value instead (the
+        index is cached next to the file) and read one sample at a time, so the memory does not
+        grow with the size of the dataset.
+    vocabulary_directory : ``str``, optional (default=None)
+        if specified, instances read from ``.instances`` files or instance stores are built from
+        token ids mapped once per distinct token with the vocabulary saved in this directory,
+        which must be the vocabulary of the model (the ``directory_path`` of the ``vocabulary``
+        section of the config).  Their fields give the same tensors as the ``TextField`` and
+        ``ListField`` ones, see :mod:`indexed_fields`.  Only ``single_id`` and ``characters`` token
+        indexers are supported.
+    cache_token_ids : ``bool``, optional (default=False)
+        if true (requires ``vocabulary_directory``), the token ids of the instances of a complete
+        pass over an ``.instances`` file are saved in ``<file>.ids`` and the next passes read them
+        from there instead of the file.  The cache is rebuilt when the vocabulary, the token
+        indexers, ``max_samples`` or the file change, see :mod:`token_id_cache`.
     """
 
     def __init__(self,
@@ -55,7 +80,10 @@ class MsmarcoMultiPassageReader(DatasetReader):
                  build_pickle: bool = True,
                  language: str = 'en',
                  passage_length_limit: int = None,
-                 question_length_limit: int = None) -> None:
+                 question_length_limit: int = None,
+                 stream: bool = False,
+                 vocabulary_directory: str = None,
+                 cache_token_ids: bool = False) -> None:
         super().__init__(lazy)
         self.build_pickle = build_pickle
         self._tokenizer = tokenizer or WordTokenizer()
@@ -65,10 +93,22 @@ class MsmarcoMultiPassageReader(DatasetReader):
         self.language = language
         self.char_only = char_only
         self.max_samples = max_samples
+        self.stream = stream
+        self._token_mapper = None
+        if vocabulary_directory is not None:
+            self._token_mapper = TokenIdMapper(Vocabulary.from_files(vocabulary_directory), self._token_indexers)
+        if cache_token_ids and self._token_mapper is None:
+            raise ConfigurationError("cache_token_ids requires a vocabulary_directory")
+        self.cache_token_ids = cache_token_ids
 
     @overrides
     def _read(self, file_path: str) -> Iterable[Instance]:
-        if os.path.isfile(file_path + '.instances') or os.path.isfile(file_path + '.char.instances'):
+        instances_file = file_path + ('.char.instances' if self.char_only else '.instances')
+        store = self._open_instance_store(instances_file)
+        if store is not None:
+            logger.info("load from instance store %s", store.path)
+            yield from self._read_instance_store(store, instances_file)
+        elif os.path.isfile(file_path + '.instances') or os.path.isfile(file_path + '.char.instances'):
             if self.char_only:
                 logger.info("load from instances file %s", file_path + '.char.instances')
                 yield from self._read_instances_file(file_path + '.char.instances')
@@ -92,9 +132,15 @@ class MsmarcoMultiPassageReader(DatasetReader):
                                                  drop_invalid=False)
                 yield instance
         else:
-            logger.info("Reading file at %s", file_path)
-            with open(file_path) as f:
-                source = json.load(f)
+            if self.stream:
+                logger.info("Streaming file at %s", file_path)
+                dataset = self._stream_raw_file(file_path)
+            else:
+                logger.info("Reading file at %s", file_path)
+                with open(file_path) as f:
+                    source = json.load(f)
+                dataset = ((qid, source['passages'][qid], source['query'][qid], source['answers'][qid])
+                           for qid in source['query_id'])
             # query_ids = source['query_id']
             # queries = source['query']
             # data_passages = source['passages']
@@ -104,10 +150,7 @@ class MsmarcoMultiPassageReader(DatasetReader):
             logger.info("Reading the dataset")
             start_time = time.time()
             total_p = 0.0
-            for qid in source['query_id']:
-                passages = source['passages'][qid]
-                query = source['query'][qid]
-                answers = source['answers'][qid]
+            for qid, passages, query, answers in dataset:
                 question_text = query
                 passage_texts = [passage['passage_text'] for passage in passages][:10]
                 spans = []
@@ -173,6 +216,15 @@ class MsmarcoMultiPassageReader(DatasetReader):
                 else:
                     logger.info("wrong instance")
 
+    @staticmethod
+    def _stream_raw_file(file_path: str):
+        index = ColumnJsonIndex(file_path, 'query_id')
+        try:
+            for qid, (passages, query, answers) in index.rows(['passages', 'query', 'answers']):
+                yield qid, passages, query, answers
+        finally:
+            index.close()
+
     @staticmethod
     def segmented_text_to_tuples(tokens):
         idx = 0
@@ -183,36 +235,92 @@ class MsmarcoMultiPassageReader(DatasetReader):
         return result
 
     def _read_instances_file(self, file_path: str):
-        f_preprocessed = open(file_path, 'r')
-        for count, line in enumerate(f_preprocessed):
-            if self.max_samples != -1 and count > self.max_samples:
-                break
-            if line.isspace():
-                continue
-            json_obj = json.loads(line.strip())
-            if 'train' in file_path:
-                if not sum(json_obj['answer_texts'], []):
+        writer = None
+        if self.cache_token_ids:
+            path = cache_path(file_path, self._token_mapper, max_samples=self.max_samples)
+            if TokenIdCache.exists(path):
+                logger.info("load token ids from %s", path)
+                yield from TokenIdCache(path, self._token_mapper)
+                return
+            writer = TokenIdCacheWriter(path, self._token_mapper, max_samples=self.max_samples)
+        try:
+            # only the lines of the current shard in the workers of the ``prefetch`` iterator
+            for count, line in enumerate(shard_lines(file_path)):
+                if self.max_samples != -1 and count > self.max_samples:
+                    break
+                if line.isspace():
                     continue
-                elif not json_obj['token_spans']:
+                json_obj = json.loads(line.strip())
+                if not self._keep_json_obj(json_obj, file_path):
                     continue
-                try:
-                    if all([a[0] == [-1, -1] for a in json_obj['token_spans']]):
-                        continue
-                except Exception as e:
-                    pass
-                # try:
-                #     if sum([a[0] == [-1, -1] for a in json_obj['token_spans']]) !=\
-                #             len(json_obj['token_spans']) - 1:
-                #         continue
-                # except Exception as e:
-                #     pass
-            if 'dev' in file_path:
-                if not sum(json_obj['answer_texts'], []):
-                    continue
-            yield self._json_blob_to_instance(json_obj)
-        f_preprocessed.close()
+                if writer is not None:
+                    yield writer.add(json_obj)
+                else:
+                    yield self._json_blob_to_instance(json_obj)
+            if writer is not None:
+                writer.save()
+        finally:
+            if writer is not None:
+                writer.close()
+
+    @staticmethod
+    def _open_instance_store(file_path: str) -> Optional[InstanceStore]:
+        """
+        The :class:`InstanceStore` of the ``.instances`` file ``file_path``, if it exists and the file
+        did not change since it was built.
+        """
+        if not InstanceStore.exists(file_path + STORE_SUFFIX):
+            return None
+        store = InstanceStore(file_path + STORE_SUFFIX)
+        if not store.is_built_from(file_path):
+            logger.warning("ignore the instance store %s, %s changed since it was built",
+                           store.path, file_path)
+            return None
+        return store
+
+    def _read_instance_store(self, store: InstanceStore, file_path: str):
+        """
+        Reads the :class:`InstanceStore` built from the ``.instances`` file ``file_path``, with the
+        same filters as :func:`_read_instances_file`.
+        """
+        if self._token_mapper is not None:
+            store_ids = self._token_mapper.intern(store.tokens)
+        for index in shard_range(len(store)):
+            if self.max_samples != -1 and index > self.max_samples:
+                break
+            if self._token_mapper is None:
+                json_obj = store[index]
+                if self._keep_json_obj(json_obj, file_path):
+                    yield self._json_blob_to_instance(json_obj)
+            elif self._keep_json_obj(store.filter_fields(index), file_path):
+                yield store_to_indexed_instance(self._token_mapper, store, index, store_ids)
+
+    @staticmethod
+    def _keep_json_obj(json_obj, file_path: str) -> bool:
+        if 'train' in file_path:
+            if not sum(json_obj['answer_texts'], []):
+                return False
+            elif not json_obj['token_spans']:
+                return False
+            try:
+                if all([a[0] == [-1, -1] for a in json_obj['token_spans']]):
+                    return False
+            except Exception as e:
+                pass
+            # try:
+            #     if sum([a[0] == [-1, -1] for a in json_obj['token_spans']]) !=\
+            #             len(json_obj['token_spans']) - 1:
+            #         return False
+            # except Exception as e:
+            #     pass
+        if 'dev' in file_path:
+            if not sum(json_obj['answer_texts'], []):
+                return False
+        return True
 
     def _json_blob_to_instance(self, json_obj) -> Instance:
+        if self._token_mapper is not None:
+            return json_obj_to_indexed_instance(self._token_mapper, json_obj)
         question_tokens = [Token(text=text, idx=idx) for text, idx in json_obj['question_tokens']]
         passages_tokens = [[Token(text=text, idx=idx) for text, idx in passage_tokens]
                            for passage_tokens in json_obj['passages_tokens']]
@@ -264,14 +372,13 @@ class MsmarcoMultiPassageReader(DatasetReader):
                             for passage_tokens in passages_tokens]
         token_spans = []
         for passage_id, span_in_passage in enumerate(char_spans):
-            passage_offsets = passages_offsets[passage_id]
+            offset_index = TokenOffsetIndex(passages_offsets[passage_id])
             passage_token_spans: List[Tuple[int, int]] = []
-            for char_span_start, char_span_end in span_in_passage:
-                if char_span_end > passage_offsets[-1][1]:
+            for (char_span_start, char_span_end), token_span in zip(span_in_passage,
+                                                                    offset_index.token_spans(span_in_passage)):
+                if token_span is None:
                     continue
-                (span_start, span_end), error = self.char_span_to_token_span(
-                    passage_offsets,
-                    (char_span_start, char_span_end))
+                (span_start, span_end), error = token_span
                 if error:
                     logger.debug("Passage: %s", passages_texts[passage_id])
                     logger.debug("Passage tokens: %s", passages_tokens[passage_id])
@@ -364,37 +471,4 @@ class MsmarcoMultiPassageReader(DatasetReader):
             Whether the token spans match the input character spans exactly.  If this is ``False``, it
             means there was an error in either the tokenization or the annotated character span.
         """
-        # We have token offsets into the passage from the tokenizer; we _should_ be able to just find
-        # the tokens that have the same offsets as our span.
-        error = False
-        start_index = 0
-        while start_index < len(token_offsets) and token_offsets[start_index][0] < character_span[0]:
-            start_index += 1
-        # start_index should now be pointing at the span start index.
-        if start_index == len(token_offsets) or token_offsets[start_index][0] > character_span[0]:
-            # In this case, a tokenization or labeling issue made us go too far - the character span
-            # we're looking for actually starts in the previous token.  We'll back up one.
-            logger.debug("Bad labelling or tokenization - start offset doesn't match")
-            start_index -= 1
-        if token_offsets[start_index][0] != character_span[0]:
-            error = True
-        end_index = start_index
-        while end_index < len(token_offsets) and token_offsets[end_index][1] < character_span[1]:
-            end_index += 1
-        if end_index == len(token_offsets):
-            logger.debug("Bad labelling or tokenization - end offset doesn't match")
-            end_index -= 1
-        elif end_index == start_index and token_offsets[end_index][1] > character_span[1]:
-            # Looks like there was a token that should have been split, like "1854-1855", where the
-            # answer is "1854".  We can't do much in this case, except keep the answer as the whole
-            # token.
-            logger.debug("Bad tokenization - end offset doesn't match")
-        elif token_offsets[end_index][1] > character_span[1]:
-            # This is a case where the given answer span is more than one token, and the last token is
-            # cut off for some reason, like "split with Luckett and Rober", when the original passage
-            # said "split with Luckett and Roberson".  In this case, we'll just keep the end index
-            # where it is, and assume the intent was to mark the whole token.
-            logger.debug("Bad labelling or tokenization - end offset doesn't match")
-        if token_offsets[end_index][1] != character_span[1]:
-            error = True
-        return (start_index, end_index), error
+        return TokenOffsetIndex(token_offsets).token_span(character_span)
@@ -0,0 +1,196 @@
+"""
+A ``DataIterator`` that reads, indexes and pads the batches of an epoch in worker processes and
+hands them to the trainer through a bounded prefetch queue.
+
+Every worker reads its own shard of the dataset: the readers only read the byte range of the
+``.instances`` file (or the indices of the instance store) of the shard given to them with
+:func:`sharding.set_current_shard`, so no instance is built twice and the main process does not
+read the data at all.  Readers without shard support are split round robin after reading.  The
+batches are created by ``base_iterator`` in the workers and their tensors travel through shared
+memory; a thread of the main process copies them to pinned memory when training on a GPU.
+"""
+import logging
+import queue
+import threading
+import time
+import traceback
+from typing import Iterable, Iterator, List
+
+import torch
+import torch.multiprocessing
+from overrides import overrides
+
+from allennlp.data.instance import Instance
+from allennlp.data.iterators.data_iterator import DataIterator, TensorDict
+from allennlp.data.vocabulary import Vocabulary
+
+from .scripts import sharding
+
+logger = logging.getLogger(__name__)
+
+
+class _WorkerError:
+    def __init__(self, worker_index: int, message: str) -> None:
+        self.worker_index = worker_index
+        self.message = message
+
+
+def _shard_instances(instances: Iterable[Instance], num_workers: int, worker_index: int) -> Iterator[Instance]:
+    if isinstance(instances, list):
+        yield from instances[worker_index::num_workers]
+        return
+    for count, instance in enumerate(instances):
+        # a reader that supports shards only gives the instances of this worker
+        if sharding.current_shard_used() or count % num_workers == worker_index:
+            yield instance
+
+
+def _produce_batches(instances: Iterable[Instance],
+                     iterator: DataIterator,
+                     shuffle: bool,
+                     num_workers: int,
+                     worker_index: int,
+                     output_queue,
+                     done) -> None:
+    torch.set_num_threads(1)
+    sharding.set_current_shard(num_workers, worker_index)
+    try:
+        for tensor_dict in iterator(_shard_instances(instances, num_workers, worker_index),
+                                    num_epochs=1, shuffle=shuffle):
+            output_queue.put(tensor_dict)
+    except Exception:  # pylint: disable=broad-except
+        output_queue.put(_WorkerError(worker_index, traceback.format_exc()))
+    output_queue.put(worker_index)
+    # the tensors in shared memory must outlive the worker until the trainer received them
+    done.wait()
+
+
+def _pin_memory(tensor_dict):
+    if isinstance(tensor_dict, torch.Tensor):
+        return tensor_dict.pin_memory()
+    if isinstance(tensor_dict, dict):
+        return {key: _pin_memory(value) for key, value in tensor_dict.items()}
+    return tensor_dict
+
+
+def _pin_batches(input_queue, output_queue: queue.Queue, num_workers: int) -> None:
+    finished = 0
+    while finished < num_workers:
+        item = input_queue.get()
+        if isinstance(item, int):
+            finished += 1
+        elif not isinstance(item, _WorkerError):
+            item = _pin_memory(item)
+        output_queue.put(item)
+
+
+@DataIterator.register("prefetch")
+class PrefetchIterator(DataIterator):
+    """
+    Wraps another ``DataIterator`` and runs it in ``num_workers`` processes, each on its own shard
+    of the dataset, for every epoch.  The order of the batches of different workers depends on
+    their speed, and ``max_samples`` of the readers applies to every shard.
+
+    The fraction of the epoch the trainer spent waiting for batches is logged at the end of every
+    epoch and kept in ``data_wait_fractions``.
+
+    Parameters
+    ----------
+    base_iterator : ``DataIterator``
+        Creates the batches of a shard, e.g. a ``bucket`` iterator.
+    num_workers : ``int``, optional (default = 4)
+        The number of worker processes.
+    prefetch_batches : ``int``, optional (default = 16)
+        The maximum number of batches waiting for the trainer.
+    pin_memory : ``bool``, optional (default = True)
+        Copy the batches to pinned memory, for faster transfers to the GPU.  Ignored without CUDA.
+    """
+    def __init__(self,
+                 base_iterator: DataIterator,
+                 num_workers: int = 4,
+                 prefetch_batches: int = 16,
+                 pin_memory: bool = True) -> None:
+        super().__init__()
+        self.base_iterator = base_iterator
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.data_wait_fractions: List[float] = []
+
+    @overrides
+    def index_with(self, vocab: Vocabulary) -> None:
+        self.vocab = vocab
+        self.base_iterator.index_with(vocab)
+
+    @overrides
+    def get_num_batches(self, instances: Iterable[Instance]) -> int:
+        return self.base_iterator.get_num_batches(instances)
+
+    @overrides
+    def _create_batches(self, instances: Iterable[Instance], shuffle: bool):
+        raise RuntimeError("PrefetchIterator doesn't use create_batches")
+
+    def __call__(self,
+                 instances: Iterable[Instance],
+                 num_epochs: int = None,
+                 shuffle: bool = True) -> Iterator[TensorDict]:
+        epoch = 0
+        while num_epochs is None or epoch < num_epochs:
+            epoch += 1
+            yield from self._epoch(instances, shuffle)
+
+    @staticmethod
+    def _get(batch_queue, workers):
+        while True:
+            try:
+                return batch_queue.get(timeout=5)
+            except queue.Empty:
+                dead = [worker.exitcode for worker in workers if worker.exitcode is not None]
+                if dead:
+                    raise RuntimeError("prefetch workers exited unexpectedly with %s" % dead)
+
+    def _epoch(self, instances: Iterable[Instance], shuffle: bool) -> Iterator[TensorDict]:
+        # fork, so that lazy instances (closures over the reader) need not be pickled
+        context = torch.multiprocessing.get_context('fork')
+        worker_queue = context.Queue(self.prefetch_batches)
+        done = context.Event()
+        workers = [context.Process(target=_produce_batches,
+                                   args=(instances, self.base_iterator, shuffle,
+                                         self.num_workers, index, worker_queue, done),
+                                   daemon=True)
+                   for index in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        batch_queue = worker_queue
+        if self.pin_memory:
+            batch_queue = queue.Queue(self.prefetch_batches)
+            threading.Thread(target=_pin_batches, args=(worker_queue, batch_queue, self.num_workers),
+                             daemon=True).start()
+
+        start = time.time()
+        wait = 0.0
+        num_batches = 0
+        finished = 0
+        try:
+            while finished < self.num_workers:
+                wait_start = time.time()
+                item = self._get(batch_queue, workers)
+                wait += time.time() - wait_start
+                if isinstance(item, int):
+                    finished += 1
+                elif isinstance(item, _WorkerError):
+                    raise RuntimeError("prefetch worker %d failed:\n%s" % (item.worker_index, item.message))
+                else:
+                    num_batches += 1
+                    yield item
+        finally:
+            done.set()
+            for worker in workers:
+                worker.join(timeout=1)
+                if worker.is_alive():
+                    worker.terminate()
+        elapsed = time.time() - start
+        fraction = wait / elapsed if elapsed > 0 else 0.0
+        self.data_wait_fractions.append(fraction)
+        logger.info("epoch of %d batches in %.1fs, %.1f%% of it waiting for data",
+                    num_batches, elapsed, 100 * fraction)
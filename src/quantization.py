@@ -0,0 +1,159 @@
+# encoding: utf-8
+"""
+@file: quantization.py
+
+Dynamic int8 quantization of VNet for CPU inference: the weights of every ``LSTM`` (the phrase
+and modeling layers, the pointer net encoder) and every ``Linear`` (highway, content layers,
+``_ptr_layer_*``, passage predictor, ...) are stored in int8 and the activations are quantized
+on the fly, batch by batch, so no calibration data is needed.  The embeddings, the character CNN
+and the attentions stay in fp32.  The ``vnet_msmarco_int8`` and ``vnet_dureader_int8`` predictors
+use :func:`quantize_vnet`.
+
+The report compares the int8 model with the fp32 model on a slice of a dev set: Rouge-L,
+BLEU-4, the fraction of identical answers, the latency per batch, the size of the weights and
+the relative error of every quantized weight::
+
+    python -m src.quantization model.tar.gz dev.json --num_samples 500 > quantization.json
+"""
+import argparse
+import copy
+import io
+import itertools
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Set, Type
+
+import torch
+
+from allennlp.common.util import import_submodules, lazy_groups_of
+from allennlp.data import DatasetReader, Instance
+
+from .modules.Pointer_Network import PointerNet
+from .vnet import VNet
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_MODULES = {torch.nn.LSTM, torch.nn.Linear}
+MODULE_TYPES = {'lstm': torch.nn.LSTM, 'linear': torch.nn.Linear}
+
+
+def quantize_vnet(model: VNet,
+                  module_types: Set[Type[torch.nn.Module]] = None,
+                  dtype: torch.dtype = torch.qint8) -> VNet:
+    """
+    A copy of ``model`` on the CPU, in evaluation mode, with dynamically quantized layers of
+    ``module_types`` (default: ``LSTM`` and ``Linear``).  It is meant for inference: its state
+    dict can not be loaded in a VNet.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    if isinstance(model._pointer_net, PointerNet):  # pylint: disable=protected-access
+        model._pointer_net._decoder.drop_zero_half()  # pylint: disable=protected-access
+    return torch.quantization.quantize_dynamic(model, module_types or QUANTIZED_MODULES, dtype=dtype, inplace=True)
+
+
+def _quantized_weights(module: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    if hasattr(module, 'get_weight'):
+        weights = module.get_weight()
+    elif callable(getattr(module, 'weight', None)):
+        weights = {'weight': module.weight()}
+    else:
+        return {}
+    return {name: weight.dequantize() if weight.is_quantized else weight for name, weight in weights.items()}
+
+
+def weight_errors(model: VNet, quantized: VNet) -> Dict[str, float]:
+    """
+    ``|w - dequantize(quantize(w))| / |w|`` of every quantized weight of ``quantized``, by the name
+    of the weight in ``model``.
+    """
+    parameters = dict(model.named_parameters())
+    errors = {}
+    for name, module in quantized.named_modules():
+        for weight_name, weight in _quantized_weights(module).items():
+            full_name = '%s.%s' % (name, weight_name)
+            original = parameters.get(full_name)
+            if original is None:
+                continue
+            # only the first half of ``_ptr_layer_1`` is kept, see ``PointerNetDecoder.drop_zero_half``
+            original = original.detach().cpu()[..., :weight.size(-1)]
+            errors[full_name] = float((original - weight).norm() / original.norm().clamp(min=1e-12))
+    return errors
+
+
+def _size_mb(model: torch.nn.Module) -> float:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def evaluate(model: VNet, instances: List[Instance], batch_size: int) -> Dict[str, Any]:
+    """ The metrics of ``model`` on ``instances``, its answers and its latency per batch. """
+    model.get_metrics(reset=True)
+    answers = []
+    elapsed = 0.0
+    num_batches = 0
+    with torch.no_grad():
+        for batch in lazy_groups_of(iter(instances), batch_size):
+            start = time.time()
+            outputs = model.forward_on_instances(batch)
+            elapsed += time.time() - start
+            num_batches += 1
+            answers.extend(output['best_span_str'] for output in outputs)
+    metrics = model.get_metrics(reset=True)
+    return {'metrics': {'rouge_L': metrics['rouge_L'], 'bleu_4': metrics['bleu_4']},
+            'answers': answers,
+            'ms_per_batch': elapsed / max(num_batches, 1) * 1000,
+            'size_mb': _size_mb(model)}
+
+
+def quantization_report(model: VNet,
+                        instances: Iterable[Instance],
+                        batch_size: int = 16,
+                        module_types: Set[Type[torch.nn.Module]] = None) -> Dict[str, Any]:
+    """
+    Compares ``model`` in fp32 on the CPU with :func:`quantize_vnet` of it on ``instances`` (with
+    their answers); see the module docstring.
+    """
+    instances = list(instances)
+    fp32 = copy.deepcopy(model).cpu().eval()
+    int8 = quantize_vnet(fp32, module_types)
+    report: Dict[str, Any] = {'num_samples': len(instances), 'batch_size': batch_size}
+    answers = {}
+    for name, evaluated in (('fp32', fp32), ('int8', int8)):
+        result = evaluate(evaluated, instances, batch_size)
+        answers[name] = result.pop('answers')
+        report[name] = result
+    report['same_answers'] = sum(fp32_answer == int8_answer for fp32_answer, int8_answer
+                                 in zip(answers['fp32'], answers['int8'])) / max(len(instances), 1)
+    report['speedup'] = report['fp32']['ms_per_batch'] / max(report['int8']['ms_per_batch'], 1e-9)
+    report['weight_errors'] = weight_errors(fp32, int8)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a VNet archive with its dynamic int8 quantization.')
+    parser.add_argument('archive_file', help='the model.tar.gz of a trained model')
+    parser.add_argument('input_file', help='the dev set, read with the validation dataset reader')
+    parser.add_argument('--num_samples', type=int, default=500, help='the size of the dev slice')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_threads', type=int, default=None, help='torch threads, default: all')
+    parser.add_argument('--module_types', nargs='+', choices=sorted(MODULE_TYPES), default=sorted(MODULE_TYPES),
+                        help='the layers to quantize')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    from allennlp.models.archival import load_archive
+    import_submodules('src')
+    archive = load_archive(args.archive_file)
+    reader_params = archive.config.get('validation_dataset_reader', archive.config['dataset_reader'])
+    dataset_reader = DatasetReader.from_params(reader_params.duplicate())
+    instances = list(itertools.islice(dataset_reader.read(args.input_file), args.num_samples))
+    module_types = {MODULE_TYPES[name] for name in args.module_types}
+    print(json.dumps(quantization_report(archive.model, instances, args.batch_size, module_types), indent=2))
+
+
+if __name__ == '__main__':
+    main()
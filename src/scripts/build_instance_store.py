@@ -0,0 +1,26 @@
+"""
+Converts ``.instances`` files to the memory-mapped ``.instances.store`` directories that
+``MsmarcoMultiPassageReader`` picks up automatically.
+
+    python src/scripts/build_instance_store.py data/train.json.instances data/dev.json.instances
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+from src.instance_store import InstanceStore, STORE_SUFFIX
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('instances_files', nargs='+', help='.instances or .char.instances files')
+    args = parser.parse_args()
+    for file_path in args.instances_files:
+        start_time = time.time()
+        store = InstanceStore.from_instances_file(file_path)
+        print('%s: %d samples -> %s (%.1fs)' % (file_path, len(store), file_path + STORE_SUFFIX,
+                                                time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
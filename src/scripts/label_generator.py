@@ -4,6 +4,9 @@
 from allennlp.data.tokenizers.word_splitter import SpacyWordSplitter
 from typing import List
 import numpy
+import sys
+sys.path.append(".")
+from src.scripts.lcs import lcs_length
 
 class LabelGenerator(object):
     def __init__(self,
@@ -118,15 +121,7 @@ class LabelGenerator(object):
         return list(argstart[::-1][0:output_len]),list(argend[::-1][0:output_len])
     @staticmethod
     def get_lcs(token_a, token_p):
-        lcs_map = [[0 for _ in range(0, len(token_p) + 1)]
-                    for _ in range(0, len(token_a) + 1)]
-        for j in range(1, len(token_p) + 1):
-            for i in range(1, len(token_a) + 1):
-                if (token_a[i - 1] == token_p[j - 1]):
-                    lcs_map[i][j] = lcs_map[i - 1][j - 1] + 1
-                else:
-                    lcs_map[i][j] = max(lcs_map[i - 1][j], lcs_map[i][j - 1])
-        return lcs_map[-1][-1]
+        return lcs_length(token_a, token_p)
     @staticmethod
     def get_rouge_l(lcs, answer_length, span_length):
         beta = 1.2
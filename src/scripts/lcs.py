@@ -0,0 +1,68 @@
+"""
+Longest common subsequence lengths shared by every Rouge-L computation.
+
+We use the bit-parallel algorithm of Allison-Dix / Hyyrö: the ``m`` cells of a column of the
+dynamic program are stored as the bits of one integer, so each token of the second sequence is
+a handful of integer operations instead of ``m`` interpreted steps.  Python integers have arbitrary
+precision, so answers of any length fit in one bit vector.
+
+Hyyrö, H. (2004). Bit-parallel LCS-length computation revisited.
+"""
+from typing import Dict, Hashable, List, Sequence
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    def _popcount(value: int) -> int:
+        return bin(value).count('1')
+
+
+def _match_masks(token_a: Sequence[Hashable]) -> Dict[Hashable, int]:
+    """ Maps every token of ``token_a`` to the bit mask of its positions in ``token_a``. """
+    masks: Dict[Hashable, int] = {}
+    for i, token in enumerate(token_a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+
+def lcs_row(token_a: Sequence[Hashable], token_p: Sequence[Hashable]) -> List[int]:
+    """
+    The last row of the LCS table of ``token_a`` (rows) and ``token_p`` (columns): element ``j``
+    is the LCS length of ``token_a`` and ``token_p[:j]``, so the row has ``len(token_p) + 1`` items.
+    """
+    length_a = len(token_a)
+    full = (1 << length_a) - 1
+    masks = _match_masks(token_a)
+    row = [0]
+    v = full
+    lcs = 0
+    for token in token_p:
+        u = masks.get(token)
+        if u is not None:
+            u &= v
+            if u:
+                v = ((v + u) | (v - u)) & full
+                lcs = length_a - _popcount(v)
+        row.append(lcs)
+    return row
+
+
+def lcs_rows(token_as: Sequence[Sequence[Hashable]], token_p: Sequence[Hashable]) -> List[List[int]]:
+    """ :func:`lcs_row` of every answer in ``token_as`` against the passage ``token_p``. """
+    return [lcs_row(token_a, token_p) for token_a in token_as]
+
+
+def lcs_length(token_a: Sequence[Hashable], token_p: Sequence[Hashable]) -> int:
+    """ The LCS length of ``token_a`` and ``token_p``. """
+    if len(token_a) > len(token_p):
+        token_a, token_p = token_p, token_a
+    length_a = len(token_a)
+    full = (1 << length_a) - 1
+    masks = _match_masks(token_a)
+    v = full
+    for token in token_p:
+        u = masks.get(token)
+        if u is not None:
+            u &= v
+            v = ((v + u) | (v - u)) & full
+    return length_a - _popcount(v)
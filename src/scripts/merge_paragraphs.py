@@ -9,11 +9,14 @@
 
 按照 http://aclweb.org/anthology/D18-1235 对 DuReader 数据集进行预处理
 """
+import argparse
+import functools
 import json
 import os
-import numpy as np
-from tqdm import tqdm_notebook as tqdm
-from src.utils import ChineseMaxF1Mesure
+import sys
+sys.path.append(".")
+from src.utils import ChineseMaxF1Mesure, F1Scorer
+from src.scripts.pipeline import imap_ordered, Throughput
 
 
 def first_sentence(text, grain_size='sentence'):
@@ -43,52 +46,133 @@ def first_sentence(text, grain_size='sentence'):
     return ''
 
 
-def merge_paragraphs(file_name, top_K=3):
-    f_read = open(file_name)
-    f_write = open(file_name + '.merge_passage', 'w')
-    measure = ChineseMaxF1Mesure()
-    for idx_l, line in tqdm(enumerate(f_read)):
-        # if idx_l > 10:
-        #     break
-        raw_json = json.loads(line)
-        for idx_doc, doc in enumerate(raw_json['documents']):
-            passage_text = ''
-            paragraph_score = []
-            for paragraphs in doc['paragraphs']:
-                refs = raw_json.get('answers') or [raw_json.get('question')]
-                score = measure.calc_score([paragraphs], refs)
-                paragraph_score.append(score)
-            np.array(paragraph_score).argsort()[-top_K:][::-1]
-            try:
-                rank = sorted(list(np.array(paragraph_score).argsort()[-top_K:][::-1]))[0]
-            except Exception as e:
-                rank = 0
-            passage_text += doc.get('title', '')[:20]
-            passage_text += ''.join(doc['paragraphs'][rank: rank + 2])
-            passage_text += ''.join([first_sentence(text) for text in doc['paragraphs'][rank + 2:]])
-            doc['paragraphs'] = [passage_text]
-            raw_json['documents'][idx_doc] = doc
-        f_write.write(json.dumps(raw_json, ensure_ascii=False) + '\n')
-    f_read.close()
+_scorer = None
+
+
+def paragraph_scorer():
+    # one scorer (and one reference cache) per worker process
+    global _scorer
+    if _scorer is None:
+        _scorer = F1Scorer(ChineseMaxF1Mesure())
+    return _scorer
+
+
+def merge_documents(raw_json, top_K=3):
+    scorer = paragraph_scorer()
+    for idx_doc, doc in enumerate(raw_json['documents']):
+        passage_text = ''
+        refs = raw_json.get('answers') or [raw_json.get('question')]
+        paragraph_score = scorer.score_many(doc['paragraphs'], refs)
+        try:
+            rank = sorted(list(paragraph_score.argsort()[-top_K:][::-1]))[0]
+        except Exception as e:
+            rank = 0
+        passage_text += doc.get('title', '')[:20]
+        passage_text += ''.join(doc['paragraphs'][rank: rank + 2])
+        passage_text += ''.join([first_sentence(text) for text in doc['paragraphs'][rank + 2:]])
+        doc['paragraphs'] = [passage_text]
+        raw_json['documents'][idx_doc] = doc
+    return raw_json
+
+
+def merge_line(item, top_K=3):
+    """ ``(end_offset, line)`` -> ``(end_offset, merged line)``, both lines as utf-8 bytes. """
+    end_offset, line = item
+    raw_json = merge_documents(json.loads(line.decode('utf-8')), top_K)
+    return end_offset, (json.dumps(raw_json, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def read_lines(f_read, offset):
+    """ Yields ``(end_offset, line)`` for every non-empty line of ``f_read`` from ``offset`` on. """
+    f_read.seek(offset)
+    for line in f_read:
+        offset += len(line)
+        if line.strip():
+            yield offset, line
+
+
+def file_stamp(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_checkpoint(checkpoint_path, file_name):
+    """ The checkpoint of a run over ``file_name``, ``None`` if there is none or the file changed since. """
+    if not os.path.isfile(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('input') != file_stamp(file_name):
+        print('ignore %s, %s changed since' % (checkpoint_path, file_name), file=sys.stderr)
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, input_stamp, input_offset, output_offset):
+    with open(checkpoint_path + '.tmp', 'w') as f:
+        json.dump({'input': input_stamp, 'input_offset': input_offset, 'output_offset': output_offset}, f)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+
+def merge_paragraphs(file_name, top_K=3, workers=None, resume=True, checkpoint_every=1000):
+    """
+    Writes ``file_name + '.merge_passage'``. Lines are merged by ``workers`` processes and written
+    in input order.  Every ``checkpoint_every`` lines the byte offsets reached in the input and
+    the output are saved to ``file_name + '.merge_passage.checkpoint'``, with the size and
+    modification time of the input; with ``resume`` a new run over the same input truncates the
+    output to the last checkpoint and continues from there.  The checkpoint is removed once the
+    whole file is merged, so the next run merges it again.
+    """
+    output_name = file_name + '.merge_passage'
+    checkpoint_path = output_name + '.checkpoint'
+    input_stamp = file_stamp(file_name)
+    checkpoint = load_checkpoint(checkpoint_path, file_name) if resume and os.path.isfile(output_name) else None
+    if checkpoint is not None:
+        input_offset, output_offset = checkpoint['input_offset'], checkpoint['output_offset']
+        print('resume %s from byte %d' % (file_name, input_offset), file=sys.stderr)
+        f_write = open(output_name, 'r+b')
+        f_write.seek(output_offset)
+        f_write.truncate()
+    else:
+        input_offset = 0
+        f_write = open(output_name, 'wb')
+    throughput = Throughput(os.path.basename(file_name))
+    with open(file_name, 'rb') as f_read:
+        results = imap_ordered(functools.partial(merge_line, top_K=top_K),
+                               read_lines(f_read, input_offset),
+                               workers=workers)
+        for count, (input_offset, merged_line) in enumerate(results, 1):
+            f_write.write(merged_line)
+            throughput.update()
+            if count % checkpoint_every == 0:
+                f_write.flush()
+                save_checkpoint(checkpoint_path, input_stamp, input_offset, f_write.tell())
     f_write.close()
+    if os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    throughput.report()
+
+
+DUREADER_FILES = ['trainset/search.train.json', 'trainset/zhidao.train.json',
+                  'devset/search.dev.json', 'devset/zhidao.dev.json',
+                  'testset/search.test.json', 'testset/zhidao.test.json']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the paragraphs of DuReader documents '
+                                                 '(writes <file>.merge_passage).')
+    parser.add_argument('files', nargs='*',
+                        help='DuReader json files, default: the six raw DuReader files in --data_dir')
+    parser.add_argument('--data_dir', default='/data/nfsdata/meijie/data/dureader/raw/')
+    parser.add_argument('--top_k', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='default: number of CPUs')
+    parser.add_argument('--checkpoint_every', type=int, default=1000, help='lines')
+    parser.add_argument('--no_resume', action='store_true', help='ignore existing checkpoints')
+    args = parser.parse_args()
+    files = args.files or [os.path.join(args.data_dir, name) for name in DUREADER_FILES]
+    for file_name in files:
+        merge_paragraphs(file_name, args.top_k, args.workers, not args.no_resume, args.checkpoint_every)
 
 
 if __name__ == '__main__':
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/trainset/'
-    file_name = os.path.join(file_path, 'search.train.json')
-    merge_paragraphs(file_name)
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/trainset/'
-    file_name = os.path.join(file_path, 'zhidao.train.json')
-    merge_paragraphs(file_name)
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/devset/'
-    file_name = os.path.join(file_path, 'search.dev.json')
-    merge_paragraphs(file_name)
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/devset/'
-    file_name = os.path.join(file_path, 'zhidao.dev.json')
-    merge_paragraphs(file_name)
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/testset/'
-    file_name = os.path.join(file_path, 'search.test.json')
-    merge_paragraphs(file_name)
-    file_path = '/data/nfsdata/meijie/data/dureader/raw/testset/'
-    file_name = os.path.join(file_path, 'zhidao.test.json')
-    merge_paragraphs(file_name)
+    main()
@@ -0,0 +1,111 @@
+"""
+Helpers for the line-by-line preprocessing scripts: an order-preserving parallel map with a bounded
+number of lines in flight, and a throughput reporter.
+"""
+import collections
+import os
+import queue
+import sys
+import time
+from multiprocessing import Pool
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def imap_bounded(func: Callable[[T], R],
+                 items: Iterable[T],
+                 workers: int = None,
+                 max_in_flight: int = None,
+                 ordered: bool = True,
+                 initializer: Callable = None,
+                 initargs: tuple = ()) -> Iterator[R]:
+    """
+    ``map(func, items)`` over a process pool.
+
+    Unlike ``Pool.imap`` at most ``max_in_flight`` items (default ``64 * workers``) are read ahead,
+    so the memory stays bounded for inputs of any size and an interrupted run has only processed
+    a few items past the last result it yielded.  With ``ordered`` the results come in the order
+    of ``items``, otherwise as soon as they are ready.  ``workers=1`` runs ``func`` in this process.
+    """
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, items)
+        return
+    workers = workers or os.cpu_count()
+    pool = Pool(workers, initializer=initializer, initargs=initargs)
+    max_in_flight = max_in_flight or 64 * workers
+    # results in the order of submission, and in the order of completion if not ``ordered``
+    pending = collections.deque()
+    done = queue.Queue()
+    callback = None if ordered else done.put
+
+    def next_result():
+        result = pending.popleft()
+        if ordered:
+            return result.get()
+        return _unordered_result(done.get())
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,), callback=callback, error_callback=callback))
+            if len(pending) >= max_in_flight:
+                yield next_result()
+        while pending:
+            yield next_result()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _unordered_result(result):
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def imap_ordered(func: Callable[[T], R],
+                 items: Iterable[T],
+                 workers: int = None,
+                 max_in_flight: int = None,
+                 initializer: Callable = None,
+                 initargs: tuple = ()) -> Iterator[R]:
+    """ :func:`imap_bounded` with the results in the order of ``items``. """
+    return imap_bounded(func, items, workers, max_in_flight, True, initializer, initargs)
+
+
+def chunked(items: Iterable[T], chunk_size: int) -> Iterator[List[T]]:
+    """ Groups ``items`` in lists of ``chunk_size`` (the last one may be shorter). """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Throughput:
+    """
+    Prints the number of processed lines and lines/sec at most every ``interval`` seconds.
+    """
+    def __init__(self, name: str, interval: float = 30.0, stream=sys.stderr):
+        self.name = name
+        self.interval = interval
+        self.stream = stream
+        self.count = 0
+        self.start_time = self.last_report = time.time()
+
+    def update(self, count: int = 1) -> None:
+        self.count += count
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        print('%s: %d lines, %.1f lines/sec' % (self.name, self.count, self.count / elapsed),
+              file=self.stream, flush=True)
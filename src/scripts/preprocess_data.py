@@ -1,9 +1,12 @@
 import json
+import sys
 from allennlp.data.tokenizers import WordTokenizer
 from tqdm import tqdm
 import pickle
 from multiprocessing import Pool
 from typing import List, Tuple
+sys.path.append(".")
+from src.scripts.span_utils import TokenOffsetIndex
 tokenizer = WordTokenizer()
 
 
@@ -28,15 +31,9 @@ def data_to_json_obj(data):
                         for passage_tokens in passages_tokens]
     token_spans = []
     for passage_id, span_in_passage in enumerate(char_spans):
-        passage_offsets = passages_offsets[passage_id]
-        passage_token_spans: List[Tuple[int, int]] = []
-        for char_span_start, char_span_end in span_in_passage:
-            if char_span_end > passage_offsets[-1][1]:
-                continue
-            (span_start, span_end), error = char_span_to_token_span(
-                passage_offsets,
-                (char_span_start, char_span_end))
-            passage_token_spans.append((span_start, span_end))
+        offset_index = TokenOffsetIndex(passages_offsets[passage_id])
+        passage_token_spans: List[Tuple[int, int]] = [token_span for token_span, error in
+                                                      filter(None, offset_index.token_spans(span_in_passage))]
         if not passage_token_spans:
             passage_token_spans.append((-1, -1))
         token_spans.append(passage_token_spans)
@@ -66,25 +63,5 @@ def main():
     return
 
 
-def char_span_to_token_span(token_offsets: List[Tuple[int, int]],
-                            character_span: Tuple[int, int]) -> Tuple[Tuple[int, int], bool]:
-    error = False
-    start_index = 0
-    while start_index < len(token_offsets) and token_offsets[start_index][0] < character_span[0]:
-        start_index += 1
-    if start_index == len(token_offsets) or token_offsets[start_index][0] > character_span[0]:
-        start_index -= 1
-    if token_offsets[start_index][0] != character_span[0]:
-        error = True
-    end_index = start_index
-    while end_index < len(token_offsets) and token_offsets[end_index][1] < character_span[1]:
-        end_index += 1
-    if end_index == len(token_offsets):
-        end_index -= 1
-    if token_offsets[end_index][1] != character_span[1]:
-        error = True
-    return (start_index, end_index), error
-
-
 if __name__ == '__main__':
     main()
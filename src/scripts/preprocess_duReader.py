@@ -1,58 +1,47 @@
+import argparse
+import functools
 import json
 import sys
 import os
-from tqdm import tqdm
-from multiprocessing import Pool
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 from collections import namedtuple
 sys.path.append(".")
+from src.scripts.rouge_span import best_rouge_l_span
+from src.scripts.span_utils import TokenOffsetIndex
+from src.scripts.pipeline import imap_bounded, chunked, Throughput
 try:
     from src.utils import get_ans_by_f1
-    from src.utils import get_lcs, get_rouge_l
 except Exception as e:
     print(e)
 
+Token = namedtuple('Token', ['text', 'idx'])
+
+
+class PreprocessConfig(NamedTuple):
+    """
+    Options of the DuReader to ``.instances`` conversion, passed explicitly to the workers.
+    """
+    char_only: bool = True
+    drop_invalid: bool = False
+    max_passage_len: int = 500
+    fuzzy_matching: bool = False
+    max_question_len: int = 50
+    f1_or_rougeL: str = 'rougeL'
+    max_num_characters: int = 30
+
+
+DEFAULT_CONFIG = PreprocessConfig()
+
 
 def get_answers_with_RougeL(passage, answers, threshold=0.7):
     answers = list(set(answers))
     token_as = [list(ans) for ans in answers]
     token_p = list(passage)
-    candidates = []
-    lcs = get_lcs(token_as, token_p)
-    for lo in range(len(token_p)):
-        for hi in range(lo, len(token_p)):
-            candidate = ' '.join(token_p[lo:hi])
-            if all(ch == ' ' for ch in candidate):
-                continue
-            score = get_rouge_l(lcs, token_as, lo + 1, hi + 1)
-            if score > threshold:
-                if len(candidates) > 0:
-                    if lo == candidates[-1]['lo']:
-                        if score < candidates[-1]['score']:
-                            break
-                        elif score > candidates[-1]['score']:
-                            candidates = candidates[:-1]
-                    elif hi == candidates[-1]['hi'] and score < candidates[-1]['score']:
-                        break
-                    while len(candidates) > 1 and hi == candidates[-1]['hi'] and \
-                            score > candidates[-1]['score']:
-                        candidates = candidates[:-1]
-                        if len(candidates) == 0:
-                            break
-                candidates.append({'candidate': candidate,
-                                   'lo': lo,
-                                   'hi': hi,
-                                   'score': score})
-    max_score = 0
-    best_answer = ''
-    for candidate in candidates:
-        if candidate['score'] > max_score:
-            best_answer = candidate['candidate']
-            max_score = candidate['score']
-    if best_answer != '':
-        return [best_answer]
-    else:
+    span = best_rouge_l_span(token_as, token_p, threshold)
+    if span is None:
         return []
+    lo, hi = span
+    return [' '.join(token_p[lo:hi])]
 
 
 def segmented_text_to_tuples(tokens):
@@ -64,26 +53,6 @@ def segmented_text_to_tuples(tokens):
     return result
 
 
-def char_span_to_token_span(token_offsets: List[Tuple[int, int]],
-                            character_span: Tuple[int, int]) -> Tuple[Tuple[int, int], bool]:
-    error = False
-    start_index = 0
-    while start_index < len(token_offsets) and token_offsets[start_index][0] < character_span[0]:
-        start_index += 1
-    if start_index == len(token_offsets) or token_offsets[start_index][0] > character_span[0]:
-        start_index -= 1
-    if token_offsets[start_index][0] != character_span[0]:
-        error = True
-    end_index = start_index
-    while end_index < len(token_offsets) and token_offsets[end_index][1] < character_span[1]:
-        end_index += 1
-    if end_index == len(token_offsets):
-        end_index -= 1
-    if token_offsets[end_index][1] != character_span[1]:
-        error = True
-    return (start_index, end_index), error
-
-
 def get_em_ans(answers, passage_text, span_in_passage, answers_in_passage, flag_has_ans):
     for ans in answers:
         begin_idx = passage_text.replace(',', ' ').replace('.', ' ')\
@@ -97,7 +66,7 @@ def get_em_ans(answers, passage_text, span_in_passage, answers_in_passage, flag_
     return flag_has_ans
 
 
-def process_one_sample(data, fuzzy_matching=False):
+def process_one_sample(data, config: PreprocessConfig = DEFAULT_CONFIG):
     qid = data['query_id']
     query = data['query']
     question_tokens = data['question_tokens']
@@ -117,16 +86,17 @@ def process_one_sample(data, fuzzy_matching=False):
 
             flag_has_ans = get_em_ans(answers, passage_text, span_in_passage, answers_in_passage,
                                       flag_has_ans)
-            if fuzzy_matching:
+            if config.fuzzy_matching:
                 if not flag_has_ans and len(answers) > 0:
                     try:
-                        if f1_or_rougeL == 'f1':
-                            ans_f1 = get_ans_by_f1(passage_text[:max_passage_len * 2], answers)
+                        if config.f1_or_rougeL == 'f1':
+                            ans_f1 = get_ans_by_f1(passage_text[:config.max_passage_len * 2], answers)
                             flag_has_ans = get_em_ans(ans_f1, passage_text, span_in_passage,
                                                       answers_in_passage,
                                                       flag_has_ans)
-                        elif f1_or_rougeL == 'rougeL':
-                            ans_rougeL = get_answers_with_RougeL(passage_text[:max_passage_len * 2], answers)
+                        elif config.f1_or_rougeL == 'rougeL':
+                            ans_rougeL = get_answers_with_RougeL(passage_text[:config.max_passage_len * 2],
+                                                                 answers)
                             flag_has_ans = get_em_ans(ans_rougeL, passage_text, span_in_passage,
                                                       answers_in_passage,
                                                       flag_has_ans)
@@ -136,7 +106,7 @@ def process_one_sample(data, fuzzy_matching=False):
             # answer_texts for cal rouge-L
             # answer_texts.append(answers_in_passage)
             spans.append(span_in_passage)
-        if not flag_has_ans and drop_invalid:
+        if not flag_has_ans and config.drop_invalid:
             return None
         instance = (question_text, passage_texts, qid, answer_texts, spans, question_tokens, passages_tokens)
         return instance
@@ -145,7 +115,7 @@ def process_one_sample(data, fuzzy_matching=False):
         return (question_text, passage_texts, qid, answer_texts, spans, question_tokens, passages_tokens)
 
 
-def data_to_json_obj(data):
+def data_to_json_obj(data, config: PreprocessConfig = DEFAULT_CONFIG):
     question_text, passages_texts, qid, answer_texts, char_spans, question_tokens, passages_tokens = data
 
     json_obj = {}
@@ -157,11 +127,11 @@ def data_to_json_obj(data):
     # question_tokens = tokenizer.tokenize(question_text)
     # passages_tokens = [tokenizer.tokenize(passage_text) for passage_text in passages_texts]
 
-    passages_tokens = [passage_tokens[:max_passage_len] for passage_tokens in passages_tokens]
-    question_tokens = question_tokens[:max_question_len]
-    # if any([len(token.text) > max_num_characters for token in question_tokens]):
+    passages_tokens = [passage_tokens[:config.max_passage_len] for passage_tokens in passages_tokens]
+    question_tokens = question_tokens[:config.max_question_len]
+    # if any([len(token.text) > config.max_num_characters for token in question_tokens]):
     #     return None
-    # if any([len(token.text) > max_num_characters for sublist in passages_tokens for token in sublist]):
+    # if any([len(token.text) > config.max_num_characters for sublist in passages_tokens for token in sublist]):
     #     return None
     char_spans = char_spans or []
     # We need to convert character indices in `passage_text` to token indices in
@@ -171,15 +141,9 @@ def data_to_json_obj(data):
     token_spans = []
     if answer_texts:
         for passage_id, span_in_passage in enumerate(char_spans):
-            passage_offsets = passages_offsets[passage_id]
-            passage_token_spans: List[Tuple[int, int]] = []
-            for char_span_start, char_span_end in span_in_passage:
-                if char_span_end > passage_offsets[-1][1]:
-                    continue
-                (span_start, span_end), error = char_span_to_token_span(
-                    passage_offsets,
-                    (char_span_start, char_span_end))
-                passage_token_spans.append((span_start, span_end))
+            offset_index = TokenOffsetIndex(passages_offsets[passage_id])
+            passage_token_spans: List[Tuple[int, int]] = [token_span for token_span, error in
+                                                          filter(None, offset_index.token_spans(span_in_passage))]
             if not passage_token_spans:
                 passage_token_spans.append((-1, -1))
             token_spans.append(passage_token_spans)
@@ -192,7 +156,7 @@ def data_to_json_obj(data):
     return json_obj
 
 
-def process(l):
+def process(l, config: PreprocessConfig = DEFAULT_CONFIG):
     # DuReader to MSMarco
     j = json.loads(l)
     j['query_id'] = j.pop('question_id')
@@ -206,7 +170,7 @@ def process(l):
     except Exception as e:
         pass
     # char_only don't need jieba
-    if char_only:
+    if config.char_only:
         j['question_tokens'] = segmented_text_to_tuples([ch for ch in j['query'].replace(' ', '')])
     else:
         j['question_tokens'] = segmented_text_to_tuples(j.pop('segmented_question'))
@@ -220,7 +184,7 @@ def process(l):
         data['passage_text'] = ' '.join(k['paragraphs'])
         data['url'] = ''
         passages.append(data)
-    if char_only:
+    if config.char_only:
         j['passages_tokens'] = [segmented_text_to_tuples([ch for ch in ''.join(doc['paragraphs'])])
                                 for doc in j['documents']]
     else:
@@ -231,45 +195,83 @@ def process(l):
     # ---------
     # find word span, if fuzzy_matching is true, this will find best f1 match
     # ---------
-    instance = process_one_sample(j, fuzzy_matching)
+    instance = process_one_sample(j, config)
     if instance is None:
         return None
     # word span to char span and convert to json_obj format
-    json_obj = data_to_json_obj(instance)
+    json_obj = data_to_json_obj(instance, config)
     return json_obj
 
 
-def parallel_process_file(file_name):
-    if char_only:
-        f_save = open(file_name + '.char.instances', 'w')
-    else:
-        f_save = open(file_name + '.instances', 'w')
-    with open(file_name) as f:
-        dureader_data = f.readlines()
-    pool = Pool()
-    for json_obj in tqdm(pool.imap_unordered(process, dureader_data)):
+def process_chunk(lines, config: PreprocessConfig = DEFAULT_CONFIG):
+    """ Converts a chunk of DuReader lines to ``.instances`` lines. """
+    results = []
+    for line in lines:
+        json_obj = process(line, config)
         if json_obj is not None:
-            f_save.write(json.dumps(json_obj, ensure_ascii=False) + '\n')
-    f_save.close()
+            results.append(json.dumps(json_obj, ensure_ascii=False) + '\n')
+    return results
+
+
+def _process_counted_chunk(lines, config: PreprocessConfig = DEFAULT_CONFIG):
+    """ The number of ``lines`` and their ``.instances`` lines, which may be fewer. """
+    return len(lines), process_chunk(lines, config)
+
+
+def parallel_process_file(file_name, config: PreprocessConfig = DEFAULT_CONFIG, workers=None,
+                          chunk_size=64, max_in_flight=None, ordered=True, buffer_size=1 << 20):
+    """
+    Streams the lines of ``file_name`` to ``workers`` processes in chunks of ``chunk_size`` lines,
+    with at most ``max_in_flight`` chunks (default ``4 * workers``) read ahead, and writes
+    ``file_name + '.instances'`` (``.char.instances`` with ``config.char_only``) through a
+    ``buffer_size`` bytes buffer.  With ``ordered`` the output follows the input order.
+    """
+    if config.char_only:
+        output_name = file_name + '.char.instances'
+    else:
+        output_name = file_name + '.instances'
+    workers = workers or os.cpu_count()
+    throughput = Throughput(os.path.basename(file_name))
+    with open(file_name) as f, open(output_name, 'w', buffering=buffer_size) as f_save:
+        lines = (line for line in f if line.strip())
+        results = imap_bounded(functools.partial(_process_counted_chunk, config=config),
+                               chunked(lines, chunk_size),
+                               workers=workers,
+                               max_in_flight=max_in_flight or 4 * workers,
+                               ordered=ordered)
+        for num_lines, chunk in results:
+            f_save.writelines(chunk)
+            throughput.update(num_lines)
+    throughput.report()
 
 
 def main():
-    data_path = "/data/nfsdata/meijie/data/dureader/raw/devset"
-    file_name = os.path.join(data_path, 'zhidao.dev.json.merge_passage')
-    parallel_process_file(file_name)
-    data_path = "/data/nfsdata/meijie/data/dureader/raw/devset"
-    file_name = os.path.join(data_path, 'search.dev.json.merge_passage')
-    parallel_process_file(file_name)
+    parser = argparse.ArgumentParser(description='Convert (merged) DuReader files to .instances files.')
+    parser.add_argument('files', nargs='*', help='default: the merged dev files in --data_dir')
+    parser.add_argument('--data_dir', default='/data/nfsdata/meijie/data/dureader/raw/devset')
+    parser.add_argument('--workers', type=int, default=None, help='default: number of CPUs')
+    parser.add_argument('--chunk_size', type=int, default=64, help='lines per task')
+    parser.add_argument('--max_in_flight', type=int, default=None, help='chunks, default: 4 * workers')
+    parser.add_argument('--unordered', action='store_true', help='write lines as soon as they are done')
+    parser.add_argument('--words', action='store_true', help='use the segmented words, not characters')
+    parser.add_argument('--drop_invalid', action='store_true')
+    parser.add_argument('--fuzzy_matching', action='store_true')
+    parser.add_argument('--f1_or_rougeL', choices=['f1', 'rougeL'], default=DEFAULT_CONFIG.f1_or_rougeL)
+    parser.add_argument('--max_passage_len', type=int, default=DEFAULT_CONFIG.max_passage_len)
+    parser.add_argument('--max_question_len', type=int, default=DEFAULT_CONFIG.max_question_len)
+    args = parser.parse_args()
+    config = PreprocessConfig(char_only=not args.words,
+                              drop_invalid=args.drop_invalid,
+                              max_passage_len=args.max_passage_len,
+                              fuzzy_matching=args.fuzzy_matching,
+                              max_question_len=args.max_question_len,
+                              f1_or_rougeL=args.f1_or_rougeL)
+    files = args.files or [os.path.join(args.data_dir, 'zhidao.dev.json.merge_passage'),
+                           os.path.join(args.data_dir, 'search.dev.json.merge_passage')]
+    for file_name in files:
+        parallel_process_file(file_name, config, args.workers, args.chunk_size, args.max_in_flight,
+                              not args.unordered)
 
 
 if __name__ == '__main__':
-    Token = namedtuple('Token', ['text', 'idx'])
-    char_only = True
-    drop_invalid = False
-    max_passage_len = 500
-    fuzzy_matching = False
-    max_question_len = 50
-    f1_or_rougeL = 'rougeL'
-    max_num_characters = 30
-    # f1_or_rougeL = 'f1'
     main()
@@ -0,0 +1,93 @@
+"""
+Search of the passage span with the best Rouge-L against a set of answers, as done by
+``get_answers_with_RougeL``, on indices only.
+
+A span ``[lo, hi]`` (inclusive) is scored from the LCS rows of :func:`lcs_rows`: its LCS with the
+answer ``a`` is taken as ``lcs[a][hi + 1] - lcs[a][lo]``.  With ``P = max_a lcs_a / len(a) <= 1`` and
+``R = max_a lcs_a / (hi - lo + 1) <= max_a len(a) / (hi - lo + 1)``, the score
+``(1 + beta^2) P R / (R + beta^2 P)`` can only exceed ``threshold`` for spans shorter than
+``max_a len(a) * (1 + beta^2 - threshold) / (threshold * beta^2)`` tokens, so only that band of
+span lengths is scored, one span length at a time over all start positions.
+"""
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .lcs import lcs_rows
+
+
+def max_span_length(token_as: Sequence[Sequence[Hashable]], threshold: float, beta: float = 1.2) -> int:
+    """ An upper bound of the length of the spans that can score more than ``threshold``. """
+    max_len_a = max(len(token_a) for token_a in token_as)
+    if threshold <= 0:
+        return np.iinfo(np.int64).max
+    # + 1 keeps spans exactly at the bound, they are scored like any other span
+    return int(max_len_a * (1 + beta ** 2 - threshold) / (threshold * beta ** 2)) + 1
+
+
+def best_rouge_l_span(token_as: Sequence[Sequence[Hashable]],
+                      token_p: Sequence[str],
+                      threshold: float = 0.7,
+                      beta: float = 1.2) -> Optional[Tuple[int, int]]:
+    """
+    Returns the ``(lo, hi)`` of the answer chosen by ``get_answers_with_RougeL`` or ``None``.
+    ``get_answers_with_RougeL`` scores the span ``token_p[lo:hi + 1]`` but returns
+    ``' '.join(token_p[lo:hi])``, and skips the spans for which that string is blank.
+
+    Only the (few) spans above ``threshold`` are walked in ``(lo, hi)`` order to apply the same
+    candidate pruning as the original nested loops, so the result is identical.
+    """
+    num_tokens = len(token_p)
+    if not token_as or num_tokens < 2:
+        return None
+    lcs = np.asarray(lcs_rows(token_as, token_p), dtype=np.float64)
+    answer_lengths = np.array([float(len(token_a)) for token_a in token_as]).reshape(-1, 1)
+    # number of non-blank tokens in token_p[:i]
+    non_blank = np.concatenate([[0], np.cumsum([bool(token.strip(' ')) for token in token_p])])
+    max_length = min(num_tokens, max_span_length(token_as, threshold, beta))
+
+    los, his, scores = [], [], []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for length in range(2, max_length + 1):
+            lo = np.arange(0, num_tokens - length + 1)
+            hi = lo + length - 1
+            lcs_score = lcs[:, hi + 1] - lcs[:, lo]
+            prec_max = (lcs_score / answer_lengths).max(axis=0)
+            rec_max = (lcs_score / float(length)).max(axis=0)
+            score = ((1 + beta ** 2) * prec_max * rec_max) / (rec_max + beta ** 2 * prec_max)
+            score[(prec_max == 0) | (rec_max == 0)] = 0.0
+            keep = (score > threshold) & (non_blank[hi] - non_blank[lo] > 0)
+            los.append(lo[keep])
+            his.append(hi[keep])
+            scores.append(score[keep])
+    if not los:
+        return None
+    los, his, scores = np.concatenate(los), np.concatenate(his), np.concatenate(scores)
+    order = np.lexsort((his, los))
+
+    candidates: List[Tuple[int, int, float]] = []
+    skipped_lo = None
+    for lo, hi, score in zip(los[order].tolist(), his[order].tolist(), scores[order].tolist()):
+        if lo == skipped_lo:
+            continue
+        if len(candidates) > 0:
+            if lo == candidates[-1][0]:
+                if score < candidates[-1][2]:
+                    skipped_lo = lo
+                    continue
+                elif score > candidates[-1][2]:
+                    candidates = candidates[:-1]
+            elif hi == candidates[-1][1] and score < candidates[-1][2]:
+                skipped_lo = lo
+                continue
+            while len(candidates) > 1 and hi == candidates[-1][1] and score > candidates[-1][2]:
+                candidates = candidates[:-1]
+        candidates.append((lo, hi, score))
+
+    max_score = 0
+    best_span = None
+    for lo, hi, score in candidates:
+        if score > max_score:
+            best_span = (lo, hi)
+            max_score = score
+    return best_span
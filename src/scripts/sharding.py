@@ -0,0 +1,204 @@
+"""
+Splitting a line-delimited file into byte-range chunks that independent workers (processes of one
+machine, or machines sharing a file system) process and that are merged back in input order.
+
+Chunk ``i`` of ``n`` covers the bytes ``[i * size // n, (i + 1) * size // n)`` and owns the lines
+whose first byte lies in that range, so every line belongs to exactly one chunk and a worker only
+reads its own bytes.  Workers either take a static shard (the chunks ``i`` with
+``i % num_shards == shard_index``) or claim chunks from a shared work directory until none is left;
+a claim is the exclusive creation of ``<output>.<i>.claim``, which is atomic on a shared file system.
+The claim of a worker that died is not released: delete its ``.claim`` file (or run the chunk as a
+static shard) to process the chunk again.
+
+A process can also be given a current shard with :func:`set_current_shard`; the dataset readers
+then only read the lines (:func:`shard_lines`) or the store indices (:func:`shard_range`) of that
+shard, which is how the workers of the ``prefetch`` data iterator split a file between them.
+"""
+import json
+import os
+import socket
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+_current_shard: Optional[Tuple[int, int]] = None
+_current_shard_used = False
+
+
+def chunk_range(file_size: int, num_chunks: int, index: int) -> Tuple[int, int]:
+    """ The byte range ``[start, end)`` of chunk ``index`` of ``num_chunks``. """
+    return index * file_size // num_chunks, (index + 1) * file_size // num_chunks
+
+
+def read_lines(file_name: str, start: int, end: int) -> Iterator[bytes]:
+    """ Yields the lines of ``file_name`` that start in the byte range ``[start, end)``. """
+    with open(file_name, 'rb') as f:
+        position = start
+        if start > 0:
+            # the line containing byte ``start - 1`` belongs to the previous chunk
+            f.seek(start - 1)
+            position = start - 1 + len(f.readline())
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def set_current_shard(num_shards: Optional[int], shard_index: int = 0) -> None:
+    """ Makes the readers of this process read shard ``shard_index`` of ``num_shards`` only. """
+    global _current_shard, _current_shard_used
+    _current_shard = None if num_shards is None else (num_shards, shard_index)
+    _current_shard_used = False
+
+
+def current_shard_used() -> bool:
+    """ Whether a reader applied the current shard since :func:`set_current_shard`. """
+    return _current_shard_used
+
+
+def current_shard() -> Optional[Tuple[int, int]]:
+    """
+    ``(num_shards, shard_index)`` of this process, or ``None``.  A reader calling this applies the
+    shard itself.
+    """
+    global _current_shard_used
+    if _current_shard is not None:
+        _current_shard_used = True
+    return _current_shard
+
+
+def shard_lines(file_name: str) -> Iterator[bytes]:
+    """ The lines of ``file_name`` in the current shard of this process, all of them without one. """
+    file_size = os.path.getsize(file_name)
+    shard = current_shard()
+    if shard is None:
+        return read_lines(file_name, 0, file_size)
+    return read_lines(file_name, *chunk_range(file_size, *shard))
+
+
+def shard_range(length: int) -> range:
+    """ The indices ``< length`` in the current shard of this process, all of them without one. """
+    shard = current_shard()
+    if shard is None:
+        return range(length)
+    return range(*chunk_range(length, *shard))
+
+
+def chunk_output(output_name: str, index: int) -> str:
+    return '%s.%d' % (output_name, index)
+
+
+def claim_chunk(output_name: str, index: int) -> bool:
+    """ Atomically claims chunk ``index``; ``False`` if another worker already did. """
+    try:
+        fd = os.open(chunk_output(output_name, index) + '.claim', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+    return True
+
+
+def chunk_done(output_name: str, index: int) -> Optional[Dict]:
+    """ The record written by :func:`process_chunk` once chunk ``index`` is complete, or ``None``. """
+    try:
+        with open(chunk_output(output_name, index) + '.done') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def process_chunk(file_name: str,
+                  output_name: str,
+                  num_chunks: int,
+                  index: int,
+                  convert: Callable[[Iterable[bytes]], Iterable[str]]) -> Dict:
+    """
+    Writes ``convert(lines of the chunk)`` to ``<output_name>.<index>`` and records it in
+    ``<output_name>.<index>.done``.  Both files are renamed into place, so a chunk is either
+    complete or absent.
+    """
+    start, end = chunk_range(os.path.getsize(file_name), num_chunks, index)
+    output = chunk_output(output_name, index)
+    num_lines = 0
+
+    def counted(lines):
+        nonlocal num_lines
+        for line in lines:
+            num_lines += 1
+            yield line
+    num_outputs = 0
+    with open(output + '.tmp', 'w') as f:
+        for result in convert(counted(read_lines(file_name, start, end))):
+            f.write(result)
+            num_outputs += 1
+    os.replace(output + '.tmp', output)
+    record = {'index': index, 'start': start, 'end': end, 'lines': num_lines,
+              'outputs': num_outputs, 'bytes': os.path.getsize(output), 'output': os.path.basename(output)}
+    with open(output + '.done.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(output + '.done.tmp', output + '.done')
+    return record
+
+
+def run_worker(file_name: str,
+               output_name: str,
+               num_chunks: int,
+               convert: Callable[[Iterable[bytes]], Iterable[str]],
+               num_shards: int = None,
+               shard_index: int = None) -> List[Dict]:
+    """
+    Processes the chunks of shard ``shard_index`` of ``num_shards``, or, without a shard, claims
+    and processes any chunk that no other worker has claimed.  Completed chunks are skipped, so a
+    worker can be restarted.  Returns the records of the chunks this worker processed.
+    """
+    if num_shards is None:
+        indices = range(num_chunks)
+    else:
+        indices = range(shard_index, num_chunks, num_shards)
+    records = []
+    for index in indices:
+        if chunk_done(output_name, index) is not None:
+            continue
+        if num_shards is None and not claim_chunk(output_name, index):
+            continue
+        records.append(process_chunk(file_name, output_name, num_chunks, index, convert))
+    return records
+
+
+def merge_chunks(file_name: str, output_name: str, num_chunks: int, remove: bool = True) -> Dict:
+    """
+    Concatenates the outputs of all chunks into ``output_name`` in input order and writes
+    ``output_name + '.manifest.json'``.  Raises ``ValueError`` if a chunk is not complete.
+    """
+    records = [chunk_done(output_name, index) for index in range(num_chunks)]
+    missing = [index for index, record in enumerate(records) if record is None]
+    if missing:
+        raise ValueError('chunks %s of %s are not complete' % (missing, output_name))
+    with open(output_name + '.tmp', 'wb') as f_out:
+        for index in range(num_chunks):
+            with open(chunk_output(output_name, index), 'rb') as f_in:
+                while True:
+                    buffer = f_in.read(1 << 24)
+                    if not buffer:
+                        break
+                    f_out.write(buffer)
+    os.replace(output_name + '.tmp', output_name)
+    manifest = {'input': os.path.abspath(file_name),
+                'input_bytes': os.path.getsize(file_name),
+                'output': os.path.abspath(output_name),
+                'num_chunks': num_chunks,
+                'lines': sum(record['lines'] for record in records),
+                'outputs': sum(record['outputs'] for record in records),
+                'chunks': records}
+    with open(output_name + MANIFEST_SUFFIX, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if remove:
+        for index in range(num_chunks):
+            for suffix in ('', '.done', '.claim'):
+                path = chunk_output(output_name, index) + suffix
+                if os.path.exists(path):
+                    os.remove(path)
+    return manifest
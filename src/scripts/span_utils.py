@@ -0,0 +1,81 @@
+"""
+Mapping of character spans of a passage to token spans, shared by the readers and the
+preprocessing scripts.
+
+:class:`TokenOffsetIndex` keeps the start and end offsets of the tokens of one passage and resolves
+each character span with two binary searches, where ``char_span_to_token_span`` used to scan the
+tokens from the beginning of the passage for every span.  The results, including the error flag and
+the corner cases of the linear scan, are the same.
+"""
+from bisect import bisect_left
+from typing import List, Optional, Sequence, Tuple
+
+
+class TokenOffsetIndex:
+    """
+    Parameters
+    ----------
+    token_offsets : ``Sequence[Tuple[int, int]]``
+        The ``(start, end)`` character offsets of the tokens of a passage, as in the
+        ``passages_offsets`` of the readers.
+    """
+
+    def __init__(self, token_offsets: Sequence[Tuple[int, int]]) -> None:
+        self.starts = [start for start, _ in token_offsets]
+        self.ends = [end for _, end in token_offsets]
+        # tokenizers give increasing offsets; anything else falls back to the linear scan
+        self._sorted = all(a <= b for a, b in zip(self.starts, self.starts[1:])) and \
+            all(a <= b for a, b in zip(self.ends, self.ends[1:]))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _first_not_less(self, values: List[int], target: int, lo: int) -> int:
+        # the index at which ``while values[i] < target: i += 1`` stops, starting from ``lo``
+        if self._sorted:
+            return bisect_left(values, target, lo)
+        while lo < len(values) and values[lo] < target:
+            lo += 1
+        return lo
+
+    def token_span(self, character_span: Tuple[int, int]) -> Tuple[Tuple[int, int], bool]:
+        """
+        The inclusive token span closest to ``character_span`` and whether it does not match the
+        character span exactly, like ``MsmarcoMultiPassageReader.char_span_to_token_span``.
+        """
+        start_char, end_char = character_span
+        starts, ends = self.starts, self.ends
+        start_index = self._first_not_less(starts, start_char, 0)
+        if start_index == len(starts) or starts[start_index] > start_char:
+            # the span starts inside the previous token (or before the first one, then the index
+            # is -1, i.e. the last token, as in the linear scan)
+            start_index -= 1
+        error = starts[start_index] != start_char
+        end_index = start_index
+        if end_index < 0:
+            if ends[end_index] >= end_char:
+                return (start_index, end_index), error or ends[end_index] != end_char
+            end_index = 0
+        end_index = self._first_not_less(ends, end_char, end_index)
+        if end_index == len(ends):
+            end_index -= 1
+        error = error or ends[end_index] != end_char
+        return (start_index, end_index), error
+
+    def token_spans(self,
+                    character_spans: Sequence[Tuple[int, int]]) -> List[Optional[Tuple[Tuple[int, int], bool]]]:
+        """
+        :func:`token_span` of every character span, ``None`` for the spans that end after the last
+        token (the passage was truncated) or if the passage has no tokens.
+        """
+        if not self.ends:
+            return [None] * len(character_spans)
+        last_end = self.ends[-1]
+        return [None if character_span[1] > last_end else self.token_span(character_span)
+                for character_span in character_spans]
+
+
+def char_span_to_token_span(token_offsets: Sequence[Tuple[int, int]],
+                            character_span: Tuple[int, int]) -> Tuple[Tuple[int, int], bool]:
+    """ :func:`TokenOffsetIndex.token_span` for a single span. """
+    return TokenOffsetIndex(token_offsets).token_span(character_span)
@@ -0,0 +1,304 @@
+# encoding: utf-8
+"""
+@file: serving.py
+
+A long-running serving mode for the VNet predictors (``vnet_msmarco``, ``vnet_dureader``).
+
+Requests are turned into instances as they arrive, in a thread of their own so that the
+tokenization does not hold up the event loop, and wait in a bucket of similar passage lengths.
+A bucket is run as one batch when it holds ``max_batch_size`` requests or when its oldest
+request has waited ``max_latency_ms``, whichever comes first; the batches go through the
+model one at a time (``Predictor.predict_batch_instance``, a single forward under
+``torch.no_grad()``) in a worker thread, so the event loop keeps accepting requests, and the
+outputs are sent back to the waiting requests.  :class:`ServingStats` keeps the latency
+percentiles and the batch fill rate.
+
+Serve HTTP (``POST /predict`` with one JSON request, ``GET /stats``)::
+
+    python -m src.serving model.tar.gz vnet_dureader --port 8000
+
+Replay a file of JSON lines (or stdin) as a load test, ``--rate`` requests per second::
+
+    python -m src.serving model.tar.gz vnet_dureader --input dev.json.instances --rate 50 > predictions.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, TextIO
+
+import numpy
+import torch
+
+from allennlp.common.util import JsonDict, import_submodules
+from allennlp.data import Instance
+from allennlp.predictors.predictor import Predictor
+
+logger = logging.getLogger(__name__)
+
+
+def passage_length(instance: Instance) -> int:
+    """ The number of tokens of the longest passage of an instance of the multi-passage readers. """
+    return max((len(tokens) for tokens in instance.fields['metadata'].metadata['passage_tokens']), default=0)
+
+
+class ServingStats:
+    """
+    Request latencies (of the last ``window`` requests) and batch sizes of a :class:`MicroBatcher`.
+    """
+
+    def __init__(self, max_batch_size: int, window: int = 10000) -> None:
+        self.max_batch_size = max_batch_size
+        self.latencies: Deque[float] = collections.deque(maxlen=window)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def add_batch(self, latencies: List[float]) -> None:
+        self.latencies.extend(latencies)
+        self.num_requests += len(latencies)
+        self.num_batches += 1
+
+    def report(self) -> Dict[str, float]:
+        latencies = numpy.array(self.latencies) * 1000 if self.latencies else numpy.zeros(1)
+        mean_batch_size = self.num_requests / max(self.num_batches, 1)
+        return {'requests': self.num_requests,
+                'batches': self.num_batches,
+                'latency_p50_ms': float(numpy.percentile(latencies, 50)),
+                'latency_p99_ms': float(numpy.percentile(latencies, 99)),
+                'latency_max_ms': float(latencies.max()),
+                'mean_batch_size': mean_batch_size,
+                'batch_fill_rate': mean_batch_size / self.max_batch_size}
+
+
+class _Request:
+    def __init__(self, instance: Instance, future: asyncio.Future, arrival: float) -> None:
+        self.instance = instance
+        self.future = future
+        self.arrival = arrival
+
+
+class MicroBatcher:
+    """
+    Collects the requests of :func:`predict` in micro-batches of similar passage lengths.
+
+    Parameters
+    ----------
+    predictor : ``Predictor``
+        Converts the requests (``_json_to_instance``) and runs the batches (``predict_batch_instance``).
+    max_batch_size : ``int``, optional (default = 32)
+    max_latency_ms : ``float``, optional (default = 20)
+        How long the first request of a batch waits for more requests.
+    bucket_width : ``int``, optional (default = 100)
+        Requests whose longest passages have the same number of tokens divided by ``bucket_width``
+        go in the same batches.
+    length : ``Callable[[Instance], int]``, optional (default = :func:`passage_length`)
+    """
+
+    def __init__(self,
+                 predictor: Predictor,
+                 max_batch_size: int = 32,
+                 max_latency_ms: float = 20,
+                 bucket_width: int = 100,
+                 length: Callable[[Instance], int] = passage_length) -> None:
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.bucket_width = bucket_width
+        self.length = length
+        self.stats = ServingStats(max_batch_size)
+        self._buckets: Dict[int, List[_Request]] = {}
+        self._timers: Dict[int, asyncio.Handle] = {}
+        self._batches: asyncio.Queue = None
+        self._worker: asyncio.Future = None
+        self._executor = ThreadPoolExecutor(1)
+        # the requests are converted (tokenized) in another thread, off the event loop and the forward passes
+        self._json_executor = ThreadPoolExecutor(1)
+
+    def start(self) -> None:
+        """ Starts running the batches, in the running event loop. """
+        self._batches = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._run_batches())
+
+    async def predict(self, json_dict: JsonDict) -> JsonDict:
+        """ The output of the predictor for one request. """
+        loop = asyncio.get_event_loop()
+        arrival = time.time()
+        instance = await loop.run_in_executor(self._json_executor,
+                                              self.predictor._json_to_instance,  # pylint: disable=protected-access
+                                              json_dict)
+        request = _Request(instance, loop.create_future(), arrival)
+        key = self.length(instance) // self.bucket_width
+        bucket = self._buckets.setdefault(key, [])
+        bucket.append(request)
+        if len(bucket) >= self.max_batch_size:
+            self._flush(key)
+        elif len(bucket) == 1:
+            self._timers[key] = loop.call_later(self.max_latency, self._flush, key)
+        return await request.future
+
+    def _flush(self, key: int) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._buckets.pop(key, None)
+        if batch:
+            self._batches.put_nowait(batch)
+
+    def _forward(self, instances: List[Instance]) -> List[JsonDict]:
+        with torch.no_grad():
+            return self.predictor.predict_batch_instance(instances)
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self._batches.get()
+            try:
+                outputs = await loop.run_in_executor(self._executor, self._forward,
+                                                     [request.instance for request in batch])
+            except Exception as e:  # pylint: disable=broad-except
+                for request in batch:
+                    if not request.future.cancelled():
+                        request.future.set_exception(e)
+                continue
+            now = time.time()
+            self.stats.add_batch([now - request.arrival for request in batch])
+            for request, output in zip(batch, outputs):
+                if not request.future.cancelled():
+                    request.future.set_result(output)
+
+    async def close(self) -> None:
+        for key in list(self._buckets):
+            self._flush(key)
+        while not self._batches.empty():
+            await asyncio.sleep(self.max_latency)
+        self._worker.cancel()
+        self._executor.shutdown()
+        self._json_executor.shutdown()
+
+
+async def _handle_http(batcher: MicroBatcher,
+                       reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path = request_line.decode('latin-1').split()[:2]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if method == 'POST' and path == '/predict':
+                try:
+                    status, payload = '200 OK', batcher.predictor.dump_line(await batcher.predict(json.loads(body)))
+                except Exception as e:  # pylint: disable=broad-except
+                    status, payload = '400 Bad Request', json.dumps({'error': repr(e)}) + '\n'
+            elif method == 'GET' and path == '/stats':
+                status, payload = '200 OK', json.dumps(batcher.stats.report()) + '\n'
+            else:
+                status, payload = '404 Not Found', json.dumps({'error': 'POST /predict or GET /stats'}) + '\n'
+            data = payload.encode('utf-8')
+            writer.write(('HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                          % (status, len(data))).encode('latin-1') + data)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(batcher: MicroBatcher, host: str, port: int) -> None:
+    batcher.start()
+    server = await asyncio.start_server(lambda reader, writer: _handle_http(batcher, reader, writer), host, port)
+    logger.info('serving on http://%s:%d/predict', host, port)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        server.close()
+        await server.wait_closed()
+        await batcher.close()
+
+
+async def serve_lines(batcher: MicroBatcher, lines: Iterable[str], output: TextIO, rate: float = None) -> None:
+    """
+    Sends every JSON line of ``lines`` as a request, all at once or ``rate`` requests per second
+    on average (exponential arrival times), and writes the outputs to ``output`` in input order.
+    """
+    batcher.start()
+
+    async def request(line: str, delay: float) -> str:
+        await asyncio.sleep(delay)
+        return batcher.predictor.dump_line(await batcher.predict(batcher.predictor.load_line(line)))
+
+    delay = 0.0
+    tasks = []
+    for line in lines:
+        if not line.strip():
+            continue
+        tasks.append(asyncio.ensure_future(request(line, delay)))
+        if rate:
+            delay += random.expovariate(rate)
+    for task in tasks:
+        output.write(await task)
+    await batcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a VNet archive with micro-batching.')
+    parser.add_argument('archive_file', help='the model.tar.gz of a trained model')
+    parser.add_argument('predictor', help='vnet_msmarco or vnet_dureader')
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_latency_ms', type=float, default=20)
+    parser.add_argument('--bucket_width', type=int, default=100, help='passage tokens per length bucket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='serve HTTP on this port')
+    parser.add_argument('--input', default=None, help='JSON lines to replay, default: stdin')
+    parser.add_argument('--rate', type=float, default=None, help='requests per second of the replay')
+    parser.add_argument('--top_k', type=int, default=None, help='also output the top-k answers of every request')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
+
+    from allennlp.models.archival import load_archive
+    import_submodules('src')
+    predictor = Predictor.from_archive(load_archive(args.archive_file, cuda_device=args.cuda_device),
+                                       args.predictor)
+    if args.top_k:
+        predictor.top_k = args.top_k
+    batcher = MicroBatcher(predictor, args.max_batch_size, args.max_latency_ms, args.bucket_width)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.time()
+    if args.port is not None:
+        serving = loop.create_task(serve_http(batcher, args.host, args.port))
+    else:
+        lines = open(args.input) if args.input else sys.stdin
+        serving = loop.create_task(serve_lines(batcher, lines, sys.stdout, args.rate))
+    try:
+        loop.run_until_complete(serving)
+    except KeyboardInterrupt:
+        # let ``serve_http`` close the server and the batcher
+        serving.cancel()
+        loop.run_until_complete(asyncio.gather(serving, return_exceptions=True))
+    finally:
+        report = batcher.stats.report()
+        report['requests_per_second'] = report['requests'] / (time.time() - start)
+        print(json.dumps(report), file=sys.stderr)
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# encoding: utf-8
+"""
+@file: token_id_cache.py
+
+The pre-indexed instances of a reader pass, saved on disk so that the next passes read token ids
+instead of parsing, selecting and indexing the samples again.
+
+A cache is the directory ``<data file>.ids/<key>`` where ``key`` hashes the vocabulary and the
+token indexers (:func:`TokenIdMapper.fingerprint`), the length limits of the reader and the size
+and modification time of the data file: when any of them changes, the reader looks for another
+directory and builds it again.  Outdated caches are not deleted.  The workers of the ``prefetch``
+iterator each have the cache of their shard (``<key>.shard-<index>-of-<num_shards>``).
+
+==================== ======= ==================================================================
+file                 dtype   content
+==================== ======= ==================================================================
+ids.<name>           int64   vocabulary id of every cache token for the single id indexer
+chars.<name>         int64   character ids of every cache token, ``(num_tokens, width)``
+num_chars.<name>     int64   number of characters of every cache token
+token_ids            int32   cache token id of every token of every sequence
+seq_offsets          int64   tokens of sequence ``s`` are ``token_ids[seq_offsets[s]:seq_offsets[s + 1]]``
+sample_offsets       int64   sequences of sample ``i``; the first one is the question
+spans                int32   ``(start, end)`` token spans of the passages, shape ``(num_spans, 2)``
+span_offsets         int64   spans of sequence ``s`` (empty for questions)
+metadata             uint8   utf-8 JSON metadata of every sample, concatenated
+metadata_offsets     int64   bytes of the metadata of sample ``i``
+header.json                  limits, ``[qid, num_passages_texts, num_token_spans]`` of every
+                             sample, widths of ``chars.<name>``
+==================== ======= ==================================================================
+"""
+import array
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterator, List
+
+import numpy
+
+from allennlp.data.instance import Instance
+
+from .indexed_fields import TokenIdMapper, LazyMetadata, instance_metadata, make_indexed_instance
+from .instance_store import _open_array
+from .scripts.sharding import current_shard
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.ids'
+
+_ARRAYS = {'token_ids': 'int32',
+           'seq_offsets': 'int64',
+           'sample_offsets': 'int64',
+           'spans': 'int32',
+           'span_offsets': 'int64',
+           'metadata': 'uint8',
+           'metadata_offsets': 'int64'}
+
+
+def cache_path(file_path: str, mapper: TokenIdMapper, **limits: Any) -> str:
+    """
+    The cache directory of the pass over ``file_path`` of a reader with the ``mapper`` and the
+    length limits ``limits`` in the current shard.
+    """
+    digest = hashlib.sha1(mapper.fingerprint().encode('utf-8'))
+    stat = os.stat(file_path)
+    digest.update(json.dumps([sorted(limits.items()), stat.st_size, stat.st_mtime_ns]).encode('utf-8'))
+    key = digest.hexdigest()[:16]
+    shard = current_shard()
+    if shard is not None:
+        key += '.shard-%d-of-%d' % (shard[1], shard[0])
+    return os.path.join(file_path + CACHE_SUFFIX, key)
+
+
+def _decode_metadata(encoded: bytes) -> Dict[str, Any]:
+    metadata = json.loads(encoded.decode('utf-8'))
+    metadata['passages_offsets'] = [[tuple(offsets) for offsets in passage_offsets]
+                                    for passage_offsets in metadata['passages_offsets']]
+    return metadata
+
+
+class TokenIdCache:
+    """
+    Read-only access to a cache written by :class:`TokenIdCacheWriter`.
+
+    Parameters
+    ----------
+    path : ``str``
+        The cache directory, see :func:`cache_path`.
+    mapper : ``TokenIdMapper``
+        A mapper with the vocabulary and token indexers of the cache.
+    """
+
+    def __init__(self, path: str, mapper: TokenIdMapper) -> None:
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as f:
+            header = json.load(f)
+        self.samples: List[List[Any]] = header['samples']
+        for name, dtype in _ARRAYS.items():
+            setattr(self, name, _open_array(os.path.join(path, name), dtype))
+        self.spans = self.spans.reshape(-1, 2)
+        tables = {}
+        for name, width in header['tables'].items():
+            table = _open_array(os.path.join(path, name), 'int64')
+            tables[name] = table if width is None else table.reshape(-1, width)
+        self.mapper = TokenIdMapper.from_tables(mapper.vocab, mapper.token_indexers, tables)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.isfile(os.path.join(path, 'header.json'))
+
+    def _sequence(self, array: numpy.ndarray, offsets: numpy.ndarray, seq: int) -> numpy.ndarray:
+        return array[offsets[seq]:offsets[seq + 1]]
+
+    def instance(self, index: int) -> Instance:
+        question, *passages = range(int(self.sample_offsets[index]), int(self.sample_offsets[index + 1]))
+        qid, num_passages_texts, num_token_spans = self.samples[index]
+        token_spans = [self._sequence(self.spans, self.span_offsets, seq) for seq in passages[:num_token_spans]]
+        # only the bytes of the metadata go with the instance when it is pickled
+        encoded = self._sequence(self.metadata, self.metadata_offsets, index).tobytes()
+        return make_indexed_instance(self.mapper,
+                                     self._sequence(self.token_ids, self.seq_offsets, question),
+                                     [self._sequence(self.token_ids, self.seq_offsets, seq) for seq in passages],
+                                     num_passages_texts,
+                                     token_spans,
+                                     LazyMetadata(functools.partial(_decode_metadata, encoded), qid))
+
+    def __iter__(self) -> Iterator[Instance]:
+        for index in range(len(self)):
+            yield self.instance(index)
+
+
+class TokenIdCacheWriter:
+    """
+    Builds the pre-indexed instances of the samples of a pass with :func:`add` and saves them in
+    the cache directory ``path`` with :func:`save` when the pass is complete.  The token ids and
+    the metadata go to a temporary directory during the pass, which :func:`close` removes if the
+    pass was not saved.
+    """
+
+    def __init__(self, path: str, mapper: TokenIdMapper, **limits: Any) -> None:
+        self.path = path
+        self.mapper = mapper
+        self.limits = limits
+        self._temporary = '%s.tmp-%d' % (path, os.getpid())
+        os.makedirs(self._temporary, exist_ok=True)
+        self._token_ids = open(os.path.join(self._temporary, 'token_ids'), 'wb')
+        self._metadata = open(os.path.join(self._temporary, 'metadata'), 'wb')
+        self._num_token_ids = 0
+        self._metadata_size = 0
+        self._arrays = {name: array.array('q' if dtype == 'int64' else 'i')
+                        for name, dtype in _ARRAYS.items() if name not in ('token_ids', 'metadata')}
+        for name in ('seq_offsets', 'sample_offsets', 'span_offsets', 'metadata_offsets'):
+            self._arrays[name].append(0)
+        self._samples: List[List[Any]] = []
+
+    def _add_sequence(self, local_ids: numpy.ndarray, spans=()) -> None:
+        local_ids.astype(_ARRAYS['token_ids']).tofile(self._token_ids)
+        self._num_token_ids += len(local_ids)
+        self._arrays['seq_offsets'].append(self._num_token_ids)
+        for start, end in spans:
+            self._arrays['spans'].extend((start, end))
+        self._arrays['span_offsets'].append(len(self._arrays['spans']) // 2)
+
+    def add(self, json_obj: Dict[str, Any]) -> Instance:
+        """
+        The pre-indexed instance of ``json_obj`` (a sample in the format of a line of an
+        ``.instances`` file), as ``json_obj_to_indexed_instance`` builds it.
+        """
+        max_q_len, max_p_len, max_p_num = (self.limits.get(name)
+                                           for name in ('max_q_len', 'max_p_len', 'max_p_num'))
+        question_ids = self.mapper.intern([text for text, _ in json_obj['question_tokens'][:max_q_len]])
+        passages_ids = [self.mapper.intern([text for text, _ in passage_tokens[:max_p_len]])
+                        for passage_tokens in json_obj['passages_tokens'][:max_p_num]]
+        token_spans = json_obj.get('token_spans') or []
+        metadata = instance_metadata(json_obj, max_q_len, max_p_len, max_p_num)
+
+        self._add_sequence(question_ids)
+        for passage_id, passage_ids in enumerate(passages_ids):
+            self._add_sequence(passage_ids, token_spans[passage_id] if passage_id < len(token_spans) else ())
+        self._arrays['sample_offsets'].append(len(self._arrays['seq_offsets']) - 1)
+        encoded = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        self._metadata.write(encoded)
+        self._metadata_size += len(encoded)
+        self._arrays['metadata_offsets'].append(self._metadata_size)
+        self._samples.append([json_obj['qid'], len(json_obj['passages_texts']),
+                              min(len(token_spans), len(passages_ids))])
+        return make_indexed_instance(self.mapper, question_ids, passages_ids, len(json_obj['passages_texts']),
+                                     token_spans, LazyMetadata(functools.partial(dict, metadata), json_obj['qid']))
+
+    def save(self) -> None:
+        """ Writes the cache; the directory is complete or absent, even with concurrent writers. """
+        self._token_ids.close()
+        self._metadata.close()
+        for name, values in self._arrays.items():
+            numpy.asarray(values, dtype=_ARRAYS[name]).tofile(os.path.join(self._temporary, name))
+        widths = {}
+        for name, table in self.mapper.tables().items():
+            numpy.ascontiguousarray(table, dtype=numpy.int64).tofile(os.path.join(self._temporary, name))
+            widths[name] = table.shape[1] if table.ndim == 2 else None
+        # header.json is written last, it marks the cache as complete
+        with open(os.path.join(self._temporary, 'header.json'), 'w') as f:
+            json.dump({'limits': self.limits, 'tables': widths, 'samples': self._samples}, f, ensure_ascii=False)
+        try:
+            os.rename(self._temporary, self.path)
+        except OSError:
+            # another process saved the same cache first
+            return
+        logger.info('cached the token ids of %d samples in %s', len(self._samples), self.path)
+
+    def close(self) -> None:
+        self._token_ids.close()
+        self._metadata.close()
+        shutil.rmtree(self._temporary, ignore_errors=True)
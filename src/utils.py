@@ -4,6 +4,17 @@ from typing import List
 import string
 import re
 import collections
+from functools import lru_cache
+
+import numpy as np
+
+from .scripts.lcs import lcs_rows
+from .scripts.rouge_span import best_rouge_l_span
+
+ARTICLES_REGEX = re.compile(r'\b(a|an|the)\b', re.UNICODE)
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+CHINESE_PUNCTUATION_TABLE = str.maketrans('', '', ''.join(set(string.punctuation) |
+                                                          set('。？！；.?!;，,\n\r、【】‘’“……（_—）”｛｝ ')))
 
 
 def memory_effient_masked_softmax(vector: torch.Tensor, mask: torch.Tensor,
@@ -29,15 +40,13 @@ class MaxF1Mesure():
     def normalize_answer(self, s):
         """Lower text and remove punctuation, articles and extra whitespace."""
         def remove_articles(text):
-            regex = re.compile(r'\b(a|an|the)\b', re.UNICODE)
-            return re.sub(regex, ' ', text)
+            return ARTICLES_REGEX.sub(' ', text)
 
         def white_space_fix(text):
             return ' '.join(text.split())
 
         def remove_punc(text):
-            exclude = set(string.punctuation)
-            return ''.join(ch for ch in text if ch not in exclude)
+            return text.translate(PUNCTUATION_TABLE)
 
         def lower(text):
             return text.lower()
@@ -74,50 +83,18 @@ class MaxF1Mesure():
             max_f1 = max(max_f1, f1)
             if max_f1 == 1:
                 break
-        return f1
+        return max_f1
 
 
 def get_answers_with_RougeL(passage, answers, threshold=0.7):
     answers = list(set(answers))
     token_as = [ans.split(' ') for ans in answers]
     token_p = passage.split(' ')
-    candidates = []
-    lcs = get_lcs(token_as, token_p)
-    for lo in range(len(token_p)):
-        for hi in range(lo, len(token_p)):
-            candidate = ' '.join(token_p[lo:hi])
-            if all(ch == ' ' for ch in candidate):
-                continue
-            score = get_rouge_l(lcs, token_as, lo + 1, hi + 1)
-            if score > threshold:
-                if len(candidates) > 0:
-                    if lo == candidates[-1]['lo']:
-                        if score < candidates[-1]['score']:
-                            break
-                        elif score > candidates[-1]['score']:
-                            candidates = candidates[:-1]
-                    elif hi == candidates[-1]['hi'] and score < candidates[-1]['score']:
-                        break
-                    while len(candidates) > 1 and hi == candidates[-1]['hi'] and \
-                            score > candidates[-1]['score']:
-                        candidates = candidates[:-1]
-                        if len(candidates) == 0:
-                            break
-                candidates.append({'candidate': candidate,
-                                   'lo': lo,
-                                   'hi': hi,
-                                   'score': score})
-    max_score = 0
-    best_answer = ''
-    for candidate in candidates:
-        if candidate['score'] > max_score:
-            best_answer = candidate['candidate']
-            max_score = candidate['score']
-    if best_answer != '':
-        return [best_answer]
-    else:
+    span = best_rouge_l_span(token_as, token_p, threshold)
+    if span is None:
         return []
-    # return [item['candidate'] for item in candidates]
+    lo, hi = span
+    return [' '.join(token_p[lo:hi])]
 
 
 def get_rouge_l(lcs, token_as, lo, hi):
@@ -139,32 +116,71 @@ def get_rouge_l(lcs, token_as, lo, hi):
 
 
 def get_lcs(token_as: List[List[str]], token_p: List[str]):
-    lcs = []
-    for token_a in token_as:
-        lcs_map = [[0 for i in range(0, len(token_p) + 1)]
-                   for j in range(0, len(token_a) + 1)]
-        for j in range(1, len(token_p) + 1):
-            for i in range(1, len(token_a) + 1):
-                if(token_a[i - 1] == token_p[j - 1]):
-                    lcs_map[i][j] = lcs_map[i - 1][j - 1] + 1
-                else:
-                    lcs_map[i][j] = max(lcs_map[i - 1][j], lcs_map[i][j - 1])
-        lcs.append([lcs_map[-1][i] for i in range(len(token_p) + 1)])
-    return lcs
+    """
+    For every answer, the LCS lengths against every prefix ``token_p[:j]`` of the passage.
+    """
+    return lcs_rows(token_as, token_p)
+
+
+class F1SpanScorer():
+    """
+    Scores the spans of whitespace separated segments of a passage with the F1 of
+    :func:`MaxF1Mesure.calc_score` against the best answer.
+
+    The segments and the answers are normalized once (``get_tokens`` of a segment is the same as
+    the part of ``get_tokens`` of the whole span coming from that segment), then a span is grown one
+    segment at a time while the token overlap with every answer is kept up to date, so each span
+    only costs the work for its new tokens.
+    """
+    def __init__(self, segments: List[str], answers: List[str], get_tokens=None):
+        get_tokens = get_tokens or MaxF1Mesure().get_tokens
+        self.segments_tokens = [get_tokens(segment) for segment in segments]
+        self.answers_length = [len(get_tokens(ans)) for ans in answers]
+        self.answers_counts = [collections.Counter(get_tokens(ans)) for ans in answers]
+
+    def scores(self, lo: int):
+        """
+        Yields ``(hi, score)`` of the spans ``segments[lo:hi + 1]`` for ``hi = lo, lo + 1, ...``.
+        """
+        counts = collections.Counter()
+        num_same = [0] * len(self.answers_counts)
+        length = 0
+        for hi in range(lo, len(self.segments_tokens)):
+            for token in self.segments_tokens[hi]:
+                counts[token] += 1
+                for idx, answer_counts in enumerate(self.answers_counts):
+                    if counts[token] <= answer_counts[token]:
+                        num_same[idx] += 1
+            length += len(self.segments_tokens[hi])
+            yield hi, self._max_f1(length, num_same)
+
+    def _max_f1(self, length, num_same):
+        max_f1 = 0
+        for answer_length, same in zip(self.answers_length, num_same):
+            # as MaxF1Mesure.compute_f1(candidate, answer)
+            if length == 0 or answer_length == 0:
+                f1 = int(length == answer_length)
+            elif same == 0:
+                f1 = 0
+            else:
+                precision = 1.0 * same / answer_length
+                recall = 1.0 * same / length
+                f1 = (2 * precision * recall) / (precision + recall)
+            max_f1 = max(max_f1, f1)
+        return max_f1
 
 
 def get_ans_by_f1(passage, answers, threshold=0.7):
     answers = list(set(answers))
     candidates = []
-    measure = MaxF1Mesure()
-    indices = [0] + [m.start() for m in re.finditer(' ', passage)]
-    for i, lo in enumerate(indices):
-        lo = lo + 1
-        for hi in indices[i:] + list(set([indices[-1], len(passage)])):
-            candidate = passage[lo:hi]
-            if len(candidate) == 0:
+    segments = passage.split(' ')
+    starts = [0] + [m.start() + 1 for m in re.finditer(' ', passage)]
+    scorer = F1SpanScorer(segments, answers)
+    for lo_segment, lo in enumerate(starts):
+        for hi_segment, score in scorer.scores(lo_segment):
+            hi = starts[hi_segment] + len(segments[hi_segment])
+            if hi == lo:
                 continue
-            score = measure.calc_score([candidate], answers)
             if score > threshold:
                 if len(candidates) > 0:
                     if lo == candidates[-1]['lo']:
@@ -179,36 +195,32 @@ def get_ans_by_f1(passage, answers, threshold=0.7):
                         candidates = candidates[:-1]
                         if len(candidates) == 0:
                             break
-                candidates.append({'candidate': candidate,
-                                   'lo': lo,
+                candidates.append({'lo': lo,
                                    'hi': hi,
                                    'score': score})
     max_score = 0
     best_answer = ''
     for candidate in candidates:
         if candidate['score'] > max_score:
-            best_answer = candidate['candidate']
+            best_answer = passage[candidate['lo']:candidate['hi']]
             max_score = candidate['score']
     if best_answer != '':
         return [best_answer]
     else:
         return []
-    return [item['candidate'] for item in candidates]
 
 
 class ChineseMaxF1Mesure():
     def normalize_answer(self, s):
         """Lower text and remove punctuation, articles and extra whitespace."""
         def remove_articles(text):
-            regex = re.compile(r'\b(a|an|the)\b', re.UNICODE)
-            return re.sub(regex, ' ', text)
+            return ARTICLES_REGEX.sub(' ', text)
 
         def white_space_fix(text):
             return ' '.join(text)
 
         def remove_punc(text):
-            exclude = set(string.punctuation) | set('。？！；.?!;，,\n\r、【】‘’“……（_—）”｛｝ ')
-            return ''.join(ch for ch in text if ch not in exclude)
+            return text.translate(CHINESE_PUNCTUATION_TABLE)
         return white_space_fix(remove_articles(remove_punc(s)))
 
     def get_tokens(self, s):
@@ -242,4 +254,56 @@ class ChineseMaxF1Mesure():
             max_f1 = max(max_f1, f1)
             if max_f1 == 1:
                 break
-        return f1
+        return max_f1
+
+
+class F1Scorer():
+    """
+    Batch version of ``MaxF1Mesure.calc_score`` / ``ChineseMaxF1Mesure.calc_score``.
+
+    Candidates are normalized once per call and references once per scorer (they are kept in an
+    LRU cache), so scoring many paragraphs against the same answers does not normalize the
+    answers again for every paragraph.
+
+    Parameters
+    ----------
+    measure : ``MaxF1Mesure`` or ``ChineseMaxF1Mesure``, optional (default=``MaxF1Mesure()``)
+        Defines the normalization of the texts.
+    cache_size : ``int``, optional (default=4096)
+        The number of normalized references to keep.
+    """
+    def __init__(self, measure=None, cache_size: int = 4096):
+        self.measure = measure or MaxF1Mesure()
+        self._ref_counts = lru_cache(maxsize=cache_size)(self._counts)
+
+    def _counts(self, text):
+        tokens = self.measure.get_tokens(text)
+        return len(tokens), collections.Counter(tokens)
+
+    @staticmethod
+    def _f1(candidate_counts, ref_counts):
+        # as compute_f1(candidate, ref)
+        candidate_length, candidate_counter = candidate_counts
+        ref_length, ref_counter = ref_counts
+        if candidate_length == 0 or ref_length == 0:
+            return int(candidate_length == ref_length)
+        num_same = sum((candidate_counter & ref_counter).values())
+        if num_same == 0:
+            return 0
+        precision = 1.0 * num_same / ref_length
+        recall = 1.0 * num_same / candidate_length
+        return (2 * precision * recall) / (precision + recall)
+
+    def score(self, candidate: str, refs: List[str]) -> float:
+        """ The best F1 of ``candidate`` against ``refs``, like ``calc_score([candidate], refs)``. """
+        candidate_counts = self._counts(candidate)
+        max_f1 = 0
+        for ref in refs:
+            max_f1 = max(max_f1, self._f1(candidate_counts, self._ref_counts(ref)))
+            if max_f1 == 1:
+                break
+        return max_f1
+
+    def score_many(self, candidates: List[str], refs: List[str]) -> np.ndarray:
+        """ :func:`score` of every candidate, as a float array. """
+        return np.array([self.score(candidate, refs) for candidate in candidates], dtype=np.float64)
@@ -10,7 +10,7 @@
 这一行开始写关于本文件的说明与解释
 """
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import random
 
 import torch
@@ -29,7 +29,7 @@ from .MsmarcoRouge import MsmarcoRouge
 from .DureaderBleu import DureaderBleu
 from .modules.Pointer_Network import PointerNet
 # from .modules.pointerNetwork import PointerNetDecoder
-from .modules.ElasticHighway import ElasticHighway
+from .modules.ElasticHighway import ElasticHighway, FusedElasticHighway
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
@@ -62,6 +62,20 @@ class VNet(Model):
     dropout : ``float``, optional (default=0.2)
         If greater than 0, we will apply dropout with this probability after all encoders (pytorch
         LSTMs do not apply dropout to their last layer).
+    max_span_len : ``int``, optional (default=None)
+        If given, the decoder only considers answer spans of at most this many tokens and searches
+        them with :func:`get_best_span_banded`, which needs ``O(passage_length * max_span_len)`` work
+        and ``O(passage_length)`` memory per passage instead of the ``passage_length ** 2`` tensors
+        built by :func:`get_best_span`.
+    dynamic_padding : ``bool``, optional (default=False)
+        If ``False`` every batch is padded to ``max_passage_len`` tokens and ``max_num_passages``
+        passages before it goes through the network. If ``True`` we keep the real passage length and
+        number of passages of the batch end to end: the passage predictor only uses the weights of
+        the passages that are present and missing passages and padding tokens are masked out of the
+        verification and content losses.  Short (bucketed) batches then cost proportionally less.
+    fused_highway : ``bool``, optional (default=False)
+        If ``True`` use :class:`FusedElasticHighway`, which runs one matmul per highway layer instead
+        of three. Weights trained with the unfused layer are converted when they are loaded.
     mask_lstms : ``bool``, optional (default=True)
         If ``False``, we will skip passing the mask to the LSTM layers.  This gives a ~2x speedup,
         with only a slight performance decrease, if any.  We haven't experimented much with this
@@ -91,6 +105,9 @@ class VNet(Model):
                  max_num_passages: int = 5,
                  max_num_character: int = 4,
                  max_passage_len: int = 4,
+                 max_span_len: int = None,
+                 dynamic_padding: bool = False,
+                 fused_highway: bool = False,
                  mask_lstms: bool = True,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None) -> None:
@@ -102,11 +119,18 @@ class VNet(Model):
         self.relu = torch.nn.ReLU()
         self.max_num_passages = max_num_passages
         self.max_passage_len = max_passage_len
+        self.max_span_len = max_span_len
+        self.dynamic_padding = dynamic_padding
         self.ptr_dim = ptr_dim
         self._text_field_embedder = text_field_embedder
-        self._highway_layer = TimeDistributed(ElasticHighway(text_field_embedder.get_output_dim(),
-                                                             highway_embedding_size,
-                                                             num_highway_layers))
+        if fused_highway:
+            self._highway_layer = FusedElasticHighway(text_field_embedder.get_output_dim(),
+                                                      highway_embedding_size,
+                                                      num_highway_layers)
+        else:
+            self._highway_layer = TimeDistributed(ElasticHighway(text_field_embedder.get_output_dim(),
+                                                                 highway_embedding_size,
+                                                                 num_highway_layers))
         self._phrase_layer = phrase_layer
         self._matrix_attention = DotProductMatrixAttention()
         self._modeling_layer = modeling_layer
@@ -146,6 +170,10 @@ class VNet(Model):
         else:
             self._dropout = lambda x: x
         self._mask_lstms = mask_lstms
+        # set by the predictors: ``forward`` only decodes the answers, see ``_inference_output``
+        self.inference = False
+        # set by the predictors: ``forward`` also returns the ``top_k`` best spans
+        self.top_k: Optional[int] = None
 
         initializer(self)
 
@@ -206,6 +234,12 @@ class VNet(Model):
             If sufficient metadata was provided for the instances in the batch, we also return the
             string from the original passage that the model thinks is the best answer to the
             question.
+        top_k_spans : torch.LongTensor, optional
+            With ``top_k`` set, the ``(batch_size, top_k, 3)`` best spans of
+            :func:`get_top_k_spans` (:func:`get_top_k_spans_banded` with ``max_span_len``),
+            with their ``top_k_scores``, the verification probabilities of their passages
+            ``top_k_passage_scores`` and, with metadata, their strings ``top_k_span_str``.
+            The first one is ``best_span``.
         """
         # ---------------------------------------
         # Part One: Question and Passage Modeling
@@ -217,8 +251,12 @@ class VNet(Model):
         #   torch.Size([batch_size, num_passages, passage_length])
         # shape(passages_batch_size=num_passages*batch_size, question_length, question_embedding_size )
         batch_size, num_passages, passage_length = passages['tokens'].size()
-        pad_size_p_length = self.max_passage_len - passage_length
-        pad_size_p_length = max(pad_size_p_length, 0)
+        if self.dynamic_padding:
+            # keep the real passage length of the batch
+            pad_size_p_length = 0
+        else:
+            pad_size_p_length = self.max_passage_len - passage_length
+            pad_size_p_length = max(pad_size_p_length, 0)
         # shape(batch_size*num_passages, passage_length, num_characters)
         batch_passages = {}
         if 'token_characters' in passages:
@@ -237,7 +275,7 @@ class VNet(Model):
                                                        'constant',
                                                        0.0)
         # shape(batch_size*num_passages, passage_length)
-        passage_length = self.max_passage_len
+        passage_length = passage_length + pad_size_p_length
         batch_passages['tokens'] = F.pad(passages['tokens'],
                                          (0, pad_size_p_length),
                                          'constant',
@@ -253,23 +291,9 @@ class VNet(Model):
             embedded_passages = self._highway_layer(self._text_field_embedder(batch_passages))
         embedding_dim = embedded_passages.size(-1)
 
-        # shape(batch_size, question_length, num_characters)
-        questions = {}
+        # The question is embedded and encoded once per question, not once per passage.
+        # shape(batch_size, question_length, embedding_size)
         batch_size, question_length = question['tokens'].size()
-        if 'token_characters' in question:
-            num_characters = question['token_characters'].size(-1)
-            questions['token_characters'] = question['token_characters'].repeat(1, num_passages, 1)\
-                                                                        .view(batch_size * num_passages,
-                                                                              question_length,
-                                                                              num_characters)
-            questions['token_characters'] = questions['token_characters'][:, :, :self.max_num_character]
-            pad_size_char = self.max_num_character - questions['token_characters'].size(-1)
-            questions['token_characters'] = F.pad(questions['token_characters'],
-                                                  (0, pad_size_char),
-                                                  'constant',
-                                                  0.0)
-        questions['tokens'] = question['tokens'].repeat(1, num_passages).view(-1, question_length)
-
         if "_token_embedders" in dir(self._text_field_embedder) \
                 and 'token_characters' in self._text_field_embedder._token_embedders.keys()\
                 and 'using_glyph' in dir(self._text_field_embedder._token_embedders['token_characters']):
@@ -277,44 +301,46 @@ class VNet(Model):
             embedded_question = self._highway_layer(embedded_question)
         else:
             embedded_question = self._highway_layer(self._text_field_embedder(question))
-        embedding_size = embedded_question.size(-1)
-        # shape(num_passages*batch_size, question_length, embedding_size)
-        embedded_questions = embedded_question.repeat(1, num_passages, 1)\
-                                              .view(-1, question_length, embedding_size)
-        assert embedded_questions.size(0) == embedded_passages.size(0)
-        assert torch.eq(embedded_questions[0, :, :], embedded_questions[num_passages - 1, :, :]).all()
-        # shape(num_passages*batch_size, question_length)
-        questions_mask = util.get_text_field_mask(questions).float()
+        # shape(batch_size, question_length)
+        question_mask = util.get_text_field_mask(question).float()
         # shape(num_passages*batch_size, passage_length)
         passages_mask = util.get_text_field_mask(batch_passages).float()
 
-        # shape(num_passages*batch_size, question_length)
-        questions_lstm_mask = questions_mask if self._mask_lstms else None
+        # shape(batch_size, question_length)
+        question_lstm_mask = question_mask if self._mask_lstms else None
         # shape(num_passages*batch_size, passage_length)
         passages_lstm_mask = passages_mask if self._mask_lstms else None
 
         # encoded_question
-        #     torch.Size([num_passages*batch_size, question_length, phrase_layer_encoding_dim])
-        encoded_questions = self._dropout(self._phrase_layer(embedded_questions, questions_lstm_mask))
-        phrase_layer_encoding_dim = encoded_questions.size(-1)
+        #     torch.Size([batch_size, question_length, phrase_layer_encoding_dim])
+        encoded_question = self._dropout(self._phrase_layer(embedded_question, question_lstm_mask))
+        phrase_layer_encoding_dim = encoded_question.size(-1)
         # encoded_passages
         #     torch.Size([num_passages*batch_size, passage_length, phrase_layer_encoding_dim])
         encoded_passages = self._dropout(self._phrase_layer(embedded_passages, passages_lstm_mask))
-        # Shape: (num_passages*batch_size, passage_length, question_length)
-        passages_questions_similarity = self._matrix_attention(encoded_passages, encoded_questions)
-        # Shape: (num_passages*batch_size, passage_length, question_length)
-        passages_questions_attention = util.masked_softmax(passages_questions_similarity, questions_mask)
+        # All passages of a question attend to the same encoded question, so we look at the
+        # passages as one long sequence per question (a view, nothing is copied) instead of
+        # repeating the question num_passages times.
+        # Shape: (batch_size, num_passages*passage_length, phrase_layer_encoding_dim)
+        grouped_passages = encoded_passages.view(batch_size, num_passages * passage_length,
+                                                 phrase_layer_encoding_dim)
+        # Shape: (batch_size, num_passages*passage_length, question_length)
+        passages_questions_similarity = self._matrix_attention(grouped_passages, encoded_question)
+        # Shape: (batch_size, num_passages*passage_length, question_length)
+        passages_questions_attention = util.masked_softmax(passages_questions_similarity, question_mask)
 
         # Shape: (num_passages*batch_size, passage_length, phrase_layer_encoding_dim)
-        passages_questions_vectors = util.weighted_sum(encoded_questions, passages_questions_attention)
+        passages_questions_vectors = util.weighted_sum(encoded_question, passages_questions_attention)\
+            .view(batch_size * num_passages, passage_length, phrase_layer_encoding_dim)
 
         # We replace masked values with something really negative here, so they don't affect the
         # max below.
         masked_similarity = util.replace_masked_values(passages_questions_similarity,
-                                                       questions_mask.unsqueeze(1),
+                                                       question_mask.unsqueeze(1),
                                                        -1e7)
         # Shape: (batch_size * num_passages, passage_length)
-        questions_passages_similarity = masked_similarity.max(dim=-1)[0].squeeze(-1)
+        questions_passages_similarity = masked_similarity.max(dim=-1)[0]\
+            .view(batch_size * num_passages, passage_length)
         # Shape: (batch_size * num_passages, passage_length)
         questions_passages_attention = util.masked_softmax(questions_passages_similarity, passages_mask)
         # Shape: (batch_size * num_passages, phrase_layer_encoding_dim)
@@ -400,19 +426,59 @@ class VNet(Model):
 
         # shape(batch_size, num_passages, num_passages)
         g = self._passages_matrix_attention(batch_r, attention_batch_r)
-        pad_size = self.max_num_passages - g.size(-1)
-        g = F.pad(g, (0, pad_size, 0, pad_size), 'constant', 0.0)
-        # shape(batch_size, num_passages)
-        passages_verify = self._passage_predictor(g).squeeze(-1)
-        if self.training and random.randint(1, 100) != 1:
+        if self.dynamic_padding:
+            # Zero-padding g to max_num_passages columns is the same as only using the weights of
+            # the first num_passages columns; the padding passages are masked instead of scored.
+            # shape(batch_size, num_passages)
+            passages_exist_mask = (passages_mask.view(batch_size, num_passages, -1).sum(-1) > 0).float()
+            passage_predictor = self._passage_predictor._module
+            if isinstance(passage_predictor, torch.nn.Linear):
+                passages_verify = F.linear(g, passage_predictor.weight[:, :num_passages],
+                                           passage_predictor.bias).squeeze(-1)
+            else:
+                # a quantized layer (``src/quantization.py``) has no weight to slice
+                passages_verify = passage_predictor(F.pad(g, (0, self.max_num_passages - num_passages),
+                                                          'constant', 0.0)).squeeze(-1)
+            passages_verify_probs = util.masked_softmax(passages_verify, passages_exist_mask)
+        else:
+            pad_size = self.max_num_passages - g.size(-1)
+            g = F.pad(g, (0, pad_size, 0, pad_size), 'constant', 0.0)
+            # shape(batch_size, max_num_passages)
+            passages_verify = self._passage_predictor(g).squeeze(-1)
+            passages_verify_probs = torch.softmax(passages_verify, dim=-1)
+        top_k_output: Dict[str, Any] = {}
+        if self.training and not self.inference and random.randint(1, 100) != 1:
             best_span = None
         else:
-            best_span = self.get_best_span(span_start_probs.view(batch_size, num_passages, -1),
-                                           span_end_probs.view(batch_size, num_passages, -1),
-                                           util.masked_softmax(p, passages_mask).view(batch_size,
-                                                                                      num_passages,
-                                                                                      -1),
-                                           torch.softmax(passages_verify, dim=-1))
+            span_decoder_inputs = (span_start_probs.view(batch_size, num_passages, -1),
+                                   span_end_probs.view(batch_size, num_passages, -1),
+                                   util.masked_softmax(p, passages_mask).view(batch_size,
+                                                                              num_passages,
+                                                                              -1),
+                                   passages_verify_probs)
+            if self.top_k:
+                # one search for the answer and the top-k
+                if self.max_span_len is None:
+                    top_k_spans, top_k_scores = self.get_top_k_spans(*span_decoder_inputs, self.top_k)
+                else:
+                    top_k_spans, top_k_scores = self.get_top_k_spans_banded(*span_decoder_inputs,
+                                                                            self.max_span_len, self.top_k)
+                best_span = top_k_spans[:, 0]
+                top_k_output = {'top_k_spans': top_k_spans,
+                                'top_k_scores': top_k_scores,
+                                'top_k_passage_scores': passages_verify_probs.gather(1, top_k_spans[:, :, 0])}
+                if metadata is not None:
+                    top_k_output['top_k_span_str'] = [[self.span_string(instance_metadata, *span) for span in spans]
+                                                      for instance_metadata, spans in zip(metadata,
+                                                                                          top_k_spans.tolist())]
+            elif self.max_span_len is None:
+                best_span = self.get_best_span(*span_decoder_inputs)
+            else:
+                best_span = self.get_best_span_banded(*span_decoder_inputs, self.max_span_len)
+        if self.inference:
+            output_dict = self._inference_output(best_span, metadata)
+            output_dict.update(top_k_output)
+            return output_dict
         output_dict = {'best_span': best_span,
                        'span_start_logits': span_start_logits.view(batch_size, num_passages, -1),
                        'span_start_probs': span_start_probs.view(batch_size, num_passages, -1),
@@ -444,19 +510,20 @@ class VNet(Model):
             eps = 1e-7
             p = p.clamp(eps, 1. - eps)
             ground_truth_p = self.span_idx_to_01_mask(spans_start, spans_end, p.size(-1))
-            loss_Content = torch.sum(torch.log(p) * ground_truth_p)
-            loss_Content += torch.sum(torch.log(1 - p) * (1 - ground_truth_p))
-            loss_Content = -loss_Content / max(passage_length * batch_size, 1)
+            loss_Content = torch.log(p) * ground_truth_p + torch.log(1 - p) * (1 - ground_truth_p)
+            if self.dynamic_padding:
+                loss_Content = loss_Content * passages_mask
+            loss_Content = -torch.sum(loss_Content) / max(self.max_passage_len * batch_size, 1)
 
             # shape(batch_size, num_passages)
             ground_truth_passages_verify = (spans_end != -1).float().to(device).view(batch_size,
                                                                                      num_passages)
-            pad_size = self.max_num_passages - ground_truth_passages_verify.size(-1)
-            ground_truth_passages_verify = F.pad(ground_truth_passages_verify,
-                                                 (0, pad_size), 'constant', 0.0)
+            if not self.dynamic_padding:
+                pad_size = self.max_num_passages - ground_truth_passages_verify.size(-1)
+                ground_truth_passages_verify = F.pad(ground_truth_passages_verify,
+                                                     (0, pad_size), 'constant', 0.0)
             # sigmoid passage loss
-            passages_verify = torch.softmax(passages_verify, dim=-1)
-            passages_verify = passages_verify.clamp(eps, 1. - eps)
+            passages_verify = passages_verify_probs.clamp(eps, 1. - eps)
             loss_Verification = torch.log(passages_verify) * ground_truth_passages_verify
             # softmax passage loss
             # loss_Verification = torch.log_softmax(passages_verify, dim=-1) * ground_truth_passages_verify
@@ -486,17 +553,8 @@ class VNet(Model):
                     continue
                 question_tokens.append(metadata[i]['question_tokens'])
                 passage_tokens.append(metadata[i]['passage_tokens'])
-                passage_str = metadata[i]['original_passages']
-                offsets = metadata[i]['passages_offsets']
                 passage_id, start_idx, end_idx = tuple(best_span[i, :])
-                # passage_id = max(0, min(passage_id, len(offsets) - 1))
-                # clamp start_idx and end_idx to range(0, passage_length - 1)
-                start_idx = max(0, min(start_idx, len(offsets[passage_id]) - 1))
-                end_idx = max(0, min(end_idx, len(offsets[passage_id]) - 1))
-
-                start_offset = offsets[passage_id][start_idx][0]
-                end_offset = offsets[passage_id][end_idx][1]
-                best_span_string = passage_str[passage_id][start_offset:end_offset]
+                best_span_string = self.span_string(metadata[i], passage_id, start_idx, end_idx)
                 output_dict['best_span_str'].append(best_span_string)
                 answer_texts = metadata[i].get('answer_texts', [])
                 if self.language == 'zh':
@@ -536,8 +594,38 @@ class VNet(Model):
             output_dict['question_tokens'] = question_tokens
             output_dict['passage_tokens'] = passage_tokens
         output_dict['qids'] = [data['qid'] for data in metadata]
+        output_dict.update(top_k_output)
+        return output_dict
+
+    def _inference_output(self,
+                          best_span: torch.Tensor,
+                          metadata: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        The output of ``forward`` in inference mode: ``best_span`` and, with ``metadata``,
+        ``best_span_str`` and ``qids``.  No loss, metrics or logging, and no logits or probabilities
+        are kept.
+        """
+        output_dict = {'best_span': best_span}
+        if metadata is not None:
+            output_dict['best_span_str'] = [self.span_string(instance_metadata, *span)
+                                            for instance_metadata, span in zip(metadata, best_span.tolist())]
+            output_dict['qids'] = [instance_metadata['qid'] for instance_metadata in metadata]
         return output_dict
 
+    @staticmethod
+    def span_string(metadata: Dict[str, Any], passage_id: int, start_idx: int, end_idx: int) -> str:
+        """ The text of the token span ``[start_idx, end_idx]`` of a passage, from its ``metadata``. """
+        passage_str = metadata['original_passages']
+        offsets = metadata['passages_offsets']
+        # passage_id = max(0, min(passage_id, len(offsets) - 1))
+        # clamp start_idx and end_idx to range(0, passage_length - 1)
+        start_idx = max(0, min(start_idx, len(offsets[passage_id]) - 1))
+        end_idx = max(0, min(end_idx, len(offsets[passage_id]) - 1))
+
+        start_offset = offsets[passage_id][start_idx][0]
+        end_offset = offsets[passage_id][end_idx][1]
+        return passage_str[passage_id][start_offset:end_offset]
+
     @staticmethod
     def get_best_span(span_start_probs: torch.Tensor,
                       span_end_probs: torch.Tensor,
@@ -565,6 +653,58 @@ class VNet(Model):
         4.47 / 61.9 * 1000 = 72.2
         new version is a little hard to understand
         '''
+        best_spans = VNet._dense_span_scores(span_start_probs, span_end_probs, content, passages_verify)
+        batch_size, num_passages, passage_length = span_start_probs.size()
+        best_spans = best_spans.view(batch_size, num_passages * (passage_length ** 2)).argmax(-1)
+
+        passage_idx = best_spans // (passage_length ** 2)
+        span_start_idx = best_spans % (passage_length ** 2) // passage_length
+        span_end_idx = best_spans % (passage_length ** 2) % passage_length
+        return torch.stack([passage_idx, span_start_idx, span_end_idx], dim=-1)
+
+    @staticmethod
+    def get_top_k_spans(span_start_probs: torch.Tensor,
+                        span_end_probs: torch.Tensor,
+                        content: torch.Tensor,
+                        passages_verify: torch.Tensor,
+                        k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        '''
+        The ``k`` best spans of ``get_best_span`` with their scores: the best end of every start
+        position in the score matrix of ``get_best_span``, then one ``torch.topk`` over the
+        ``num_passages * passage_length`` starts, as ``get_top_k_spans_banded`` does on the band.
+
+        Parameters
+        ----------
+        span_start_probs, span_end_probs, content, passages_verify:
+            as in ``get_best_span``
+        k: the number of spans, at most ``num_passages * passage_length``
+        Return
+        ------
+        top_k_spans: shape(batch_size, k, 3)
+            3 for [passage_id, start, end], best first
+        top_k_scores: shape(batch_size, k)
+            ``start * end * mean(content[start:end + 1]) * verify`` of the spans
+        '''
+        span_scores = VNet._dense_span_scores(span_start_probs, span_end_probs, content, passages_verify)
+        batch_size, num_passages, passage_length = span_start_probs.size()
+        # the spans with ``end < start`` lose against every valid one, as in the band search
+        invalid = torch.tril(torch.ones((passage_length, passage_length), device=span_scores.device), diagonal=-1)
+        span_scores = span_scores - 2 * invalid
+        best_scores, best_ends = span_scores.max(-1)
+        best_offsets = best_ends - torch.arange(passage_length, device=best_ends.device)
+        best_scores = best_scores.view(batch_size, -1)
+        top_k_scores, top_k_starts = best_scores.topk(min(k, best_scores.size(-1)), dim=-1)
+        return VNet._starts_to_spans(top_k_starts, best_offsets.view(batch_size, -1), passage_length), top_k_scores
+
+    @staticmethod
+    def _dense_span_scores(span_start_probs: torch.Tensor,
+                           span_end_probs: torch.Tensor,
+                           content: torch.Tensor,
+                           passages_verify: torch.Tensor) -> torch.Tensor:
+        '''
+        The scores of ``get_best_span`` for every ``[start, end]``, 0 for ``end < start``,
+        shape(batch_size, num_passages, passage_length, passage_length).
+        '''
         if span_start_probs.dim() != 3 or span_end_probs.dim() != 3:
             raise ValueError("Input shapes must be (batch_size, num_passages, passage_length)")
         batch_size, num_passages, passage_length = span_start_probs.size()
@@ -585,16 +725,117 @@ class VNet(Model):
         cumsum_content[cumsum_content != cumsum_content] = 0.0
 
         best_spans = valid_span_probs * cumsum_content
-        best_spans = best_spans.view(batch_size, num_passages, passage_length, passage_length) *\
+        return best_spans.view(batch_size, num_passages, passage_length, passage_length) *\
             passages_verify.view((batch_size, num_passages, 1, 1))
-        best_spans = best_spans.view(batch_size, num_passages * (passage_length ** 2)).argmax(-1)
 
-        passage_idx = best_spans // (passage_length ** 2)
-        span_start_idx = best_spans % (passage_length ** 2) // passage_length
-        span_end_idx = best_spans % (passage_length ** 2) % passage_length
-        span_start_probs = span_start_probs.view(batch_size, num_passages, passage_length)
-        span_end_probs = span_end_probs.view(batch_size, num_passages, passage_length)
-        content = content.view(batch_size, num_passages, passage_length)
+    @staticmethod
+    def get_best_span_banded(span_start_probs: torch.Tensor,
+                             span_end_probs: torch.Tensor,
+                             content: torch.Tensor,
+                             passages_verify: torch.Tensor,
+                             max_span_len: int) -> torch.Tensor:
+        '''
+        Linear-memory version of ``get_best_span`` that only looks at spans with
+        ``end - start < max_span_len``.
+
+        The span score is the same ``start * end * mean(content[start:end + 1]) * verify``. Instead
+        of materialising the ``(passage_length, passage_length)`` score matrix we slide over the band
+        one offset at a time: ``content_sum`` is the running (prefix) sum of the content from every
+        start position, and we keep a running max of the score per start position.
+        With ``max_span_len >= passage_length`` the result is the same as ``get_best_span``.
+
+        Parameters
+        ----------
+        span_start_probs: shape(batch_size, num_passages, passage_length)
+        span_end_probs: shape(batch_size, num_passages, passage_length)
+        content: shape(batch_size, num_passages, passage_length)
+        passages_verify: shape(batch_size, num_passages)
+        max_span_len: the width of the band, i.e. the longest answer in tokens
+        Return
+        ------
+        best_word_span: shape(batch_size, 3)
+            3 for [best_passage_id, start, end]
+        '''
+        best_scores, best_offsets = VNet._best_end_per_start(span_start_probs, span_end_probs, content,
+                                                             passages_verify, max_span_len)
+        best_starts = best_scores.argmax(-1, keepdim=True)
+        return VNet._starts_to_spans(best_starts, best_offsets, span_start_probs.size(-1)).squeeze(1)
+
+    @staticmethod
+    def get_top_k_spans_banded(span_start_probs: torch.Tensor,
+                               span_end_probs: torch.Tensor,
+                               content: torch.Tensor,
+                               passages_verify: torch.Tensor,
+                               max_span_len: int,
+                               k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        '''
+        The ``k`` best spans of ``get_best_span_banded`` with their scores, for reranking and
+        ensembling.  The band search already keeps the best end of every start position, so the
+        top-k is one ``torch.topk`` over the ``num_passages * passage_length`` starts instead of the
+        argmax: the spans have different starts (for one start only its best end is a candidate),
+        and the memory stays ``O(passage_length)`` per passage.
+
+        Parameters
+        ----------
+        span_start_probs, span_end_probs, content, passages_verify, max_span_len:
+            as in ``get_best_span_banded``
+        k: the number of spans, at most ``num_passages * passage_length``
+        Return
+        ------
+        top_k_spans: shape(batch_size, k, 3)
+            3 for [passage_id, start, end], best first
+        top_k_scores: shape(batch_size, k)
+            ``start * end * mean(content[start:end + 1]) * verify`` of the spans
+        '''
+        best_scores, best_offsets = VNet._best_end_per_start(span_start_probs, span_end_probs, content,
+                                                             passages_verify, max_span_len)
+        top_k_scores, top_k_starts = best_scores.topk(min(k, best_scores.size(-1)), dim=-1)
+        return VNet._starts_to_spans(top_k_starts, best_offsets, span_start_probs.size(-1)), top_k_scores
+
+    @staticmethod
+    def _best_end_per_start(span_start_probs: torch.Tensor,
+                            span_end_probs: torch.Tensor,
+                            content: torch.Tensor,
+                            passages_verify: torch.Tensor,
+                            max_span_len: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        '''
+        The band search of ``get_best_span_banded``: the best score of every start position and
+        its offset ``end - start``, both of shape(batch_size, num_passages * passage_length).
+        '''
+        if span_start_probs.dim() != 3 or span_end_probs.dim() != 3:
+            raise ValueError("Input shapes must be (batch_size, num_passages, passage_length)")
+        batch_size, num_passages, passage_length = span_start_probs.size()
+        max_span_len = max(1, min(max_span_len, passage_length))
+        span_start_probs = span_start_probs.view(batch_size * num_passages, passage_length)
+        span_end_probs = span_end_probs.view(batch_size * num_passages, passage_length)
+        content = content.view(batch_size * num_passages, passage_length)
+        passages_verify = passages_verify.view(batch_size * num_passages, 1)
+
+        # Pad the end side so that ``start + offset`` can run past the passage; those spans get a
+        # zero end probability and never win.
+        padded_end_probs = F.pad(span_end_probs, (0, max_span_len - 1), 'constant', 0.0)
+        padded_content = F.pad(content, (0, max_span_len - 1), 'constant', 0.0)
+
+        content_sum = torch.zeros_like(content)
+        best_scores = content.new_full(content.size(), -1.0)
+        best_offsets = torch.zeros_like(span_start_probs, dtype=torch.long)
+        for offset in range(max_span_len):
+            content_sum = content_sum + padded_content[:, offset:offset + passage_length]
+            scores = span_start_probs * padded_end_probs[:, offset:offset + passage_length] *\
+                (content_sum / (offset + 1)) * passages_verify
+            # strict ``>`` keeps the shortest span on ties, like the argmax in ``get_best_span``
+            better = scores > best_scores
+            best_scores = torch.where(better, scores, best_scores)
+            best_offsets = torch.where(better, torch.full_like(best_offsets, offset), best_offsets)
+
+        return best_scores.view(batch_size, -1), best_offsets.view(batch_size, -1)
+
+    @staticmethod
+    def _starts_to_spans(starts: torch.Tensor, best_offsets: torch.Tensor, passage_length: int) -> torch.Tensor:
+        """ ``[passage_id, start, end]`` of the flat start positions ``starts``, shape(batch_size, k, 3). """
+        passage_idx = starts // passage_length
+        span_start_idx = starts % passage_length
+        span_end_idx = span_start_idx + best_offsets.gather(1, starts)
         return torch.stack([passage_idx, span_start_idx, span_end_idx], dim=-1)
 
     @staticmethod
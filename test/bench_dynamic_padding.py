@@ -0,0 +1,51 @@
+# encoding: utf-8
+"""
+Throughput of ``VNet`` with ``dynamic_padding`` off (every batch padded to ``max_passage_len``) and
+on (batches keep their real length), for bucketed batches of different passage lengths.
+
+    python test/bench_dynamic_padding.py --lengths 50 100 200 400
+"""
+import argparse
+import os
+import sys
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from bench_utils import build_vnet, random_batch, time_forward
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--max_passage_len', type=int, default=400)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[50, 100, 200, 400])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    torch.manual_seed(0)
+    padded = build_vnet(max_num_passages=args.num_passages, max_passage_len=args.max_passage_len)
+    dynamic = build_vnet(max_num_passages=args.num_passages, max_passage_len=args.max_passage_len,
+                         dynamic_padding=True)
+    dynamic.load_state_dict(padded.state_dict())
+    for model in (padded, dynamic):
+        model.to(device).eval()
+
+    print('{:>8}{:>16}{:>16}{:>16}{:>10}'.format('length', 'padded inst/s', 'dynamic inst/s',
+                                                 'speedup', 'same'))
+    for length in args.lengths:
+        batch = random_batch(args.batch_size, args.num_passages, length,
+                             min_passage_length=max(1, length * 3 // 4))
+        padded_ms = time_forward(padded, batch, args.repeat, device)
+        dynamic_ms = time_forward(dynamic, batch, args.repeat, device)
+        with torch.no_grad():
+            same = torch.equal(padded(**batch)['best_span'], dynamic(**batch)['best_span'])
+        print('{:>8}{:>16.1f}{:>16.1f}{:>15.2f}x{:>10}'.format(
+                length, args.batch_size / padded_ms * 1000, args.batch_size / dynamic_ms * 1000,
+                padded_ms / dynamic_ms, str(same)))
+
+
+if __name__ == '__main__':
+    main()
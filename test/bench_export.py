@@ -0,0 +1,68 @@
+# encoding: utf-8
+"""
+Latency of ``VNet.forward`` in inference mode against the TorchScript module of ``src/export.py``,
+on the same random batch.
+
+    python test/bench_export.py --batch_size 8 --passage_length 400
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from src.export import export_vnet
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from bench_utils import build_vnet, random_batch
+
+
+def timeit(func, repeat):
+    with torch.no_grad():
+        # the TorchScript executor optimizes the graph during the first calls
+        for _ in range(3):
+            func()
+        start = time.time()
+        for _ in range(repeat):
+            result = func()
+    return result, (time.time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--passage_length', type=int, default=400)
+    parser.add_argument('--max_span_len', type=int, default=50)
+    parser.add_argument('--top_k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = build_vnet(max_num_passages=args.num_passages, max_passage_len=args.passage_length,
+                       max_span_len=args.max_span_len).eval()
+    reader = MsmarcoMultiPassageReader(token_indexers={'tokens': SingleIdTokenIndexer(),
+                                                       'token_characters': TokenCharactersIndexer()})
+    batch = random_batch(args.batch_size, args.num_passages, args.passage_length,
+                         min_passage_length=args.passage_length // 2)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.time()
+        traced = export_vnet(model, reader, os.path.join(directory, 'vnet.pt'), args.top_k)
+        print('export: %.1f s' % (time.time() - start))
+    model.inference = True
+    model.top_k = args.top_k
+    question, passages = batch['question'], batch['passages']
+    eager, eager_ms = timeit(lambda: model(question, passages), args.repeat)
+    (spans, _, _), traced_ms = timeit(lambda: traced(question['tokens'], question['token_characters'],
+                                                     passages['tokens'], passages['token_characters']),
+                                      args.repeat)
+    print('{:<10}{:>12}'.format('mode', 'ms/batch'))
+    print('{:<10}{:>12.1f}'.format('eager', eager_ms))
+    print('{:<10}{:>12.1f}'.format('traced', traced_ms))
+    print('same spans:', torch.equal(spans, eager['top_k_spans']))
+
+
+if __name__ == '__main__':
+    main()
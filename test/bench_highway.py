@@ -0,0 +1,53 @@
+# encoding: utf-8
+"""
+Time ``ElasticHighway`` (inside ``TimeDistributed``, as ``VNet`` uses it) against
+``FusedElasticHighway`` loaded from the same weights.
+
+    python test/bench_highway.py --num_tokens 64000
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from allennlp.modules import TimeDistributed
+from src.modules.ElasticHighway import ElasticHighway, FusedElasticHighway
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=160)
+    parser.add_argument('--num_tokens', type=int, default=400)
+    parser.add_argument('--input_size', type=int, default=232)
+    parser.add_argument('--output_size', type=int, default=182)
+    parser.add_argument('--num_layers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    highway = TimeDistributed(ElasticHighway(args.input_size, args.output_size, args.num_layers))
+    fused = FusedElasticHighway(args.input_size, args.output_size, args.num_layers)
+    fused.load_state_dict(highway._module.state_dict())
+    highway.to(device).eval()
+    fused.to(device).eval()
+    inputs = torch.randn(args.batch_size, args.num_tokens, args.input_size, device=device)
+
+    with torch.no_grad():
+        print('max |highway - fused|: %.3g' % (highway(inputs) - fused(inputs)).abs().max().item())
+        for name, layer in (('highway', highway), ('fused', fused)):
+            layer(inputs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            for _ in range(args.repeat):
+                layer(inputs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            print('{:<10}{:>10.2f} ms'.format(name, (time.time() - start) / args.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# encoding: utf-8
+"""
+Time reading and batching the DuReader fixture with ``TextField`` instances against the
+pre-indexed instances of ``vocabulary_directory``.
+
+    python test/bench_indexed_instances.py --copies 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from allennlp.common.util import lazy_groups_of
+from allennlp.data.dataset import Batch
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
+from src.msmarco_reader import MsmarcoMultiPassageReader
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'fixtures',
+                       'big_samples_dureader.json')
+
+
+def epoch(reader, file_path, vocab, batch_size):
+    start = time.time()
+    for instances in lazy_groups_of(iter(reader.read(file_path)), batch_size):
+        batch = Batch(instances)
+        batch.index_instances(vocab)
+        batch.as_tensor_dict()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--copies', type=int, default=20, help='copies of the fixture to read')
+    parser.add_argument('--batch_size', type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'samples.json')
+        with open(FIXTURE + '.instances') as f:
+            lines = f.readlines()
+        with open(file_path + '.instances', 'w') as f:
+            for _ in range(args.copies):
+                f.writelines(lines)
+        token_indexers = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                          'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+        reader = MsmarcoMultiPassageReader(token_indexers=token_indexers, lazy=True)
+        vocab = Vocabulary.from_instances(reader.read(FIXTURE))
+        vocab.save_to_files(os.path.join(directory, 'vocabulary'))
+        indexed_reader = MsmarcoMultiPassageReader(token_indexers=token_indexers, lazy=True,
+                                                   vocabulary_directory=os.path.join(directory, 'vocabulary'))
+        num_samples = len(lines) * args.copies
+        for name, epoch_reader in (('fields', reader), ('indexed', indexed_reader)):
+            elapsed = epoch(epoch_reader, file_path, vocab, args.batch_size)
+            print('{:<10}{:>10.2f} s {:>10.1f} samples/s'.format(name, elapsed, num_samples / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# encoding: utf-8
+"""
+Latency and output size of ``VNet.forward`` in training mode (as the predictors used it) and in
+the inference mode the predictors select.
+
+    python test/bench_inference_mode.py --passage_length 200
+"""
+import argparse
+import os
+import pickle
+import sys
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from bench_utils import build_vnet, random_batch, time_forward
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--passage_length', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    torch.manual_seed(0)
+    model = build_vnet(max_num_passages=args.num_passages, max_passage_len=args.passage_length,
+                       max_span_len=50)
+    model.to(device).eval()
+    batch = random_batch(args.batch_size, args.num_passages, args.passage_length)
+    outputs = {}
+    print('{:<10}{:>12}{:>16}'.format('mode', 'ms/batch', 'output bytes'))
+    for inference in (False, True):
+        model.inference = inference
+        ms = time_forward(model, batch, args.repeat, device)
+        with torch.no_grad():
+            output = model(**batch)
+        outputs[inference] = output
+        print('{:<10}{:>12.1f}{:>16}'.format('inference' if inference else 'default', ms,
+                                            len(pickle.dumps({key: value.cpu() if torch.is_tensor(value) else value
+                                                              for key, value in output.items()}))))
+    print('same answers:', outputs[False]['best_span_str'] == outputs[True]['best_span_str'])
+
+
+if __name__ == '__main__':
+    main()
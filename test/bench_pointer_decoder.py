@@ -0,0 +1,84 @@
+# encoding: utf-8
+"""
+Compare the pointer logits of ``PointerNetDecoder`` with the previous formulation, which ran
+``_ptr_layer_1`` over ``[embedded_inputs; 0]`` once per pointer and repeated ``_ptr_layer_2(h)``
+over the passage.
+
+    python test/bench_pointer_decoder.py --passage_length 400 --num_passages 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from src.modules.Pointer_Network import PointerNetDecoder
+
+
+def concat_logits(decoder, embedded_inputs, h):
+    passage_length = embedded_inputs.size(1)
+    features = torch.tanh(decoder._ptr_layer_1(torch.cat([embedded_inputs,
+                                                          embedded_inputs.new_zeros(
+                                                              embedded_inputs.size())], dim=-1)) +
+                          decoder._ptr_layer_2(h.unsqueeze(1)).repeat(1, passage_length, 1))
+    return decoder._ptr_layer_3(features).squeeze(-1)
+
+
+def old_pointers(decoder, embedded_inputs, h_start, h_end):
+    return concat_logits(decoder, embedded_inputs, h_start), concat_logits(decoder, embedded_inputs, h_end)
+
+
+def new_pointers(decoder, embedded_inputs, h_start, h_end):
+    passage_projection = decoder._project_passage(embedded_inputs)
+    return (decoder._pointer_logits(passage_projection, h_start),
+            decoder._pointer_logits(passage_projection, h_end))
+
+
+def measure(func, repeat, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_max_memory_allocated()
+    start = time.time()
+    with torch.no_grad():
+        for _ in range(repeat):
+            result = func()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        peak = float('nan')
+    return result, (time.time() - start) / repeat * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--passage_length', type=int, default=400)
+    parser.add_argument('--input_size', type=int, default=640)
+    parser.add_argument('--hidden_dim', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    decoder = PointerNetDecoder(args.input_size, args.hidden_dim).to(device).eval()
+    num_sequences = args.batch_size * args.num_passages
+    embedded_inputs = torch.randn(num_sequences, args.passage_length, args.input_size, device=device)
+    h_start = torch.randn(num_sequences, args.hidden_dim, device=device)
+    h_end = torch.randn(num_sequences, args.hidden_dim, device=device)
+
+    old, old_ms, old_mb = measure(lambda: old_pointers(decoder, embedded_inputs, h_start, h_end),
+                                  args.repeat, device)
+    new, new_ms, new_mb = measure(lambda: new_pointers(decoder, embedded_inputs, h_start, h_end),
+                                  args.repeat, device)
+    max_diff = max((o - n).abs().max().item() for o, n in zip(old, new))
+    print('max |old - new| logits: %.3g' % max_diff)
+    print('{:<10}{:>12}{:>12}'.format('', 'ms / batch', 'peak MiB'))
+    print('{:<10}{:>12.1f}{:>12.1f}'.format('before', old_ms, old_mb))
+    print('{:<10}{:>12.1f}{:>12.1f}'.format('after', new_ms, new_mb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# encoding: utf-8
+"""
+Time ``PointerNetEncoder`` over padded passages with and without ``passages_mask`` (packed LSTM).
+
+    python test/bench_pointer_encoder.py --passage_length 400 --min_length 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from src.modules.Pointer_Network import PointerNetEncoder
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--passage_length', type=int, default=400)
+    parser.add_argument('--min_length', type=int, default=50)
+    parser.add_argument('--input_size', type=int, default=640)
+    parser.add_argument('--hidden_dim', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    encoder = PointerNetEncoder(args.input_size, args.hidden_dim, 2, 0.0, False).to(device).eval()
+    num_sequences = args.batch_size * args.num_passages
+    inputs = torch.randn(num_sequences, args.passage_length, args.input_size, device=device)
+    lengths = torch.randint(args.min_length, args.passage_length + 1, (num_sequences,), device=device)
+    mask = (torch.arange(args.passage_length, device=device).unsqueeze(0) < lengths.unsqueeze(1)).long()
+    print('mean length %.1f / %d' % (lengths.float().mean().item(), args.passage_length))
+
+    for name, encoder_mask in (('padded', None), ('packed', mask)):
+        with torch.no_grad():
+            encoder(inputs, encoder.init_hidden(num_sequences), encoder_mask)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            for _ in range(args.repeat):
+                encoder(inputs, encoder.init_hidden(num_sequences), encoder_mask)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+        print('{:<10}{:>10.1f} ms / batch'.format(name, (time.time() - start) / args.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# encoding: utf-8
+"""
+CPU latency of ``VNet.forward`` in inference mode, fp32 against the dynamic int8 model of
+``src/quantization.py``, on fixed batches of the DuReader fixture (random weights, so only the
+latency and the size are meaningful; see ``python -m src.quantization`` for the accuracy).
+
+    python test/bench_quantization.py --batch_size 8 --num_threads 4
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from allennlp.common.util import lazy_groups_of
+from allennlp.data.dataset import Batch
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from src.quantization import quantize_vnet
+from bench_utils import NUM_CHARACTERS, NUM_TOKENS, build_vnet
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'fixtures',
+                       'big_samples_dureader.json')
+
+
+def fixture_batches(batch_size):
+    token_indexers = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                      'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+    instances = list(MsmarcoMultiPassageReader(token_indexers=token_indexers).read(FIXTURE))
+    vocab = Vocabulary.from_instances(instances, max_vocab_size={'tokens': NUM_TOKENS - 2,
+                                                                 'token_characters': NUM_CHARACTERS - 2})
+    batches = []
+    for group in lazy_groups_of(iter(instances), batch_size):
+        batch = Batch(group)
+        batch.index_instances(vocab)
+        tensors = batch.as_tensor_dict()
+        batches.append({'question': tensors['question'], 'passages': tensors['passages']})
+    return batches
+
+
+def time_batches(model, batches, repeat):
+    with torch.no_grad():
+        answers = [model(**batch)['best_span'] for batch in batches]
+        start = time.time()
+        for _ in range(repeat):
+            for batch in batches:
+                model(**batch)
+    return answers, (time.time() - start) / repeat / len(batches) * 1000
+
+
+def size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--max_span_len', type=int, default=50)
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(0)
+    batches = fixture_batches(args.batch_size)
+    passage_length = max(batch['passages']['tokens'].size(-1) for batch in batches)
+    model = build_vnet(max_passage_len=passage_length, max_span_len=args.max_span_len).eval()
+    model.inference = True
+    quantized = quantize_vnet(model)
+    print('{:<8}{:>12}{:>12}'.format('model', 'ms/batch', 'MiB'))
+    results = {}
+    for name, evaluated in (('fp32', model), ('int8', quantized)):
+        results[name], ms = time_batches(evaluated, batches, args.repeat)
+        print('{:<8}{:>12.1f}{:>12.1f}'.format(name, ms, size_mb(evaluated)))
+    same = sum(torch.equal(fp32, int8) for fp32, int8 in zip(results['fp32'], results['int8']))
+    print('batches with the same answers: %d / %d' % (same, len(batches)))
+
+
+if __name__ == '__main__':
+    main()
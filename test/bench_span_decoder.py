@@ -0,0 +1,116 @@
+# encoding: utf-8
+"""
+Compare ``VNet.get_best_span`` (dense L x L search) with ``VNet.get_best_span_banded``.
+
+    python test/bench_span_decoder.py --batch_size 32 --num_passages 5 --passage_length 400
+
+With ``max_span_len == passage_length`` both decoders must return exactly the same spans; for
+shorter bands the banded decoder is checked against the dense scores restricted to the band.
+``VNet.get_top_k_spans_banded`` is checked against the best end of every start of the dense scores
+and timed next to the single argmax.
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, os.pardir))))
+from src.vnet import VNet
+
+
+def random_inputs(batch_size, num_passages, passage_length, device):
+    def probs(*size):
+        return torch.softmax(torch.randn(*size, device=device) * 3, dim=-1)
+    return (probs(batch_size, num_passages, passage_length),
+            probs(batch_size, num_passages, passage_length),
+            probs(batch_size, num_passages, passage_length),
+            probs(batch_size, num_passages))
+
+
+def dense_band_scores(span_start_probs, span_end_probs, content, passages_verify, max_span_len):
+    """ The dense scores of ``get_best_span`` with every span longer than ``max_span_len`` masked. """
+    batch_size, num_passages, passage_length = span_start_probs.size()
+    device = span_start_probs.device
+    ones = torch.ones((passage_length, passage_length), device=device)
+    band = torch.triu(ones) - torch.triu(ones, diagonal=max_span_len)
+    span_probs = span_start_probs.unsqueeze(-1) * span_end_probs.unsqueeze(-2) * band
+    cumsum_content = torch.cumsum(content.unsqueeze(-2) * torch.triu(ones), dim=-1) /\
+        torch.cumsum(torch.triu(ones), dim=-1)
+    cumsum_content[cumsum_content != cumsum_content] = 0.0
+    return span_probs * cumsum_content * passages_verify.view(batch_size, num_passages, 1, 1)
+
+
+def dense_band_reference(span_start_probs, span_end_probs, content, passages_verify, max_span_len):
+    """ The dense search of ``get_best_span`` with every span longer than ``max_span_len`` masked. """
+    batch_size, num_passages, passage_length = span_start_probs.size()
+    scores = dense_band_scores(span_start_probs, span_end_probs, content, passages_verify, max_span_len)
+    best = scores.view(batch_size, -1).argmax(-1)
+    return torch.stack([best // (passage_length ** 2),
+                        best % (passage_length ** 2) // passage_length,
+                        best % (passage_length ** 2) % passage_length], dim=-1)
+
+
+def timeit(func, repeat, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_max_memory_allocated()
+    start = time.time()
+    for _ in range(repeat):
+        result = func()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        peak = float('nan')
+    return result, (time.time() - start) / repeat * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_passages', type=int, default=5)
+    parser.add_argument('--passage_length', type=int, default=400)
+    parser.add_argument('--max_span_lens', type=int, nargs='+', default=[400, 200, 100, 50])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+
+    # correctness: identical argmax results
+    for trial in range(args.trials):
+        inputs = random_inputs(2, args.num_passages, args.passage_length // 4, device)
+        dense = VNet.get_best_span(*inputs)
+        banded = VNet.get_best_span_banded(*inputs, args.passage_length)
+        assert torch.equal(dense, banded), (trial, dense, banded)
+        for max_span_len in args.max_span_lens:
+            reference = dense_band_reference(*inputs, max_span_len)
+            banded = VNet.get_best_span_banded(*inputs, max_span_len)
+            assert torch.equal(reference, banded), (trial, max_span_len, reference, banded)
+            # the top-k of the best end of every start, best first
+            top_k_spans, top_k_scores = VNet.get_top_k_spans_banded(*inputs, max_span_len, args.top_k)
+            best_ends = dense_band_scores(*inputs, max_span_len).max(-1)[0].view(2, -1)
+            assert torch.allclose(top_k_scores, best_ends.topk(args.top_k, dim=-1)[0]), (trial, max_span_len)
+            assert torch.equal(top_k_spans[:, 0], banded), (trial, max_span_len, top_k_spans, banded)
+    print('argmax and top-%d results are identical on %d random trials' % (args.top_k, args.trials))
+
+    inputs = random_inputs(args.batch_size, args.num_passages, args.passage_length, device)
+    dense, dense_ms, dense_mb = timeit(lambda: VNet.get_best_span(*inputs), args.repeat, device)
+    print('{:<24}{:>12}{:>14}{:>10}'.format('decoder', 'ms / batch', 'peak MiB', 'same'))
+    print('{:<24}{:>12.1f}{:>14.1f}{:>10}'.format('dense', dense_ms, dense_mb, '-'))
+    for max_span_len in args.max_span_lens:
+        banded, banded_ms, banded_mb = timeit(
+            lambda: VNet.get_best_span_banded(*inputs, max_span_len), args.repeat, device)
+        same = torch.equal(dense, banded) if max_span_len >= args.passage_length else '-'
+        print('{:<24}{:>12.1f}{:>14.1f}{:>10}'.format('banded K=%d' % max_span_len,
+                                                     banded_ms, banded_mb, str(same)))
+        (top_k_spans, _), top_k_ms, top_k_mb = timeit(
+            lambda: VNet.get_top_k_spans_banded(*inputs, max_span_len, args.top_k), args.repeat, device)
+        print('{:<24}{:>12.1f}{:>14.1f}{:>10}'.format('top-%d K=%d' % (args.top_k, max_span_len),
+                                                     top_k_ms, top_k_mb, str(torch.equal(top_k_spans[:, 0], banded))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# encoding: utf-8
+"""
+Helpers shared by the ``bench_*.py`` scripts: a small randomly initialised ``VNet`` and random
+batches in the layout produced by the dataset readers.
+"""
+import time
+
+import torch
+from allennlp.data import Vocabulary
+from allennlp.modules.matrix_attention.linear_matrix_attention import LinearMatrixAttention
+from allennlp.modules.seq2seq_encoders import PytorchSeq2SeqWrapper
+from allennlp.modules.seq2vec_encoders import CnnEncoder
+from allennlp.modules.text_field_embedders import BasicTextFieldEmbedder
+from allennlp.modules.token_embedders import Embedding, TokenCharactersEncoder
+
+from src.vnet import VNet
+from src.modules.Pointer_Network import PointerNet
+
+NUM_TOKENS = 5000
+NUM_CHARACTERS = 300
+
+
+def build_vnet(embedding_dim=100, num_filters=32, hidden_size=64, max_num_passages=5,
+               max_passage_len=400, max_num_character=15, **kwargs) -> VNet:
+    text_field_embedder = BasicTextFieldEmbedder({
+            'tokens': Embedding(NUM_TOKENS, embedding_dim),
+            'token_characters': TokenCharactersEncoder(Embedding(NUM_CHARACTERS, 16),
+                                                       CnnEncoder(16, num_filters,
+                                                                  ngram_filter_sizes=(5,)))})
+    highway_size = embedding_dim + num_filters
+    encoding_dim = 2 * hidden_size
+    phrase_layer = PytorchSeq2SeqWrapper(torch.nn.LSTM(highway_size, hidden_size, batch_first=True,
+                                                       bidirectional=True))
+    modeling_layer = PytorchSeq2SeqWrapper(torch.nn.LSTM(encoding_dim * 4, hidden_size, num_layers=2,
+                                                         batch_first=True, bidirectional=True))
+    span_end_lstm = PytorchSeq2SeqWrapper(torch.nn.LSTM(encoding_dim * 5, hidden_size, batch_first=True))
+    return VNet(Vocabulary(),
+                text_field_embedder=text_field_embedder,
+                highway_embedding_size=highway_size,
+                num_highway_layers=1,
+                phrase_layer=phrase_layer,
+                matrix_attention_layer=LinearMatrixAttention(highway_size, highway_size, 'x,y,x*y'),
+                modeling_layer=modeling_layer,
+                pointer_net=PointerNet(encoding_dim * 5, hidden_size, lstm_layers=2, dropout=0.0),
+                span_end_lstm=span_end_lstm,
+                ptr_dim=hidden_size,
+                dropout=0.0,
+                max_num_passages=max_num_passages,
+                max_passage_len=max_passage_len,
+                max_num_character=max_num_character,
+                **kwargs)
+
+
+def random_text(lengths, num_characters=15):
+    """
+    Random ``TextField`` tensors for a batch of sequences; ``lengths`` has one entry per sequence
+    (any shape), padding positions are 0.
+    """
+    lengths = torch.as_tensor(lengths)
+    max_length = int(lengths.max())
+    positions = torch.arange(max_length).view(*([1] * lengths.dim()), max_length)
+    mask = (positions < lengths.unsqueeze(-1)).long()
+    tokens = torch.randint(2, NUM_TOKENS, lengths.size() + (max_length,)) * mask
+    token_characters = torch.randint(2, NUM_CHARACTERS, tokens.size() + (num_characters,))
+    return {'tokens': tokens, 'token_characters': token_characters * mask.unsqueeze(-1)}
+
+
+def random_batch(batch_size=32, num_passages=5, passage_length=400, question_length=20,
+                 min_passage_length=None):
+    min_passage_length = min_passage_length or passage_length
+    passage_lengths = torch.randint(min_passage_length, passage_length + 1, (batch_size, num_passages))
+    passage_lengths[0, 0] = passage_length
+    return {'question': random_text(torch.full((batch_size,), question_length, dtype=torch.long)),
+            'passages': random_text(passage_lengths),
+            'metadata': [random_metadata(i, question_length, passage_lengths[i].tolist())
+                         for i in range(batch_size)]}
+
+
+def random_metadata(qid, question_length, passage_lengths):
+    """ Metadata with one single-character token per position, as ``VNet`` reads it. """
+    return {'qid': qid,
+            'question_tokens': ['q'] * question_length,
+            'passage_tokens': [['p'] * length for length in passage_lengths],
+            'original_passages': ['p' * length for length in passage_lengths],
+            'passages_offsets': [[(i, i + 1) for i in range(length)] for length in passage_lengths],
+            'answer_texts': []}
+
+
+def move_to_device(batch, device):
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device)
+    if isinstance(batch, dict):
+        return {key: move_to_device(value, device) for key, value in batch.items()}
+    return batch
+
+
+def time_forward(model, batch, repeat=5, device=torch.device('cpu')):
+    """ Milliseconds per ``model(**batch)`` call (no gradients) after one warm-up call. """
+    batch = move_to_device(batch, device)
+    with torch.no_grad():
+        model(**batch)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(repeat):
+            model(**batch)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+    return (time.time() - start) / repeat * 1000
@@ -0,0 +1,82 @@
+# encoding: utf-8
+import json
+import os
+import subprocess
+import sys
+
+import numpy
+import torch
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data.dataset import Batch
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+from src.VNetPredictor import VNetPredictorDu
+from src.export import export_vnet
+from src.exported_predictor import ExportedVNetPredictor
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from bench_utils import build_vnet
+
+
+class TestExport(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        token_indexers = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                          'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+        self.reader = MsmarcoMultiPassageReader(token_indexers=token_indexers, lazy=True)
+        with open('../fixtures/big_samples_dureader.json.instances') as f:
+            self.samples = [json.loads(line) for line in f][:6]
+        for sample in self.samples:
+            sample['passages_tokens'] = [passage_tokens[:100] for passage_tokens in sample['passages_tokens']]
+        # the scores of a random model are close, a fixed one keeps the top-k order away from ties
+        torch.manual_seed(0)
+        self.model = build_vnet(max_num_passages=5, max_passage_len=120, max_span_len=30)
+        self.model.vocab = Vocabulary.from_instances(self.reader.read('../fixtures/big_samples_dureader.json'),
+                                                     max_vocab_size={'tokens': 4000, 'token_characters': 250})
+        self.model_file = os.path.join(self.TEST_DIR, 'vnet.pt')
+        export_vnet(self.model, self.reader, self.model_file, top_k=3)
+
+    def assert_same_answers(self, samples):
+        # the question characters are padded to the longest question token of the batch
+        expected = VNetPredictorDu(self.model, self.reader, top_k=3).predict_batch_json(samples)
+        exported = ExportedVNetPredictor(self.model_file).predict_batch_json(samples)
+        for expected_output, output in zip(expected, exported):
+            assert output['qids'] == expected_output['qids']
+            assert output['best_span_str'] == expected_output['best_span_str']
+            assert output['top_k_span_str'] == expected_output['top_k_span_str']
+            assert output['top_k_spans'] == expected_output['top_k_spans']
+            numpy.testing.assert_allclose(output['top_k_scores'], expected_output['top_k_scores'], rtol=1e-5)
+
+    def test_exported_predictor_gives_the_answers_of_the_model(self):
+        self.assert_same_answers(self.samples)
+        self.assert_same_answers(self.samples[:1])
+
+    def test_question_tokens_longer_than_max_num_character(self):
+        word = 'internationalization'
+        assert len(word) > self.model.max_num_character
+        sample = self.samples[3]
+        sample['question_tokens'] = sample['question_tokens'] + [[word, 10]]
+        predictor = ExportedVNetPredictor(self.model_file)
+        model_predictor = VNetPredictorDu(self.model, self.reader)
+        for samples in (self.samples, [sample]):
+            batch = Batch([model_predictor._json_to_instance(sample)  # pylint: disable=protected-access
+                           for sample in samples])
+            batch.index_instances(self.model.vocab)
+            expected = batch.as_tensor_dict()['question']['token_characters']
+            question_characters = predictor._tensors([predictor._metadata(sample)  # pylint: disable=protected-access
+                                                      for sample in samples])[1]
+            assert question_characters.tolist() == expected.tolist()
+            self.assert_same_answers(samples)
+
+    def test_script_does_not_import_allennlp(self):
+        input_file = os.path.join(self.TEST_DIR, 'samples.json')
+        with open(input_file, 'w') as f:
+            f.writelines(json.dumps(sample, ensure_ascii=False) + '\n' for sample in self.samples)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'exported_predictor.py')
+        check = ("import runpy, sys; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__'); "
+                 "assert 'allennlp' not in sys.modules")
+        output = subprocess.run([sys.executable, '-c', check, script, self.model_file, input_file],
+                                stdout=subprocess.PIPE, check=True).stdout.decode('utf-8')
+        lines = [json.loads(line) for line in output.splitlines()]
+        assert [line['question_id'] for line in lines] == [sample['qid'] for sample in self.samples]
+        assert all(len(line['top_k_answers']) == 3 for line in lines)
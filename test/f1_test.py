@@ -0,0 +1,94 @@
+# encoding: utf-8
+import random
+
+from allennlp.common.testing import AllenNlpTestCase
+
+from src.utils import ChineseMaxF1Mesure, F1Scorer, MaxF1Mesure, get_ans_by_f1
+
+WORDS = ['cost', 'Cost,', 'living', 'the', 'a', '$4,625', 'per', 'month.', '']
+CHINESE = '华盛顿州的平均费用是每月，。？ ab'
+
+
+def nested_loop_f1_answer(passage, answers, threshold):
+    """ ``get_ans_by_f1`` with every span scored from its text by ``MaxF1Mesure.calc_score``. """
+    measure = MaxF1Mesure()
+    segments = passage.split(' ')
+    starts = [sum(len(segment) + 1 for segment in segments[:i]) for i in range(len(segments))]
+    candidates = []
+    for lo_segment, lo in enumerate(starts):
+        for hi_segment in range(lo_segment, len(segments)):
+            hi = starts[hi_segment] + len(segments[hi_segment])
+            if hi == lo:
+                continue
+            score = measure.calc_score([passage[lo:hi]], answers)
+            if score > threshold:
+                if len(candidates) > 0:
+                    if lo == candidates[-1][0]:
+                        if score < candidates[-1][2]:
+                            break
+                        elif score > candidates[-1][2]:
+                            candidates = candidates[:-1]
+                    elif hi == candidates[-1][1] and score < candidates[-1][2]:
+                        break
+                    while len(candidates) > 1 and hi == candidates[-1][1] and score > candidates[-1][2]:
+                        candidates = candidates[:-1]
+                candidates.append((lo, hi, score))
+    best_answer, max_score = '', 0
+    for lo, hi, score in candidates:
+        if score > max_score:
+            best_answer, max_score = passage[lo:hi], score
+    return [best_answer] if best_answer else []
+
+
+class TestF1(AllenNlpTestCase):
+    def test_get_ans_by_f1_matches_nested_loop(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            passage = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 25)))
+            answers = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+                       for _ in range(rng.randint(1, 3))]
+            for threshold in (0.3, 0.7):
+                assert get_ans_by_f1(passage, answers, threshold) == \
+                    nested_loop_f1_answer(passage, answers, threshold)
+
+    def test_get_ans_by_f1_first_word(self):
+        assert get_ans_by_f1('cost of living in washington', ['cost']) == ['cost']
+        assert get_ans_by_f1('cost of living in washington', ['cost of living']) == ['cost of living']
+        assert get_ans_by_f1('cost of living', ['washington']) == []
+
+    def test_calc_score_is_the_best_answer(self):
+        measure = MaxF1Mesure()
+        assert measure.calc_score(['cost of living'], ['cost of living', 'washington']) == 1
+        assert measure.calc_score(['cost of living'], ['washington', 'cost of living', 'month']) == 1
+
+    def test_chinese_calc_score_is_the_best_answer(self):
+        measure = ChineseMaxF1Mesure()
+        assert measure.calc_score(['平均费用'], ['平均费用', '华盛顿']) == 1
+        assert measure.calc_score(['平均费用'], ['费用是每月', '华盛顿']) == measure.compute_f1('平均费用', '费用是每月')
+
+    def test_score_many_matches_calc_score(self):
+        rng = random.Random(0)
+
+        def english():
+            return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6)))
+
+        def chinese():
+            return ''.join(rng.choice(CHINESE) for _ in range(rng.randint(0, 8)))
+        for measure, sample in ((MaxF1Mesure(), english), (ChineseMaxF1Mesure(), chinese)):
+            # a cache smaller than the references, so that they are evicted and normalized again
+            scorer = F1Scorer(measure, cache_size=2)
+            for _ in range(100):
+                refs = [sample() for _ in range(rng.randint(1, 4))]
+                candidates = [sample() for _ in range(rng.randint(0, 6))]
+                scores = scorer.score_many(candidates, refs)
+                assert scores.shape == (len(candidates),)
+                assert scores.tolist() == [measure.calc_score([candidate], refs) for candidate in candidates]
+
+    def test_scorer_caches_the_references(self):
+        scorer = F1Scorer(cache_size=2)
+        for _ in range(3):
+            scorer.score_many(['cost of living', 'per month'], ['the cost', 'a month'])
+        info = scorer._ref_counts.cache_info()  # pylint: disable=protected-access
+        assert (info.misses, info.currsize) == (2, 2)
+        scorer.score('cost', ['living'])
+        assert scorer._ref_counts.cache_info().currsize == 2  # pylint: disable=protected-access
@@ -0,0 +1,83 @@
+# encoding: utf-8
+import random
+
+from allennlp.common.testing import AllenNlpTestCase
+
+from src.scripts.lcs import lcs_length, lcs_row, lcs_rows
+from src.scripts.rouge_span import best_rouge_l_span
+
+
+def dynamic_programming_row(token_a, token_p):
+    lcs_map = [[0 for i in range(0, len(token_p) + 1)]
+               for j in range(0, len(token_a) + 1)]
+    for j in range(1, len(token_p) + 1):
+        for i in range(1, len(token_a) + 1):
+            if(token_a[i - 1] == token_p[j - 1]):
+                lcs_map[i][j] = lcs_map[i - 1][j - 1] + 1
+            else:
+                lcs_map[i][j] = max(lcs_map[i - 1][j], lcs_map[i][j - 1])
+    return lcs_map[-1]
+
+
+def nested_loop_span(token_as, token_p, threshold):
+    """ The span search of the former ``get_answers_with_RougeL``, returning ``(lo, hi)``. """
+    beta = 1.2
+    lcs = lcs_rows(token_as, token_p)
+    candidates = []
+    for lo in range(len(token_p)):
+        for hi in range(lo, len(token_p)):
+            if all(ch == ' ' for ch in ' '.join(token_p[lo:hi])):
+                continue
+            lcs_scores = [lcs[idx][hi + 1] - lcs[idx][lo] for idx in range(len(token_as))]
+            prec_max = max(lcs_score / float(len(token_a)) for lcs_score, token_a in zip(lcs_scores, token_as))
+            rec_max = max(lcs_score / float(hi - lo + 1) for lcs_score in lcs_scores)
+            if prec_max != 0 and rec_max != 0:
+                score = ((1 + beta ** 2) * prec_max * rec_max) / float(rec_max + beta ** 2 * prec_max)
+            else:
+                score = 0.0
+            if score > threshold:
+                if len(candidates) > 0:
+                    if lo == candidates[-1][0]:
+                        if score < candidates[-1][2]:
+                            break
+                        elif score > candidates[-1][2]:
+                            candidates = candidates[:-1]
+                    elif hi == candidates[-1][1] and score < candidates[-1][2]:
+                        break
+                    while len(candidates) > 1 and hi == candidates[-1][1] and score > candidates[-1][2]:
+                        candidates = candidates[:-1]
+                candidates.append((lo, hi, score))
+    best_span, max_score = None, 0
+    for lo, hi, score in candidates:
+        if score > max_score:
+            best_span, max_score = (lo, hi), score
+    return best_span
+
+
+class TestLcs(AllenNlpTestCase):
+    def test_matches_dynamic_programming(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            token_a = [rng.choice('abcd') for _ in range(rng.randint(0, 70))]
+            token_p = [rng.choice('abcde') for _ in range(rng.randint(0, 80))]
+            expected = dynamic_programming_row(token_a, token_p)
+            assert lcs_row(token_a, token_p) == expected
+            assert lcs_length(token_a, token_p) == lcs_length(token_p, token_a) == expected[-1]
+
+    def test_tokens(self):
+        answer = 'the average cost is $ 4,625 per month'.split()
+        passage = 'the average cost of assisted living is $ 4,625 per month .'.split()
+        assert lcs_length(answer, passage) == 8
+        assert lcs_row(answer, passage)[:4] == [0, 1, 2, 3]
+
+    def test_best_rouge_l_span(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            passage = ''.join(rng.choice('abc d ') for _ in range(rng.randint(0, 40)))
+            answers = [''.join(rng.choice('abcd') for _ in range(rng.randint(1, 8)))
+                       for _ in range(rng.randint(1, 3))]
+            for threshold in (0.3, 0.7):
+                for token_as, token_p in (([list(ans) for ans in answers], list(passage)),
+                                          ([ans.split(' ') for ans in answers], passage.split(' '))):
+                    assert best_rouge_l_span(token_as, token_p, threshold) == \
+                        nested_loop_span(token_as, token_p, threshold)
@@ -1,9 +1,47 @@
+import json
+import os
+import shutil
+from unittest import mock
+
 from allennlp.common.testing import AllenNlpTestCase
 from allennlp.common.util import ensure_list
+from allennlp.data.dataset import Batch
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
 
 # export PYTHONPATH=/home/meelfy/working/msmarco/:$PYTHONPATH
 # export PYTHONPATH=/home/meelfy/working/msmarco/src/:$PYTHONPATH
 from src.msmarco_reader import MsmarcoMultiPassageReader
+from src.dureader_reader import DuReaderMultiPassageReader
+from src.instance_store import InstanceStore
+from src.token_id_cache import CACHE_SUFFIX
+
+TOKEN_INDEXERS = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                  'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+
+
+def indexed_tensors(reader, file_path, directory):
+    """
+    The tensors of the instances ``reader`` reads from ``file_path``, indexed with a vocabulary of
+    all of them but the last one, which is saved in ``directory/vocabulary``.
+    """
+    instances = ensure_list(reader.read(file_path))
+    vocab = Vocabulary.from_instances(instances[:-1])
+    vocab.save_to_files(os.path.join(directory, 'vocabulary'))
+    batch = Batch(instances)
+    batch.index_instances(vocab)
+    return batch.as_tensor_dict()
+
+
+def assert_same_tensors(reader, file_path, expected_tensors):
+    """ Reads ``file_path`` with the pre-indexing ``reader`` and compares the tensors. """
+    tensors = Batch(ensure_list(reader.read(file_path))).as_tensor_dict()
+    for key in ('question', 'passages'):
+        for name in ('tokens', 'token_characters'):
+            assert tensors[key][name].equal(expected_tensors[key][name])
+    assert tensors['spans_start'].equal(expected_tensors['spans_start'])
+    assert tensors['spans_end'].equal(expected_tensors['spans_end'])
+    assert [dict(metadata) for metadata in tensors['metadata']] == expected_tensors['metadata']
 
 
 class TestQAReader(AllenNlpTestCase):
@@ -25,3 +63,92 @@ class TestQAReader(AllenNlpTestCase):
         assert passage == fields['metadata']['passage_tokens'][6]
         assert len(fields['metadata']['answer_texts']) == 10
         assert ''.join(passage[start:end+1]) == fields['metadata']['answer_texts'][6][0].replace(' ','')
+
+    def test_read_from_instance_store(self):
+        file_path = os.path.join(self.TEST_DIR, 'samples.json')
+        shutil.copy('../fixtures/big_samples_dureader.json.instances', file_path + '.instances')
+        reader = MsmarcoMultiPassageReader(lazy=True)
+        expected = ensure_list(reader.read(file_path))
+
+        InstanceStore.from_instances_file(file_path + '.instances')
+        instances = ensure_list(reader.read(file_path))
+
+        assert len(instances) == len(expected)
+        for instance, expected_instance in zip(instances, expected):
+            assert instance.fields['metadata'].metadata == expected_instance.fields['metadata'].metadata
+            assert [t.text for t in instance.fields['question'].tokens] == \
+                [t.text for t in expected_instance.fields['question'].tokens]
+            assert [[span.sequence_index for span in spans] for spans in instance.fields['spans_start']] == \
+                [[span.sequence_index for span in spans] for spans in expected_instance.fields['spans_start']]
+
+        # a regenerated .instances file is read instead of the stale store
+        with open(file_path + '.instances') as f:
+            lines = f.readlines()
+        with open(file_path + '.instances', 'w') as f:
+            f.writelines(lines[:3])
+        instances = ensure_list(reader.read(file_path))
+        assert [instance.fields['metadata']['qid'] for instance in instances] == \
+            [instance.fields['metadata']['qid'] for instance in expected[:3]]
+
+    def test_stream_raw_file(self):
+        file_path = os.path.join(self.TEST_DIR, '2samples.json')
+        shutil.copy('../fixtures/2samples.json', file_path)
+        expected = ensure_list(MsmarcoMultiPassageReader(lazy=True).read(file_path))
+        instances = ensure_list(MsmarcoMultiPassageReader(lazy=True, stream=True).read(file_path))
+
+        assert len(instances) == len(expected)
+        for instance, expected_instance in zip(instances, expected):
+            assert instance.fields['metadata'].metadata == expected_instance.fields['metadata'].metadata
+
+    def test_read_pre_indexed(self):
+        file_path = os.path.join(self.TEST_DIR, 'samples.json')
+        shutil.copy('../fixtures/big_samples_dureader.json.instances', file_path + '.instances')
+        expected_tensors = indexed_tensors(MsmarcoMultiPassageReader(token_indexers=TOKEN_INDEXERS),
+                                           file_path, self.TEST_DIR)
+
+        reader = MsmarcoMultiPassageReader(token_indexers=TOKEN_INDEXERS,
+                                           vocabulary_directory=os.path.join(self.TEST_DIR, 'vocabulary'))
+        for _ in range(2):
+            assert_same_tensors(reader, file_path, expected_tensors)
+            # the second time from the instance store
+            InstanceStore.from_instances_file(file_path + '.instances')
+
+    def test_token_id_cache(self):
+        file_path = os.path.join(self.TEST_DIR, 'samples.json')
+        shutil.copy('../fixtures/big_samples_dureader.json.instances', file_path + '.instances')
+        expected_tensors = indexed_tensors(MsmarcoMultiPassageReader(token_indexers=TOKEN_INDEXERS),
+                                           file_path, self.TEST_DIR)
+
+        reader = MsmarcoMultiPassageReader(token_indexers=TOKEN_INDEXERS, cache_token_ids=True,
+                                           vocabulary_directory=os.path.join(self.TEST_DIR, 'vocabulary'))
+        cache_directory = file_path + '.instances' + CACHE_SUFFIX
+        # a new limit invalidates the cache
+        for max_samples, caches in ((-1, 1), (-1, 1), (1000, 2)):
+            reader.max_samples = max_samples
+            assert_same_tensors(reader, file_path, expected_tensors)
+            assert len(os.listdir(cache_directory)) == caches
+
+
+class TestDuReaderReader(AllenNlpTestCase):
+    def test_token_id_cache(self):
+        file_path = os.path.join(self.TEST_DIR, 'dev.json')
+        with open(file_path, 'w') as f:
+            for qid, words in enumerate([['法律', '是', '国家'], ['制定', '认可', '规则'], ['国家', '的', '规则']]):
+                sample = {'question_id': qid,
+                          'segmented_question': words[:2] + ['吗'],
+                          'documents': [{'segmented_paragraphs': [words[::-1], words + ['的']]},
+                                        {'segmented_paragraphs': [words[1:]]}],
+                          'answers': [''.join(words)],
+                          'answer_docs': [0],
+                          'answer_spans': [[0, 1]]}
+                f.write(json.dumps(sample, ensure_ascii=False) + '\n')
+        expected_tensors = indexed_tensors(DuReaderMultiPassageReader(token_indexers=TOKEN_INDEXERS),
+                                           file_path, self.TEST_DIR)
+
+        reader = DuReaderMultiPassageReader(token_indexers=TOKEN_INDEXERS, cache_token_ids=True,
+                                            vocabulary_directory=os.path.join(self.TEST_DIR, 'vocabulary'))
+        assert_same_tensors(reader, file_path, expected_tensors)
+        assert len(os.listdir(file_path + CACHE_SUFFIX)) == 1
+        # the second pass reads neither the file nor selects paragraphs
+        with mock.patch.object(reader, '_load_dataset', side_effect=AssertionError('read %s' % file_path)):
+            assert_same_tensors(reader, file_path, expected_tensors)
@@ -0,0 +1,47 @@
+# encoding: utf-8
+import random
+from collections import Counter
+
+from allennlp.common.testing import AllenNlpTestCase
+
+from src.paragraph_selection import ParagraphSelector, select_paragraphs
+
+
+def counter_selection(question_tokens, paragraphs):
+    """ The former selection of ``DuReaderMultiPassageReader._load_dataset``. """
+    para_infos = []
+    for para_tokens in paragraphs:
+        common_with_question = Counter(para_tokens) & Counter(question_tokens)
+        correct_preds = sum(common_with_question.values())
+        if correct_preds == 0:
+            recall_wrt_question = 0
+        else:
+            recall_wrt_question = float(correct_preds) / len(question_tokens)
+        para_infos.append((para_tokens, recall_wrt_question, len(para_tokens)))
+    para_infos.sort(key=lambda x: (-x[1], x[2]))
+    fake_passage_tokens = []
+    for para_info in para_infos[:1]:
+        fake_passage_tokens += para_info[0]
+    return fake_passage_tokens
+
+
+class TestParagraphSelection(AllenNlpTestCase):
+    def test_matches_counter_selection(self):
+        rng = random.Random(0)
+        words = ['法律', '是', '国家', '的', '制定', '认可', '规则', 'x']
+        for _ in range(1000):
+            question_tokens = [rng.choice(words) for _ in range(rng.randint(0, 6))]
+            documents = [[[rng.choice(words) for _ in range(rng.randint(0, 8))] for _ in range(rng.randint(0, 4))]
+                         for _ in range(rng.randint(0, 5))]
+            selection = select_paragraphs(question_tokens, documents)
+            for paragraphs, index in zip(documents, selection):
+                selected = paragraphs[index] if index >= 0 else []
+                assert selected == counter_selection(question_tokens, paragraphs)
+
+    def test_cache(self):
+        selector = ParagraphSelector()
+        assert selector.select('q1', ['a', 'b'], [[['c'], ['b', 'a', 'x'], ['a', 'b']], []]) == [2, -1]
+        # the cached selection, whatever the tokens
+        assert selector.select('q1', ['c'], [[['c']]]) == [2, -1]
+        assert selector.select(None, ['c'], [[['a'], ['c']]]) == [1]
+        assert len(selector) == 1
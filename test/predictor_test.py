@@ -0,0 +1,44 @@
+# encoding: utf-8
+import torch
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data.dataset import Batch
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+from src.VNetPredictor import VNetPredictorDu
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from bench_utils import NUM_CHARACTERS, NUM_TOKENS, build_vnet
+
+
+class TestVNetPredictor(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        token_indexers = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                          'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+        self.reader = MsmarcoMultiPassageReader(token_indexers=token_indexers)
+        self.instances = self.reader.read('../fixtures/big_samples_dureader.json')[:6]
+        torch.manual_seed(0)
+        self.model = build_vnet(max_passage_len=500, max_span_len=30).eval()
+        self.model.vocab = Vocabulary.from_instances(self.instances,
+                                                     max_vocab_size={'tokens': NUM_TOKENS - 2,
+                                                                     'token_characters': NUM_CHARACTERS - 2})
+
+    def test_inference_mode_gives_the_answers_of_the_default_mode(self):
+        expected = self.model.forward_on_instances(self.instances)
+        predictor = VNetPredictorDu(self.model, self.reader, top_k=3)
+        outputs = predictor.predict_batch_instance(self.instances)
+        assert [output['best_span_str'] for output in outputs] == \
+            [output['best_span_str'] for output in expected]
+        assert [output['best_span'] for output in outputs] == [output['best_span'].tolist() for output in expected]
+        assert all(len(output['top_k_span_str']) == 3 and 'span_start_logits' not in output for output in outputs)
+        assert predictor.predict_instance(self.instances[0])['best_span_str'] == expected[0]['best_span_str']
+
+    def test_predictor_leaves_the_model_mode(self):
+        predictor = VNetPredictorDu(self.model, self.reader, top_k=3)
+        predictor.predict_batch_instance(self.instances[:2])
+        assert not self.model.inference and self.model.top_k is None
+        batch = Batch(self.instances[:2])
+        batch.index_instances(self.model.vocab)
+        with torch.no_grad():
+            output = self.model(**batch.as_tensor_dict())
+        assert 'loss' in output and 'top_k_spans' not in output
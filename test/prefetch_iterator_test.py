@@ -0,0 +1,65 @@
+import os
+import pickle
+import shutil
+from unittest import mock
+
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.common.util import ensure_list
+from allennlp.data.iterators import BasicIterator
+from allennlp.data.token_indexers import SingleIdTokenIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from src.instance_store import InstanceStore
+from src.prefetch_iterator import PrefetchIterator
+
+
+class TestPrefetchIterator(AllenNlpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file_path = os.path.join(self.TEST_DIR, 'samples.json')
+        shutil.copy('../fixtures/big_samples_dureader.json.instances', self.file_path + '.instances')
+        self.reader = MsmarcoMultiPassageReader(lazy=True)
+        self.expected = sorted(instance.fields['metadata'].metadata['qid']
+                               for instance in self.reader.read(self.file_path))
+        self.vocab = Vocabulary.from_instances(self.reader.read(self.file_path))
+
+    def read_qids(self, instances, num_workers):
+        iterator = PrefetchIterator(BasicIterator(batch_size=2), num_workers=num_workers, prefetch_batches=2)
+        iterator.index_with(self.vocab)
+        qids = []
+        for tensor_dict in iterator(instances, num_epochs=2):
+            assert tensor_dict['question']['tokens'].size(0) <= 2
+            qids.extend(metadata['qid'] for metadata in tensor_dict['metadata'])
+        assert len(iterator.data_wait_fractions) == 2
+        return sorted(qids)
+
+    def test_workers_read_disjoint_shards(self):
+        instances = self.reader.read(self.file_path)
+        assert self.read_qids(instances, 3) == sorted(self.expected * 2)
+
+        InstanceStore.from_instances_file(self.file_path + '.instances')
+        assert self.read_qids(instances, 3) == sorted(self.expected * 2)
+
+    def test_instance_list(self):
+        instances = ensure_list(self.reader.read(self.file_path))
+        assert self.read_qids(instances, 2) == sorted(self.expected * 2)
+
+    def test_batches_share_the_unpickled_store(self):
+        InstanceStore.from_instances_file(self.file_path + '.instances')
+        self.vocab.save_to_files(os.path.join(self.TEST_DIR, 'vocabulary'))
+        reader = MsmarcoMultiPassageReader(token_indexers={'tokens': SingleIdTokenIndexer()},
+                                           vocabulary_directory=os.path.join(self.TEST_DIR, 'vocabulary'))
+        metadata = [instance.fields['metadata'].metadata for instance in reader.read(self.file_path)]
+        opened = []
+        init = InstanceStore.__init__
+
+        def counting_init(store, path):
+            opened.append(path)
+            init(store, path)
+        with mock.patch.object(InstanceStore, '__init__', counting_init):
+            # one batch at a time, as the trainer receives them
+            copies = [pickle.loads(pickle.dumps(metadata[i:i + 2])) for i in range(0, len(metadata), 2)]
+            decoded = [dict(batch_metadata) for batch in copies for batch_metadata in batch]
+        assert len(opened) == 1
+        assert decoded == [dict(batch_metadata) for batch_metadata in metadata]
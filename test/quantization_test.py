@@ -0,0 +1,62 @@
+# encoding: utf-8
+import torch
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+from src.VNetPredictor import VNetPredictorDuInt8
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from src.quantization import quantization_report, quantize_vnet
+from bench_utils import NUM_CHARACTERS, NUM_TOKENS, build_vnet, random_batch
+
+
+class TestQuantization(AllenNlpTestCase):
+    def test_quantize_vnet_replaces_the_lstms_and_linear_layers(self):
+        # the spans of random weights are close to ties that any rounding flips; the best spans of
+        # this seed beat the second ones by more than 0.3%, several times the int8 score error
+        torch.manual_seed(2)
+        model = build_vnet(max_num_passages=3, max_passage_len=40, max_span_len=10).eval()
+        quantized = quantize_vnet(model)
+        assert not any(isinstance(module, (torch.nn.LSTM, torch.nn.Linear)) for module in quantized.modules())
+        assert isinstance(model._phrase_layer._module, torch.nn.LSTM)
+
+        batch = random_batch(8, 3, 40, min_passage_length=20)
+        model.inference = quantized.inference = True
+        model.top_k = quantized.top_k = 2
+        with torch.no_grad():
+            expected = model(**batch)
+            output = quantized(**batch)
+        assert output['best_span'].size() == (8, 3)
+        assert (output['best_span'] == expected['best_span']).all(-1).sum() >= 7
+        assert sum(answer == expected_answer for answer, expected_answer
+                   in zip(output['best_span_str'], expected['best_span_str'])) >= 7
+        assert torch.allclose(output['top_k_scores'][:, 0], expected['top_k_scores'][:, 0], rtol=0.05)
+
+    def test_dynamic_padding(self):
+        model = build_vnet(max_num_passages=3, max_passage_len=40, dynamic_padding=True).eval()
+        quantized = quantize_vnet(model)
+        quantized.inference = True
+        with torch.no_grad():
+            output = quantized(**random_batch(2, 2, 30))
+        assert output['best_span'][:, 0].max() < 2
+
+    def test_report_and_predictor(self):
+        token_indexers = {'tokens': SingleIdTokenIndexer(lowercase_tokens=True),
+                          'token_characters': TokenCharactersIndexer(min_padding_length=5)}
+        reader = MsmarcoMultiPassageReader(token_indexers=token_indexers)
+        instances = reader.read('../fixtures/big_samples_dureader.json')[:4]
+        model = build_vnet(max_passage_len=500, max_span_len=20).eval()
+        model.vocab = Vocabulary.from_instances(instances,
+                                                max_vocab_size={'tokens': NUM_TOKENS - 2,
+                                                                'token_characters': NUM_CHARACTERS - 2})
+        report = quantization_report(model, instances, batch_size=2)
+        assert report['num_samples'] == 4
+        assert set(report['int8']['metrics']) == {'rouge_L', 'bleu_4'}
+        assert report['int8']['size_mb'] < report['fp32']['size_mb']
+        assert 0 <= report['same_answers'] <= 1
+        assert report['weight_errors']['_phrase_layer._module.weight_ih_l0'] < 0.05
+
+        predictor = VNetPredictorDuInt8(model, reader)
+        assert predictor._model is not model and not model.inference
+        output = predictor.predict_instance(instances[0])
+        assert output['qids'] == instances[0].fields['metadata'].metadata['qid']
@@ -0,0 +1,50 @@
+# encoding: utf-8
+import asyncio
+import io
+import json
+
+from allennlp.common.testing import AllenNlpTestCase
+from allennlp.data import Instance
+from allennlp.data.fields import MetadataField
+
+from src.serving import MicroBatcher, serve_lines
+
+
+class FakePredictor:
+    def __init__(self):
+        self.batches = []
+
+    def load_line(self, line):
+        return json.loads(line)
+
+    def _json_to_instance(self, json_dict):
+        return Instance({'metadata': MetadataField({'qid': json_dict['qid'],
+                                                    'passage_tokens': [['x'] * json_dict['length']]})})
+
+    def predict_batch_instance(self, instances):
+        self.batches.append([instance.fields['metadata'].metadata['qid'] for instance in instances])
+        return [{'qids': instance.fields['metadata'].metadata['qid']} for instance in instances]
+
+    def dump_line(self, outputs):
+        return json.dumps({'query_id': outputs['qids']}) + '\n'
+
+
+class TestMicroBatcher(AllenNlpTestCase):
+    def test_serve_lines(self):
+        predictor = FakePredictor()
+        batcher = MicroBatcher(predictor, max_batch_size=3, max_latency_ms=50, bucket_width=100)
+        lines = [json.dumps({'qid': qid, 'length': 50 if qid % 2 else 250}) for qid in range(8)]
+        output = io.StringIO()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(serve_lines(batcher, lines, output))
+        finally:
+            loop.close()
+
+        assert [json.loads(line)['query_id'] for line in output.getvalue().splitlines()] == list(range(8))
+        # full batches first, then the rest of every bucket after the deadline
+        assert sorted(predictor.batches) == [[0, 2, 4], [1, 3, 5], [6], [7]]
+        report = batcher.stats.report()
+        assert report['requests'] == 8 and report['batches'] == 4
+        assert report['batch_fill_rate'] == 8 / 4 / 3
+        assert report['latency_p50_ms'] <= report['latency_p99_ms']
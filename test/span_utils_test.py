@@ -0,0 +1,56 @@
+# encoding: utf-8
+import random
+
+from allennlp.common.testing import AllenNlpTestCase
+
+from src.scripts.span_utils import TokenOffsetIndex
+
+
+def linear_scan(token_offsets, character_span):
+    """ The former ``char_span_to_token_span`` of the readers and scripts. """
+    error = False
+    start_index = 0
+    while start_index < len(token_offsets) and token_offsets[start_index][0] < character_span[0]:
+        start_index += 1
+    if start_index == len(token_offsets) or token_offsets[start_index][0] > character_span[0]:
+        start_index -= 1
+    if token_offsets[start_index][0] != character_span[0]:
+        error = True
+    end_index = start_index
+    while end_index < len(token_offsets) and token_offsets[end_index][1] < character_span[1]:
+        end_index += 1
+    if end_index == len(token_offsets):
+        end_index -= 1
+    if token_offsets[end_index][1] != character_span[1]:
+        error = True
+    return (start_index, end_index), error
+
+
+class TestTokenOffsetIndex(AllenNlpTestCase):
+    def test_matches_linear_scan(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            token_offsets = []
+            position = rng.randint(0, 3)
+            for _ in range(rng.randint(1, 12)):
+                length = rng.randint(0, 4)
+                token_offsets.append((position, position + length))
+                position += length + rng.randint(0, 2)
+            if rng.random() < 0.2:
+                rng.shuffle(token_offsets)
+            character_spans = [tuple(sorted((rng.randint(0, position + 3), rng.randint(0, position + 3))))
+                               for _ in range(5)]
+            offset_index = TokenOffsetIndex(token_offsets)
+            for character_span, token_span in zip(character_spans, offset_index.token_spans(character_spans)):
+                expected = linear_scan(token_offsets, character_span)
+                assert offset_index.token_span(character_span) == expected
+                if character_span[1] > token_offsets[-1][1]:
+                    assert token_span is None
+                else:
+                    assert token_span == expected
+
+    def test_spans(self):
+        # "the average cost is 4,625"
+        offset_index = TokenOffsetIndex([(0, 3), (4, 11), (12, 16), (17, 19), (20, 25)])
+        assert offset_index.token_spans([(4, 16), (5, 16), (20, 26)]) == [((1, 2), False), ((1, 2), True), None]
+        assert TokenOffsetIndex([]).token_spans([(0, 1)]) == [None]
@@ -1,15 +1,34 @@
-# encoding: utf-8
-
-# export PYTHONPATH=/home/meelfy/working/msmarco/:$PYTHONPATH
-from allennlp.common.testing import ModelTestCase
-from src.msmarco_reader import MsmarcoMultiPassageReader
-from src.vnet import VNet
-
-class VnetTest(ModelTestCase):
-    def setUp(self):
-        super(VnetTest, self).setUp()
-        self.set_up_model('./vnet.jsonnet',
-                          '../fixtures/small_samples.json')
-
-    def test_model_can_train_save_and_load(self):
-        self.ensure_model_can_train_save_and_load(self.param_file)
+# encoding: utf-8
+
+# export PYTHONPATH=/home/meelfy/working/msmarco/:$PYTHONPATH
+import torch
+from allennlp.common.testing import AllenNlpTestCase, ModelTestCase
+from src.msmarco_reader import MsmarcoMultiPassageReader
+from src.vnet import VNet
+
+class VnetTest(ModelTestCase):
+    def setUp(self):
+        super(VnetTest, self).setUp()
+        self.set_up_model('./vnet.jsonnet',
+                          '../fixtures/small_samples.json')
+
+    def test_model_can_train_save_and_load(self):
+        self.ensure_model_can_train_save_and_load(self.param_file)
+
+
+class SpanDecoderTest(AllenNlpTestCase):
+    def test_top_k_spans_match_the_band_search(self):
+        torch.manual_seed(0)
+        span_start_probs, span_end_probs, content = torch.rand(3, 2, 3, 30).unbind(0)
+        # a padding passage, whose spans all score 0
+        span_start_probs[1, 1] = 0
+        passages_verify = torch.rand(2, 3)
+        spans, scores = VNet.get_top_k_spans(span_start_probs, span_end_probs, content, passages_verify, 5)
+        banded_spans, banded_scores = VNet.get_top_k_spans_banded(span_start_probs, span_end_probs, content,
+                                                                  passages_verify, 30, 5)
+        assert spans.tolist() == banded_spans.tolist()
+        assert torch.allclose(scores, banded_scores)
+        assert spans[:, 0].tolist() == VNet.get_best_span(span_start_probs, span_end_probs, content,
+                                                          passages_verify).tolist()
+        all_spans, _ = VNet.get_top_k_spans(span_start_probs, span_end_probs, content, passages_verify, 90)
+        assert (all_spans[:, :, 2] >= all_spans[:, :, 1]).all()